@@ -62,7 +62,7 @@ def create_app(config_name=None):
         app.logger.info('IPAM Platform startup')
     
     # Register blueprints
-    from app.routes import auth, main, subnets, customers, assignments, reports
+    from app.routes import auth, main, subnets, customers, assignments, reports, api
     
     app.register_blueprint(auth.bp)
     app.register_blueprint(main.bp)
@@ -70,6 +70,10 @@ def create_app(config_name=None):
     app.register_blueprint(customers.bp)
     app.register_blueprint(assignments.bp)
     app.register_blueprint(reports.bp)
+    app.register_blueprint(api.bp)
+    # The JSON API authenticates by session and only changes state for JSON
+    # bodies, which cross-site forms cannot send
+    csrf.exempt(api.bp)
     
     # Register error handlers
     from app import errors
@@ -77,6 +81,10 @@ def create_app(config_name=None):
     app.register_error_handler(500, errors.internal_error)
     app.register_error_handler(403, errors.forbidden_error)
     
+    # Batched audit log writer
+    from app.utils import audit
+    audit.init_app(app)
+    
     # Register CLI commands
     from app import cli
     cli.register(app)
@@ -3,6 +3,22 @@ import click
 from flask.cli import with_appcontext
 
 
+def job_user_id(username=None):
+    """Id of the user a batch job's audit entries are recorded for.
+    
+    Defaults to the first active admin; an unknown username is an error.
+    """
+    from app.models import User
+    
+    if username:
+        user = User.query.filter_by(username=username).first()
+        if user is None:
+            raise click.BadParameter(f'unknown user {username}', param_hint='--user')
+    else:
+        user = User.query.filter_by(is_admin=True, is_active=True).order_by(User.id).first()
+    return user.id if user else None
+
+
 def register(app):
     """Register CLI commands."""
     
@@ -19,6 +35,9 @@ def register(app):
             
         click.echo('Creating database tables...')
         db.create_all()
+        
+        from app.utils.audit_storage import ensure_audit_partitions
+        ensure_audit_partitions()
         click.echo('Database initialized!')
     
     @app.cli.command()
@@ -49,3 +68,264 @@ def register(app):
         db.session.commit()
         
         click.echo(f'Admin user {username} created!')
+    
+    @app.cli.command()
+    @click.option('--batch-size', default=5000, show_default=True,
+                  help='Rows backfilled per UPDATE batch')
+    @with_appcontext
+    def upgrade_subnet_storage(batch_size):
+        """Add missing subnet columns and backfill the cidr/integer range columns."""
+        from sqlalchemy import bindparam, inspect, select, text
+        from sqlalchemy.exc import IntegrityError
+        from sqlalchemy.schema import AddConstraint, CreateIndex
+        from app import db
+        from app.models import Subnet, invalidate_subnet_lookups, network_columns
+        from app.utils.network import rebuild_subnet_counters
+        
+        table = Subnet.__table__
+        dialect = db.engine.dialect
+        existing = {column['name'] for column in inspect(db.engine).get_columns('subnets')}
+        
+        with db.engine.begin() as conn:
+            for column in table.columns:
+                if column.name not in existing:
+                    column_type = column.type.compile(dialect=dialect)
+                    conn.execute(text(f'ALTER TABLE subnets ADD COLUMN {column.name} {column_type}'))
+                    click.echo(f'Added column subnets.{column.name}')
+        
+        update = table.update().where(table.c.id == bindparam('b_id')).values(
+            network_cidr=bindparam('network_cidr'),
+            ip_version=bindparam('ip_version'),
+            range_start=bindparam('range_start'),
+            range_end=bindparam('range_end'),
+        )
+        pending = select(table.c.id, table.c.network_address, table.c.prefix_length).where(
+            table.c.ip_version.is_(None), table.c.id > bindparam('last_id')
+        ).order_by(table.c.id).limit(batch_size)
+        
+        backfilled = 0
+        last_id = 0
+        while True:
+            with db.engine.begin() as conn:
+                rows = conn.execute(pending, {'last_id': last_id}).all()
+                if not rows:
+                    break
+                conn.execute(update, [
+                    dict(network_columns(address, prefix), b_id=subnet_id)
+                    for subnet_id, address, prefix in rows
+                ])
+            last_id = rows[-1].id
+            backfilled += len(rows)
+        click.echo(f'Backfilled {backfilled} subnets')
+        
+        with db.engine.begin() as conn:
+            indexes = {index['name'] for index in inspect(conn).get_indexes('subnets')}
+            for index in table.indexes:
+                if index.name in indexes:
+                    continue
+                # Some backends do not reflect expression indexes
+                conn.execute(CreateIndex(index, if_not_exists=True))
+                click.echo(f'Created index {index.name}')
+        
+        if dialect.name == 'postgresql':
+            constraint = next(c for c in table.constraints
+                              if c.name == 'excl_subnet_sibling_overlap')
+            try:
+                with db.engine.begin() as conn:
+                    exists = conn.execute(
+                        text('SELECT 1 FROM pg_constraint WHERE conname = :name'),
+                        {'name': constraint.name}).first()
+                    if not exists:
+                        conn.execute(AddConstraint(constraint))
+                        click.echo(f'Created constraint {constraint.name}')
+            except IntegrityError as e:
+                click.echo(f'Could not create {constraint.name}, '
+                           f'resolve overlapping sibling subnets first: {e.orig}', err=True)
+        
+        click.echo(f'Rebuilt utilization counters for {rebuild_subnet_counters()} subnets')
+        invalidate_subnet_lookups()
+        click.echo('Subnet storage upgraded!')
+    
+    @app.cli.command('rebuild-subnet-counters')
+    @with_appcontext
+    def rebuild_counters():
+        """Recompute the rolled-up subnet utilization counters."""
+        from app.utils.network import rebuild_subnet_counters
+        
+        click.echo(f'Rebuilt utilization counters for {rebuild_subnet_counters()} subnets')
+    
+    @app.cli.command('lookup-ips')
+    @click.argument('input_file', type=click.File('r'))
+    @click.option('--output', '-o', type=click.File('w'), default='-',
+                  help='CSV output file (default: stdout)')
+    @click.option('--chunk-size', type=int, default=None,
+                  help='Addresses resolved per batch')
+    @with_appcontext
+    def lookup_ips(input_file, output, chunk_size):
+        """Resolve each IP in a file (one per line) to its subnet and customer."""
+        import csv
+        from itertools import islice
+        from app.utils.network import get_ip_owner_details
+        from app.utils.prefix_lookup import prefix_table
+        
+        chunk_size = chunk_size or app.config['IP_LOOKUP_CHUNK']
+        writer = csv.writer(output)
+        writer.writerow(['ip', 'subnet_id', 'cidr', 'customer_id', 'customer'])
+        details = {}
+        resolved = unmatched = 0
+        lines = (line.strip() for line in input_file)
+        while True:
+            chunk = [ip for ip in islice(lines, chunk_size) if ip]
+            if not chunk:
+                break
+            owners, _ = prefix_table.lookup_many(chunk)
+            owners = owners.tolist()
+            missing = sorted({owner for owner in owners if owner >= 0} - details.keys())
+            details.update(get_ip_owner_details(missing))
+            
+            for ip, owner in zip(chunk, owners):
+                owner_details = details.get(owner)
+                if owner_details is None:
+                    unmatched += 1
+                    writer.writerow([ip, '', '', '', ''])
+                    continue
+                customer = owner_details['customer'] or {}
+                writer.writerow([ip, owner, owner_details['subnet']['cidr'],
+                                 customer.get('id', ''), customer.get('name', '')])
+            resolved += len(chunk)
+        click.echo(f'Resolved {resolved} addresses, {unmatched} without a subnet', err=True)
+    
+    @app.cli.command('fragmentation-report')
+    @click.option('--location', default=None, help='Only pools in this location')
+    @click.option('--min-index', type=float, default=0.0,
+                  help='Only pools at or above this fragmentation index')
+    @click.option('--limit', type=int, default=20, help='Pools to show')
+    @with_appcontext
+    def fragmentation_report(location, min_index, limit):
+        """Show the most fragmented pools and the merges that would help."""
+        from app.utils.network import get_fragmentation_report
+        
+        reports = get_fragmentation_report(location=location, min_fragmentation=min_index)
+        for report in reports[:limit]:
+            click.echo(f"{report['cidr']:<43} free {report['free_percent']:>6}% "
+                       f"in {report['free_block_count']} blocks, "
+                       f"largest {report['largest_free_block'] or '-'}, "
+                       f"index {report['fragmentation_index']}")
+            for merge in report['merges'][:3]:
+                click.echo(f"    merge {len(merge['subnet_ids'])} unused subnets "
+                           f"into {merge['cidr']}")
+        click.echo(f'{len(reports)} pools matched')
+    
+    @app.cli.command('compact-subnets')
+    @click.option('--subnet-id', type=int, multiple=True, help='Only these parents (repeatable)')
+    @click.option('--location', default=None, help='Only parents in this location')
+    @click.option('--mode', type=click.Choice(['merge', 'collapse']), default='merge',
+                  help='merge: join adjacent unused children; '
+                       'collapse: delete all children and restore the parent')
+    @click.option('--dry-run', is_flag=True, help='Only show what would change')
+    @with_appcontext
+    def compact_subnets_command(subnet_id, location, mode, dry_run):
+        """Fold unused (available, never assigned) child subnets back together."""
+        from app.utils.network import compact_subnets
+        
+        results = compact_subnets(subnet_ids=list(subnet_id) or None, mode=mode,
+                                  dry_run=dry_run, location=location)
+        removed = 0
+        for result in results:
+            if 'error' in result:
+                click.echo(f"{result['cidr']}: skipped, {result['error']}")
+                continue
+            removed += len(result['removed_subnet_ids'])
+            action = 'restored' if result['collapsed'] else \
+                f"merged into {', '.join(result['created']) or 'virtual children'}"
+            click.echo(f"{result['cidr']}: {len(result['removed_subnet_ids'])} subnets {action}")
+        prefix = 'Would remove' if dry_run else 'Removed'
+        click.echo(f'{prefix} {removed} subnets under {len(results)} parents')
+    
+    @app.cli.command('audit-partitions')
+    @click.option('--months-ahead', type=int, default=3,
+                  help='Months after the current one to create partitions for')
+    @with_appcontext
+    def audit_partitions(months_ahead):
+        """Partition the audit log by month (PostgreSQL) and add upcoming months."""
+        from app.utils.audit_storage import ensure_audit_partitions
+        
+        created = ensure_audit_partitions(months_ahead)
+        for name in created:
+            click.echo(f'Created {name}')
+        click.echo(f'{len(created)} audit log partitions created')
+    
+    @app.cli.command('archive-audit-log')
+    @click.option('--older-than', type=int, default=12, show_default=True,
+                  help='Archive whole months older than this many months')
+    @click.option('--output-dir', type=click.Path(file_okay=False), default='archive',
+                  show_default=True, help='Directory for the .ndjson.gz files')
+    @click.option('--dry-run', is_flag=True, help='Only count the rows per month')
+    @with_appcontext
+    def archive_audit_log(older_than, output_dir, dry_run):
+        """Move old audit log months to compressed NDJSON files and drop them."""
+        from app.utils.audit_storage import archive_audit_logs
+        
+        results = archive_audit_logs(older_than, output_dir, dry_run=dry_run)
+        for result in results:
+            target = result['file'] or 'dry run'
+            click.echo(f"{result['month']}: {result['rows']} entries -> {target}")
+        click.echo(f'{sum(result["rows"] for result in results)} audit entries '
+                   f'{"would be " if dry_run else ""}archived')
+    
+    @app.cli.command('refresh-exchange-rates')
+    @click.option('--url', default=None, help='Provider URL (default: EXCHANGE_RATE_API_URL)')
+    @with_appcontext
+    def refresh_rates(url):
+        """Fetch current exchange rates and record them in the rate history."""
+        from app.utils.exchange_rates import refresh_exchange_rates
+        
+        for rate in refresh_exchange_rates(url=url):
+            click.echo(f"{rate['from_currency']}/{rate['to_currency']}: {rate['rate']} "
+                       f"({rate['effective_date']})")
+    
+    @app.cli.command('expire-assignments')
+    @click.option('--batch-size', type=int, default=1000, show_default=True,
+                  help='Assignments expired per UPDATE and transaction')
+    @click.option('--user', 'username', default=None,
+                  help='User the audit summary is recorded for (default: first admin)')
+    @click.option('--dry-run', is_flag=True, help='Only count the overdue assignments')
+    @with_appcontext
+    def expire_overdue_assignments(batch_size, username, dry_run):
+        """Expire overdue active assignments and release their subnets."""
+        from app.utils.assignments import expire_assignments
+        
+        user_id = job_user_id(username)
+        result = expire_assignments(batch_size=batch_size, dry_run=dry_run,
+                                    user_id=user_id)
+        verb = 'would be' if dry_run else 'were'
+        click.echo(f"{result['expired']} assignments {verb} expired, "
+                   f"{result['released_subnets']} subnets released "
+                   f"(ending before {result['today']})")
+    
+    @app.cli.command('renew-assignments')
+    @click.option('--lookahead-days', type=int, default=None,
+                  help='Renew assignments ending within this many days '
+                       '(default: ASSIGNMENT_RENEWAL_LOOKAHEAD_DAYS)')
+    @click.option('--months', type=int, default=None,
+                  help='Renewal term in months (default: ASSIGNMENT_RENEWAL_MONTHS)')
+    @click.option('--currency', type=click.Choice(['USD', 'EUR', 'TRY']), default=None,
+                  help='Reprice renewed assignments into this currency')
+    @click.option('--batch-size', type=int, default=500, show_default=True,
+                  help='Assignments renewed per UPDATE and transaction')
+    @click.option('--user', 'username', default=None,
+                  help='User the audit summary is recorded for (default: first admin)')
+    @click.option('--dry-run', is_flag=True, help='Only count the assignments due')
+    @with_appcontext
+    def renew_due_assignments(lookahead_days, months, currency, batch_size, username, dry_run):
+        """Extend auto-renew assignments that end within the lookahead window."""
+        from app.utils.assignments import renew_assignments
+        
+        user_id = job_user_id(username)
+        result = renew_assignments(lookahead_days, months, currency, batch_size,
+                                   dry_run=dry_run, user_id=user_id)
+        verb = 'would be' if dry_run else 'were'
+        click.echo(f"{result['renewed']} assignments ending by {result['horizon']} {verb} renewed "
+                   f"({result['repriced']} repriced, {result['skipped']} changed meanwhile) "
+                   f"in {result['batches']} batches, {result['seconds']}s, "
+                   f"{result['per_second']}/s")
@@ -1,21 +1,82 @@
 """Database models for the IPAM application."""
 import ipaddress
+import re
 from datetime import datetime
 from decimal import Decimal
 
-from flask import request
-from flask_login import UserMixin, current_user
-from sqlalchemy import event
+from flask import current_app
+from flask_login import UserMixin
+from sqlalchemy import case, cast, event, func, inspect, literal_column, select, update
+from sqlalchemy.dialects import postgresql
 from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.orm import make_transient_to_detached, object_session
+from sqlalchemy.orm.attributes import flag_modified
 from werkzeug.security import generate_password_hash, check_password_hash
 
 from app import db, login_manager
+from app.utils.interval_index import (MAX_PREFIX, NetworkRange, network_range, subnet_index,
+                                      subnet_table_stamp)
+from app.utils.exchange_rates import rate_cache
+from app.utils.prefix_lookup import prefix_table
+from app.utils.user_cache import user_cache
+
+
+class AddressInteger(db.TypeDecorator):
+    """Integer IP address that fits IPv6 on every backend.
+    
+    PostgreSQL stores it as NUMERIC(39, 0). Other backends (SQLite for
+    testing) use a zero-padded hex string, which keeps exact values and sorts
+    in numeric order so range comparisons and B-tree indexes still work.
+    """
+    impl = db.String(32)
+    cache_ok = True
+    
+    def load_dialect_impl(self, dialect):
+        if dialect.name == 'postgresql':
+            return dialect.type_descriptor(db.Numeric(39, 0))
+        return dialect.type_descriptor(db.String(32))
+    
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        if dialect.name == 'postgresql':
+            return Decimal(int(value))
+        return format(int(value), '032x')
+    
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        if dialect.name == 'postgresql':
+            return int(value)
+        return int(value, 16)
+
+
+class AddressCount(db.TypeDecorator):
+    """Address count as a Python int; NUMERIC(39, 0) holds a whole IPv6 space."""
+    impl = db.Numeric(39, 0)
+    cache_ok = True
+    
+    def process_bind_param(self, value, dialect):
+        return None if value is None else Decimal(int(value))
+    
+    def process_result_value(self, value, dialect):
+        return None if value is None else int(value)
 
 
 @login_manager.user_loader
 def load_user(user_id):
-    """Load user by ID for Flask-Login."""
-    return User.query.get(int(user_id))
+    """Load user by ID for Flask-Login.
+    
+    Served from the user cache for ``USER_CACHE_SECONDS``, so most requests
+    run no query. The user is a detached instance holding only the cached
+    columns; add it to the session before changing or lazy-loading it.
+    """
+    values = user_cache.load(int(user_id), current_app.config.get('USER_CACHE_SECONDS', 60))
+    if values is None:
+        return None
+    user = User(**values)
+    make_transient_to_detached(user)
+    return user
 
 
 class User(UserMixin, db.Model):
@@ -90,17 +151,45 @@ class Customer(db.Model):
         """Get active assignments for this customer."""
         return self.assignments.filter_by(status='active').all()
     
+    @classmethod
+    def assignment_totals(cls, customer_ids=None):
+        """Active assignment count and assigned IPs per customer id.
+        
+        One grouped query over assignments and subnet prefixes; the address
+        counts are summed in Python so IPv6 totals stay exact. Customers
+        without active assignments are absent from the result.
+        """
+        ip_version = func.coalesce(
+            Subnet.ip_version, case((Subnet.network_address.contains(':'), 6), else_=4))
+        query = db.session.query(
+            Assignment.customer_id, ip_version, Subnet.prefix_length, func.count(Assignment.id)
+        ).join(Subnet, Assignment.subnet_id == Subnet.id).filter(
+            Assignment.status == 'active'
+        ).group_by(Assignment.customer_id, ip_version, Subnet.prefix_length)
+        if customer_ids is not None:
+            query = query.filter(Assignment.customer_id.in_(customer_ids))
+        
+        totals = {}
+        for customer_id, version, prefix_length, count in query:
+            assignments, addresses = totals.get(customer_id, (0, 0))
+            totals[customer_id] = (assignments + count,
+                                   addresses + count * _subnet_size(version, prefix_length))
+        return totals
+    
     @property
     def total_assigned_ips(self):
         """Calculate total IPs assigned to this customer."""
-        total = 0
-        for assignment in self.active_assignments:
-            if assignment.subnet:
-                total += assignment.subnet.total_ips
-        return total
+        return self.assignment_totals([self.id]).get(self.id, (0, 0))[1]
     
-    def to_dict(self):
-        """Convert customer to dictionary."""
+    def to_dict(self, totals=None):
+        """Convert customer to dictionary.
+        
+        ``totals`` is this customer's ``(active assignments, assigned IPs)``
+        pair from ``assignment_totals``; list views pass it to avoid a query
+        per customer.
+        """
+        if totals is None:
+            totals = self.assignment_totals([self.id]).get(self.id, (0, 0))
         return {
             'id': self.id,
             'name': self.name,
@@ -112,9 +201,15 @@ class Customer(db.Model):
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None,
             'notes': self.notes,
-            'active_assignments_count': len(self.active_assignments),
-            'total_assigned_ips': self.total_assigned_ips
+            'active_assignments_count': totals[0],
+            'total_assigned_ips': totals[1]
         }
+    
+    @classmethod
+    def to_dict_list(cls, customers):
+        """Serialize customers with their totals from a single query."""
+        totals = cls.assignment_totals([customer.id for customer in customers])
+        return [customer.to_dict(totals.get(customer.id, (0, 0))) for customer in customers]
 
 
 class Subnet(db.Model):
@@ -133,16 +228,51 @@ class Subnet(db.Model):
     parent_subnet_id = db.Column(db.Integer, db.ForeignKey('subnets.id'))
     auto_subdivide = db.Column(db.Boolean, default=False)
     is_subdivided = db.Column(db.Boolean, default=False)
+    # Set when lazily subdivided: children of this prefix exist only virtually
+    # until one is first assigned or edited
+    virtual_child_prefix = db.Column(db.Integer)
+    
+    # Derived network columns, kept in sync with network_address/prefix_length
+    network_cidr = db.Column(db.String(49).with_variant(postgresql.CIDR(), 'postgresql'))
+    ip_version = db.Column(db.Integer)
+    range_start = db.Column(AddressInteger)
+    range_end = db.Column(AddressInteger)
+    
+    # Utilization counters rolled up from all descendants; maintained by the
+    # model events so reading any node's usage is a column read
+    assigned_ips = db.Column(AddressCount, default=0)
+    reserved_ips = db.Column(AddressCount, default=0)
+    free_ips = db.Column(AddressCount, default=0)
     
     # Relationships
     parent = db.relationship('Subnet', remote_side=[id], backref='children')
     assignments = db.relationship('Assignment', backref='subnet', lazy='dynamic',
                                  cascade='all, delete-orphan')
+    host_allocation = db.relationship('HostAllocation', backref='subnet', uselist=False,
+                                      cascade='all, delete-orphan')
     
     # Indexes
     __table_args__ = (
         db.Index('idx_subnet_network_prefix', 'network_address', 'prefix_length'),
+        # Keyset order of the subnet listing
+        db.Index('idx_subnet_network_id', 'network_address', 'id'),
         db.Index('idx_subnet_status', 'status'),
+        db.Index('idx_subnet_range', 'ip_version', 'range_start', 'prefix_length'),
+        db.Index('idx_subnet_parent', 'parent_subnet_id'),
+        # Siblings (subnets sharing a parent, or all roots) must not overlap;
+        # nested children inside their parent are the only allowed overlap.
+        # The parent id is compared as a single-point range so the built-in
+        # GiST range operators are enough, without the btree_gist extension.
+        # network_cidr leads so the constraint's GiST index also serves the
+        # &&, <<= and >>= lookups.
+        postgresql.ExcludeConstraint(
+            ('network_cidr', '&&'),
+            (literal_column("int4range(COALESCE(parent_subnet_id, 0), "
+                            "COALESCE(parent_subnet_id, 0), '[]')"), '&&'),
+            name='excl_subnet_sibling_overlap',
+            using='gist',
+            ops={'network_cidr': 'inet_ops'},
+        ).ddl_if(dialect='postgresql'),
     )
     
     def __repr__(self):
@@ -153,55 +283,83 @@ class Subnet(db.Model):
         """Get subnet in CIDR notation."""
         return f"{self.network_address}/{self.prefix_length}"
     
+    def sync_network_columns(self):
+        """Refresh the derived cidr and integer range columns."""
+        for key, value in range_columns(self.address_range).items():
+            setattr(self, key, value)
+    
+    @property
+    def address_range(self):
+        """Integer form of the network, cached until the address or prefix changes."""
+        key = (self.network_address, self.prefix_length)
+        cached = self.__dict__.get('_address_range_cache')
+        if cached is None or cached[0] != key:
+            cached = (key, network_range(*key), None)
+            self._address_range_cache = cached
+        return cached[1]
+    
     @property
     def network(self):
         """Get ipaddress network object."""
-        try:
-            return ipaddress.ip_network(self.cidr)
-        except ValueError:
+        rng = self.address_range
+        if rng is None:
             return None
+        key, _, network = self._address_range_cache
+        if network is None:
+            network = rng.network()
+            self._address_range_cache = (key, rng, network)
+        return network
     
     @property
     def total_ips(self):
         """Get total number of IPs in subnet."""
-        network = self.network
-        return network.num_addresses if network else 0
+        rng = self.address_range
+        return rng.num_addresses if rng else 0
     
     @property
     def usable_ips(self):
         """Get number of usable IPs (excluding network and broadcast)."""
-        network = self.network
-        if network and network.version == 4 and network.prefixlen < 31:
-            return network.num_addresses - 2
-        return self.total_ips
+        rng = self.address_range
+        return rng.usable_addresses if rng else 0
+    
+    @property
+    def virtual_children_count(self):
+        """Number of children of a lazily subdivided subnet, materialized or not."""
+        if not self.virtual_child_prefix:
+            return 0
+        return 1 << (self.virtual_child_prefix - self.prefix_length)
     
     @hybrid_property
     def utilization(self):
-        """Calculate subnet utilization percentage."""
-        if self.status != 'available' or not self.children:
-            return 100.0 if self.status == 'assigned' else 0.0
-        
-        assigned_ips = sum(child.total_ips for child in self.children 
-                          if child.status == 'assigned')
-        return (assigned_ips / self.total_ips * 100) if self.total_ips > 0 else 0.0
+        """Calculate subnet utilization percentage from the rolled-up counters."""
+        assigned_ips = self.assigned_ips or 0
+        total_ips = assigned_ips + (self.reserved_ips or 0) + (self.free_ips or 0)
+        return (assigned_ips / total_ips * 100) if total_ips > 0 else 0.0
+    
+    @utilization.expression
+    def utilization(cls):
+        """SQL form of utilization so filters, sorting and top-N run in the database."""
+        assigned_ips = cast(func.coalesce(cls.assigned_ips, 0), db.Float)
+        total_ips = cast(func.coalesce(cls.assigned_ips, 0) + func.coalesce(cls.reserved_ips, 0)
+                         + func.coalesce(cls.free_ips, 0), db.Float)
+        return func.coalesce(assigned_ips * 100 / func.nullif(total_ips, 0), 0.0)
     
     def overlaps_with(self, other_cidr):
         """Check if this subnet overlaps with another CIDR."""
-        try:
-            this_network = self.network
-            other_network = ipaddress.ip_network(other_cidr)
-            return this_network.overlaps(other_network)
-        except ValueError:
+        this_range = self.address_range
+        other_range = NetworkRange.from_cidr(other_cidr)
+        if this_range is None or other_range is None:
             return False
+        return this_range.overlaps(other_range)
     
     def contains(self, ip_address):
         """Check if IP address is within this subnet."""
+        rng = self.address_range
         try:
-            network = self.network
             ip = ipaddress.ip_address(ip_address)
-            return ip in network
         except ValueError:
             return False
+        return rng is not None and rng.contains(int(ip), ip.version)
     
     def to_dict(self):
         """Convert subnet to dictionary."""
@@ -219,11 +377,190 @@ class Subnet(db.Model):
             'utilization': round(self.utilization, 2),
             'parent_subnet_id': self.parent_subnet_id,
             'is_subdivided': self.is_subdivided,
+            'virtual_child_prefix': self.virtual_child_prefix,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
 
 
+# Expression index so utilization filters and top-N sorts avoid a full scan
+db.Index('idx_subnet_utilization', Subnet.utilization)
+
+
+def network_columns(network_address, prefix_length):
+    """Derived column values for a subnet, also used by bulk inserts."""
+    return range_columns(network_range(network_address, prefix_length))
+
+
+def range_columns(rng):
+    """Derived column values for an already parsed NetworkRange."""
+    if rng is None:
+        return {'network_cidr': None, 'ip_version': None,
+                'range_start': None, 'range_end': None}
+    return {
+        'network_cidr': str(rng),
+        'ip_version': rng.version,
+        'range_start': rng.start,
+        'range_end': rng.end,
+    }
+
+
+class HostAllocation(db.Model):
+    """Per-subnet host allocation bitmap, one bit per address.
+    
+    Bit ``i`` stands for the address at offset ``i`` from the network address;
+    the network and broadcast addresses of IPv4 subnets are pre-set. A /16
+    costs 8 KB in a single row. ``allocated_count`` makes counting free hosts
+    O(1) and ``next_free`` (the lowest clear bit) makes allocate-next O(1)
+    except for the forward scan after handing it out.
+    """
+    __tablename__ = 'host_allocations'
+    
+    # Largest bitmap kept per subnet: 2^24 addresses (2 MB), e.g. an IPv4 /8
+    MAX_HOST_BITS = 24
+    
+    id = db.Column(db.Integer, primary_key=True)
+    subnet_id = db.Column(db.Integer, db.ForeignKey('subnets.id'), nullable=False, unique=True)
+    bitmap = db.Column(db.LargeBinary, nullable=False)
+    size = db.Column(db.Integer, nullable=False)
+    usable = db.Column(db.Integer, nullable=False)
+    allocated_count = db.Column(db.Integer, nullable=False, default=0)
+    next_free = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime(timezone=True), default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<HostAllocation subnet {self.subnet_id}: {self.allocated_count}/{self.usable}>'
+    
+    @classmethod
+    def for_subnet(cls, subnet, lock=False):
+        """Get the allocation map of a subnet, creating it on first use.
+        
+        With ``lock`` the row is selected FOR UPDATE so concurrent allocators
+        serialize on it.
+        """
+        query = cls.query.filter_by(subnet_id=subnet.id)
+        if lock:
+            query = query.with_for_update()
+        host_map = query.first()
+        if host_map:
+            return host_map
+        
+        rng = subnet.address_range
+        if rng is None:
+            raise ValueError(f'Invalid subnet {subnet.cidr}')
+        if rng.num_addresses > 1 << cls.MAX_HOST_BITS:
+            raise ValueError(f'{subnet.cidr} is too large for a host allocation map')
+        
+        size = rng.num_addresses
+        bitmap = bytearray((size + 7) // 8)
+        if rng.version == 4 and rng.prefix_length < 31:
+            # Network and broadcast addresses are never handed out
+            bitmap[0] |= 1
+            bitmap[(size - 1) >> 3] |= 1 << ((size - 1) & 7)
+            next_free = 1
+        else:
+            next_free = 0
+        
+        host_map = cls(subnet=subnet, bitmap=bytes(bitmap), size=size,
+                       usable=subnet.usable_ips, allocated_count=0, next_free=next_free)
+        db.session.add(host_map)
+        return host_map
+    
+    @property
+    def free_count(self):
+        """Number of unallocated usable hosts."""
+        return self.usable - self.allocated_count
+    
+    def _offset(self, ip_address):
+        try:
+            offset = int(ipaddress.ip_address(ip_address)) - self.subnet.address_range.start
+        except (ValueError, TypeError):
+            return None
+        return offset if 0 <= offset < self.size else None
+    
+    def _address(self, offset):
+        rng = self.subnet.address_range
+        return rng.address(rng.start + offset)
+    
+    def is_allocated(self, ip_address):
+        """Check if an address is allocated (or not allocatable)."""
+        offset = self._offset(ip_address)
+        return offset is None or bool(self.bitmap[offset >> 3] & (1 << (offset & 7)))
+    
+    def _writable_bitmap(self):
+        """The bitmap as a bytearray changed in place, copied once per load."""
+        if isinstance(self.bitmap, bytearray):
+            flag_modified(self, 'bitmap')
+        else:
+            self.bitmap = bytearray(self.bitmap)
+        return self.bitmap
+    
+    def _set(self, bitmap, offset, used):
+        if used:
+            bitmap[offset >> 3] |= 1 << (offset & 7)
+        else:
+            bitmap[offset >> 3] &= ~(1 << (offset & 7))
+    
+    def _scan_free(self, bitmap, offset):
+        """Lowest clear bit at or after ``offset``, or ``size`` when full."""
+        byte_index = offset >> 3
+        byte = bitmap[byte_index] | ((1 << (offset & 7)) - 1)
+        if byte == 0xFF:
+            # Skip whole runs of full bytes at C speed
+            byte_index = _first_non_full_byte(bitmap, byte_index + 1)
+            if byte_index < 0:
+                return self.size
+            byte = bitmap[byte_index]
+        offset = (byte_index << 3) + ((~byte & (byte + 1)).bit_length() - 1)
+        return min(offset, self.size)
+    
+    def allocate_next(self):
+        """Allocate the lowest free address, returning it or None when full."""
+        if self.next_free >= self.size:
+            return None
+        bitmap = self._writable_bitmap()
+        offset = self.next_free
+        self._set(bitmap, offset, True)
+        self.next_free = self._scan_free(bitmap, offset)
+        self.allocated_count += 1
+        return self._address(offset)
+    
+    def allocate(self, ip_address):
+        """Allocate a specific address; False if taken or outside the subnet."""
+        if self.is_allocated(ip_address):
+            return False
+        offset = self._offset(ip_address)
+        bitmap = self._writable_bitmap()
+        self._set(bitmap, offset, True)
+        if offset == self.next_free:
+            self.next_free = self._scan_free(bitmap, offset)
+        self.allocated_count += 1
+        return True
+    
+    def release(self, ip_address):
+        """Release an allocated address; False if it was not allocated."""
+        offset = self._offset(ip_address)
+        if offset is None or not self.is_allocated(ip_address):
+            return False
+        rng = self.subnet.address_range
+        if rng.version == 4 and rng.prefix_length < 31 and offset in (0, self.size - 1):
+            return False
+        bitmap = self._writable_bitmap()
+        self._set(bitmap, offset, False)
+        self.next_free = min(self.next_free, offset)
+        self.allocated_count -= 1
+        return True
+
+
+_NON_FULL_BYTE = re.compile(b'[^\xff]')
+
+
+def _first_non_full_byte(bitmap, start):
+    """Index of the first byte that is not 0xFF from ``start``, or -1."""
+    match = _NON_FULL_BYTE.search(bitmap, start)
+    return match.start() if match else -1
+
+
 class Assignment(db.Model):
     """Assignment model for subnet-customer assignments."""
     __tablename__ = 'assignments'
@@ -268,7 +605,11 @@ class Assignment(db.Model):
         return None
     
     def update_status(self):
-        """Update assignment status based on dates."""
+        """Update assignment status based on dates.
+        
+        Handles a single assignment; ``flask expire-assignments`` expires all
+        overdue ones with set-based updates.
+        """
         if self.is_expired and self.status == 'active':
             self.status = 'expired'
             if self.subnet:
@@ -315,17 +656,13 @@ class ExchangeRate(db.Model):
         return f'<ExchangeRate {self.from_currency}/{self.to_currency}: {self.rate}>'
     
     @classmethod
-    def get_rate(cls, from_currency, to_currency):
-        """Get exchange rate between two currencies."""
-        if from_currency == to_currency:
-            return Decimal('1.0')
+    def get_rate(cls, from_currency, to_currency, as_of=None):
+        """Get exchange rate between two currencies, optionally as of a date.
         
-        rate = cls.query.filter_by(
-            from_currency=from_currency,
-            to_currency=to_currency
-        ).first()
-        
-        return Decimal(str(rate.rate)) if rate else Decimal('1.0')
+        Served from the in-process rate cache, so repeated lookups do not
+        query the database.
+        """
+        return rate_cache.get_rate(from_currency, to_currency, as_of)
     
     def to_dict(self):
         """Convert exchange rate to dictionary."""
@@ -338,6 +675,38 @@ class ExchangeRate(db.Model):
         }
 
 
+class ExchangeRateHistory(db.Model):
+    """Exchange rate in effect from a given date, kept for as-of conversions."""
+    __tablename__ = 'exchange_rate_history'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    from_currency = db.Column(db.String(3), nullable=False)
+    to_currency = db.Column(db.String(3), nullable=False)
+    rate = db.Column(db.Numeric(12, 6), nullable=False)
+    effective_date = db.Column(db.Date, nullable=False)
+    created_at = db.Column(db.DateTime(timezone=True), default=datetime.utcnow)
+    
+    # Indexes
+    __table_args__ = (
+        db.UniqueConstraint('from_currency', 'to_currency', 'effective_date',
+                            name='uq_exchange_rate_history_pair_date'),
+    )
+    
+    def __repr__(self):
+        return (f'<ExchangeRateHistory {self.from_currency}/{self.to_currency} '
+                f'{self.effective_date}: {self.rate}>')
+    
+    def to_dict(self):
+        """Convert historical rate to dictionary."""
+        return {
+            'id': self.id,
+            'from_currency': self.from_currency,
+            'to_currency': self.to_currency,
+            'rate': float(self.rate),
+            'effective_date': self.effective_date.isoformat() if self.effective_date else None
+        }
+
+
 class AuditLog(db.Model):
     """Audit log model for tracking all system operations."""
     __tablename__ = 'audit_logs'
@@ -354,31 +723,27 @@ class AuditLog(db.Model):
     
     # Indexes
     __table_args__ = (
-        db.Index('idx_audit_timestamp', 'timestamp'),
-        db.Index('idx_audit_user', 'user_id'),
-        db.Index('idx_audit_entity', 'entity_type', 'entity_id'),
+        # Trailing (timestamp, id) serves keyset browsing with each filter
+        db.Index('idx_audit_timestamp', 'timestamp', 'id'),
+        db.Index('idx_audit_user', 'user_id', 'timestamp', 'id'),
+        db.Index('idx_audit_entity', 'entity_type', 'entity_id', 'timestamp', 'id'),
     )
     
     def __repr__(self):
         return f'<AuditLog {self.action} on {self.entity_type} by user {self.user_id}>'
     
     @classmethod
-    def log_action(cls, action, entity_type, entity_id=None, details=None):
-        """Create an audit log entry."""
-        if not current_user or not current_user.is_authenticated:
-            return
+    def log_action(cls, action, entity_type, entity_id=None, details=None, user_id=None):
+        """Create an audit log entry.
         
-        log = cls(
-            user_id=current_user.id,
-            action=action,
-            entity_type=entity_type,
-            entity_id=entity_id,
-            details=details,
-            ip_address=request.remote_addr if request else None,
-            user_agent=request.headers.get('User-Agent') if request else None
-        )
-        db.session.add(log)
-        db.session.commit()
+        The entry is written with the other entries of the transaction when
+        it commits, which happens right away. It belongs to ``user_id`` if
+        given, otherwise to the logged-in user.
+        """
+        from app.utils.audit import record_changes
+        
+        if record_changes(db.session, [(action, entity_type, entity_id, details)], user_id):
+            db.session.commit()
     
     def to_dict(self):
         """Convert audit log to dictionary."""
@@ -396,43 +761,371 @@ class AuditLog(db.Model):
         }
 
 
-# SQLAlchemy event listeners for audit logging
+# SQLAlchemy event listeners for audit logging. The mapper hooks only
+# collect (action, entity, id, details) tuples in the session; a single
+# after_flush listener turns each flush's changes into audit entries.
+AUDIT_CHANGES_KEY = 'audit_changes'
+AUDIT_SUMMARIZED_KEY = 'audit_summarized'
+
+
+def summarize_changes(session, entity_type, entity_ids):
+    """Leave the entities out of the next flush's audit entries.
+    
+    For bulk operations that record one summary entry of their own.
+    """
+    session.info.setdefault(AUDIT_SUMMARIZED_KEY, set()).update(
+        (entity_type, entity_id) for entity_id in entity_ids)
+
+
+def _collect_change(target, action, entity_type, details):
+    session = object_session(target) or db.session()
+    if (entity_type, target.id) in session.info.get(AUDIT_SUMMARIZED_KEY, ()):
+        return
+    session.info.setdefault(AUDIT_CHANGES_KEY, []).append(
+        (action, entity_type, target.id, details))
+
+
+@event.listens_for(db.session, 'after_flush')
+def emit_audit_changes(session, flush_context):
+    """Queue the audit entries of everything this flush wrote."""
+    session.info.pop(AUDIT_SUMMARIZED_KEY, None)
+    changes = session.info.pop(AUDIT_CHANGES_KEY, None)
+    if changes:
+        from app.utils.audit import record_changes
+        record_changes(session, changes)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def discard_audit_changes(session):
+    """Drop changes collected by a flush that failed."""
+    session.info.pop(AUDIT_SUMMARIZED_KEY, None)
+    session.info.pop(AUDIT_CHANGES_KEY, None)
+
+
 @event.listens_for(Customer, 'after_insert')
 def log_customer_insert(mapper, connection, target):
     """Log customer creation."""
-    @event.listens_for(db.session, 'after_flush', once=True)
-    def receive_after_flush(session, context):
-        AuditLog.log_action('create', 'customer', target.id, f'Created customer: {target.name}')
+    _collect_change(target, 'create', 'customer', f'Created customer: {target.name}')
 
 
 @event.listens_for(Customer, 'after_update')
 def log_customer_update(mapper, connection, target):
     """Log customer update."""
-    @event.listens_for(db.session, 'after_flush', once=True)
-    def receive_after_flush(session, context):
-        AuditLog.log_action('update', 'customer', target.id, f'Updated customer: {target.name}')
+    _collect_change(target, 'update', 'customer', f'Updated customer: {target.name}')
+
+
+@event.listens_for(Subnet, 'before_insert')
+@event.listens_for(Subnet, 'before_update')
+def sync_subnet_network_columns(mapper, connection, target):
+    """Keep the cidr and integer range columns in step with the address."""
+    target.sync_network_columns()
+
+
+def subnet_status_counts(status, total):
+    """(assigned, reserved) counters of a subnet without children."""
+    if status == 'assigned':
+        return total, 0
+    if status == 'reserved':
+        return 0, total
+    return 0, 0
+
+
+def _subnet_size(version, prefix_length):
+    if version is None or prefix_length is None:
+        return 0
+    return 1 << (MAX_PREFIX[version] - prefix_length)
+
+
+_COUNTER_FIELDS = ('status', 'parent_subnet_id', 'is_subdivided', 'network_address', 'prefix_length')
+
+
+def _propagate_subnet_counters(connection, target, parent_id, assigned, reserved, membership=None):
+    """Add counter deltas to a parent and all of its ancestors in one UPDATE.
+    
+    ``membership`` is ``'added'`` or ``'removed'`` when ``target`` joins or
+    leaves the parent. A parent that is not subdivided switches between
+    status-based counters and child sums when its first child arrives or its
+    last one leaves.
+    """
+    subnets = Subnet.__table__
+    parent = connection.execute(
+        select(subnets.c.is_subdivided, subnets.c.status, subnets.c.ip_version,
+               subnets.c.prefix_length, subnets.c.assigned_ips, subnets.c.reserved_ips)
+        .where(subnets.c.id == parent_id)
+    ).first()
+    if parent is None:
+        return
+    
+    if membership and not parent.is_subdivided:
+        has_siblings = connection.execute(
+            select(subnets.c.id).where(subnets.c.parent_subnet_id == parent_id,
+                                       subnets.c.id != target.id).limit(1)
+        ).first()
+        if not has_siblings:
+            if membership == 'added':
+                new_assigned, new_reserved = assigned, reserved
+            else:
+                total = _subnet_size(parent.ip_version, parent.prefix_length)
+                new_assigned, new_reserved = subnet_status_counts(parent.status, total)
+            assigned = new_assigned - (parent.assigned_ips or 0)
+            reserved = new_reserved - (parent.reserved_ips or 0)
+    
+    if not assigned and not reserved:
+        return
+    
+    chain = select(subnets.c.id, subnets.c.parent_subnet_id).where(
+        subnets.c.id == parent_id).cte('ancestors', recursive=True)
+    chain = chain.union_all(
+        select(subnets.c.id, subnets.c.parent_subnet_id).join(
+            chain, subnets.c.id == chain.c.parent_subnet_id)
+    )
+    ancestor_ids = connection.execute(select(chain.c.id)).scalars().all()
+    connection.execute(
+        update(subnets).where(subnets.c.id.in_(ancestor_ids)).values(
+            assigned_ips=subnets.c.assigned_ips + assigned,
+            reserved_ips=subnets.c.reserved_ips + reserved,
+            free_ips=subnets.c.free_ips - assigned - reserved,
+        )
+    )
+    
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault('stale_subnet_counters', set()).update(ancestor_ids)
+
+
+@event.listens_for(Subnet, 'before_insert')
+def init_subnet_counters(mapper, connection, target):
+    """Start a new subnet's counters from its own status."""
+    total = _subnet_size(target.ip_version, target.prefix_length)
+    if target.is_subdivided:
+        assigned, reserved = 0, 0
+    else:
+        assigned, reserved = subnet_status_counts(target.status or 'available', total)
+    target.assigned_ips = assigned
+    target.reserved_ips = reserved
+    target.free_ips = total - assigned - reserved
+
+
+@event.listens_for(Subnet, 'after_insert')
+def add_subnet_counters(mapper, connection, target):
+    """Roll a new subnet's counters up into its ancestors."""
+    if target.parent_subnet_id:
+        _propagate_subnet_counters(connection, target, target.parent_subnet_id,
+                                   target.assigned_ips, target.reserved_ips, 'added')
+
+
+@event.listens_for(Subnet, 'before_update')
+def refresh_subnet_counters(mapper, connection, target):
+    """Recompute a subnet's counters when its status, size or place changes."""
+    state = inspect(target)
+    if not any(state.attrs[key].history.has_changes() for key in _COUNTER_FIELDS):
+        return
+    
+    subnets = Subnet.__table__
+    # Read the stored values: other rows' events may have moved them this flush
+    old = connection.execute(
+        select(subnets.c.parent_subnet_id, subnets.c.assigned_ips, subnets.c.reserved_ips)
+        .where(subnets.c.id == target.id)
+    ).first()
+    
+    total = _subnet_size(target.ip_version, target.prefix_length)
+    children = connection.execute(
+        select(func.count(), func.sum(subnets.c.assigned_ips), func.sum(subnets.c.reserved_ips))
+        .where(subnets.c.parent_subnet_id == target.id)
+    ).first()
+    if target.is_subdivided or children[0]:
+        assigned, reserved = int(children[1] or 0), int(children[2] or 0)
+    else:
+        assigned, reserved = subnet_status_counts(target.status, total)
+    
+    target.assigned_ips = assigned
+    target.reserved_ips = reserved
+    target.free_ips = total - assigned - reserved
+    target._counter_previous = old
+
+
+@event.listens_for(Subnet, 'after_update')
+def move_subnet_counters(mapper, connection, target):
+    """Apply a subnet's counter change to its old and new ancestors."""
+    old = target.__dict__.pop('_counter_previous', None)
+    if old is None:
+        return
+    
+    old_assigned, old_reserved = old.assigned_ips or 0, old.reserved_ips or 0
+    if old.parent_subnet_id == target.parent_subnet_id:
+        if target.parent_subnet_id:
+            _propagate_subnet_counters(connection, target, target.parent_subnet_id,
+                                       target.assigned_ips - old_assigned,
+                                       target.reserved_ips - old_reserved)
+        return
+    
+    if old.parent_subnet_id:
+        _propagate_subnet_counters(connection, target, old.parent_subnet_id,
+                                   -old_assigned, -old_reserved, 'removed')
+    if target.parent_subnet_id:
+        _propagate_subnet_counters(connection, target, target.parent_subnet_id,
+                                   target.assigned_ips, target.reserved_ips, 'added')
+
+
+@event.listens_for(Subnet, 'after_delete')
+def remove_subnet_counters(mapper, connection, target):
+    """Take a deleted subnet's counters out of its ancestors."""
+    if target.parent_subnet_id:
+        _propagate_subnet_counters(connection, target, target.parent_subnet_id,
+                                   -(target.assigned_ips or 0), -(target.reserved_ips or 0),
+                                   'removed')
+
+
+@event.listens_for(db.session, 'after_flush_postexec')
+def expire_subnet_counters(session, flush_context):
+    """Reload ancestor counters that were updated behind the ORM's back."""
+    stale_ids = session.info.pop('stale_subnet_counters', None)
+    if not stale_ids:
+        return
+    # Match on the identity key: reading ``obj.id`` would reload expired
+    # instances, which fails for rows removed by bulk deletes
+    for key, obj in list(session.identity_map.items()):
+        if isinstance(obj, Subnet) and key[1][0] in stale_ids:
+            session.expire(obj, ['assigned_ips', 'reserved_ips', 'free_ips'])
+
+
+# In-memory lookup structures mirroring the subnets table
+SUBNET_LOOKUPS = (subnet_index, prefix_table)
+
+
+def invalidate_subnet_lookups():
+    """Drop the in-memory subnet lookups so they reload from the database."""
+    for lookup in SUBNET_LOOKUPS:
+        lookup.invalidate()
+
+
+def _update_subnet_lookups(target, deleted=False):
+    """Apply one subnet change to the in-memory lookups."""
+    _track_subnet_index(target)
+    for lookup in SUBNET_LOOKUPS:
+        if deleted:
+            lookup.discard(target.id)
+        else:
+            lookup.upsert(target.id, target.network_address, target.prefix_length)
+
+
+def _track_subnet_index(target):
+    """Remember that this transaction changed the in-memory subnet lookups."""
+    session = object_session(target)
+    if session is not None:
+        session.info['subnet_index_dirty'] = True
+
+
+def _writes_subnets(session) -> bool:
+    return any(isinstance(obj, Subnet)
+               for objects in (session.new, session.dirty, session.deleted) for obj in objects)
+
+
+@event.listens_for(db.session, 'before_flush')
+def stamp_before_subnet_writes(session, flush_context, instances):
+    """Stamp the subnets table before this transaction first writes to it."""
+    if not any(lookup.loaded for lookup in SUBNET_LOOKUPS) or not _writes_subnets(session):
+        return
+    session.info['subnet_flush'] = True
+    if 'subnet_stamps' not in session.info:
+        stamp = subnet_table_stamp(session)
+        session.info['subnet_stamps'] = (stamp, stamp)
+
+
+@event.listens_for(db.session, 'after_flush_postexec')
+def stamp_after_subnet_writes(session, flush_context):
+    """Stamp the subnets table again once the flush has written to it."""
+    if session.info.pop('subnet_flush', None):
+        before, _ = session.info['subnet_stamps']
+        session.info['subnet_stamps'] = (before, subnet_table_stamp(session))
+
+
+@event.listens_for(db.session, 'after_commit')
+def clear_subnet_index_flag(session):
+    """Committed index changes are final.
+    
+    The lookups already hold them, so their stamps move forward to the
+    committed state instead of forcing a reload of the whole table.
+    """
+    session.info.pop('subnet_index_dirty', None)
+    stamps = session.info.pop('subnet_stamps', None)
+    if stamps is not None:
+        for lookup in SUBNET_LOOKUPS:
+            lookup.stamp.advance(*stamps)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def invalidate_subnet_index(session):
+    """Rebuild the subnet lookups if a rolled back flush had touched them."""
+    session.info.pop('subnet_flush', None)
+    session.info.pop('subnet_stamps', None)
+    if session.info.pop('subnet_index_dirty', None):
+        invalidate_subnet_lookups()
 
 
 @event.listens_for(Subnet, 'after_insert')
 def log_subnet_insert(mapper, connection, target):
     """Log subnet creation."""
-    @event.listens_for(db.session, 'after_flush', once=True)
-    def receive_after_flush(session, context):
-        AuditLog.log_action('create', 'subnet', target.id, f'Created subnet: {target.cidr}')
+    _update_subnet_lookups(target)
+    _collect_change(target, 'create', 'subnet', f'Created subnet: {target.cidr}')
 
 
 @event.listens_for(Subnet, 'after_update')
 def log_subnet_update(mapper, connection, target):
     """Log subnet update."""
-    @event.listens_for(db.session, 'after_flush', once=True)
-    def receive_after_flush(session, context):
-        AuditLog.log_action('update', 'subnet', target.id, f'Updated subnet: {target.cidr}')
+    _update_subnet_lookups(target)
+    _collect_change(target, 'update', 'subnet', f'Updated subnet: {target.cidr}')
+
+
+@event.listens_for(Subnet, 'after_delete')
+def remove_deleted_subnet(mapper, connection, target):
+    """Drop deleted subnets from the in-memory lookups."""
+    _update_subnet_lookups(target, deleted=True)
 
 
 @event.listens_for(Assignment, 'after_insert')
 def log_assignment_insert(mapper, connection, target):
     """Log assignment creation."""
-    @event.listens_for(db.session, 'after_flush', once=True)
-    def receive_after_flush(session, context):
-        AuditLog.log_action('create', 'assignment', target.id, 
-                           f'Assigned subnet {target.subnet_id} to customer {target.customer_id}')
+    _collect_change(target, 'create', 'assignment',
+                    f'Assigned subnet {target.subnet_id} to customer {target.customer_id}')
+
+
+@event.listens_for(ExchangeRate, 'after_insert')
+@event.listens_for(ExchangeRate, 'after_update')
+@event.listens_for(ExchangeRate, 'after_delete')
+@event.listens_for(ExchangeRateHistory, 'after_insert')
+@event.listens_for(ExchangeRateHistory, 'after_update')
+@event.listens_for(ExchangeRateHistory, 'after_delete')
+def invalidate_rate_cache(mapper, connection, target):
+    """Reload cached exchange rates after any rate change."""
+    rate_cache.invalidate()
+    session = object_session(target)
+    if session is not None:
+        session.info['rate_cache_dirty'] = True
+
+
+@event.listens_for(db.session, 'after_commit')
+@event.listens_for(db.session, 'after_rollback')
+def reload_rate_cache(session):
+    """Drop rates the session may have cached from its uncommitted changes."""
+    if session.info.pop('rate_cache_dirty', None):
+        rate_cache.invalidate()
+
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def invalidate_user_cache(mapper, connection, target):
+    """Remember changed users so the user cache drops them."""
+    user_cache.invalidate([target.id])
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault('stale_users', set()).add(target.id)
+
+
+@event.listens_for(db.session, 'after_commit')
+@event.listens_for(db.session, 'after_rollback')
+def clear_stale_users(session):
+    """Drop users other requests may have cached while the change was pending."""
+    stale_ids = session.info.pop('stale_users', None)
+    if stale_ids:
+        user_cache.invalidate(stale_ids)
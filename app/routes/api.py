@@ -0,0 +1,303 @@
+"""JSON API routes."""
+from datetime import date, datetime
+from decimal import Decimal
+
+from flask import Blueprint, current_app, jsonify, request
+from flask_login import login_required
+
+from app.models import Customer
+from app.utils.audit_storage import browse_audit_logs
+from app.utils.exchange_rates import SUPPORTED_CURRENCIES, rate_cache
+from app.utils.listing import list_assignments, list_customers, list_subnets
+from app.utils.network import (COMPACT_MODES, allocate_subnets_batch, compact_subnet,
+                               compact_subnets, get_fragmentation_report, resolve_ip_owners)
+from app.utils.serializers import json_response, parse_fields
+
+bp = Blueprint('api', __name__, url_prefix='/api/v1')
+
+
+def error_response(message, status=400):
+    """JSON error body with the given status code."""
+    return jsonify({'error': message}), status
+
+
+@bp.route('/ip-lookup', methods=['GET'])
+@login_required
+def ip_lookup():
+    """Owning subnet, assignment and customer of a single address."""
+    ip_address = request.args.get('ip', '').strip()
+    if not ip_address:
+        return error_response('ip parametresi gerekli.')
+    return jsonify(resolve_ip_owners([ip_address])[0])
+
+
+@bp.route('/ip-lookup', methods=['POST'])
+@login_required
+def ip_lookup_batch():
+    """Resolve a batch of addresses sent as a JSON list or one per line."""
+    if request.is_json:
+        payload = request.get_json(silent=True) or {}
+        ip_addresses = payload.get('ips')
+        if not isinstance(ip_addresses, list):
+            return error_response('ips bir liste olmalı.')
+        ip_addresses = [str(ip).strip() for ip in ip_addresses]
+    else:
+        ip_addresses = [line.strip() for line in request.get_data(as_text=True).splitlines()
+                        if line.strip()]
+    
+    max_batch = current_app.config['IP_LOOKUP_MAX_BATCH']
+    if len(ip_addresses) > max_batch:
+        return error_response(f'En fazla {max_batch} adres gönderilebilir.', 413)
+    
+    return jsonify({'results': resolve_ip_owners(ip_addresses)})
+
+
+def _parse_date(value):
+    return date.fromisoformat(value) if value else None
+
+
+@bp.route('/allocations', methods=['POST'])
+@login_required
+def allocations():
+    """Place and optionally create a batch of subnets with assignments.
+    
+    Body: ``requests`` (list of ``{"hosts": n}`` or ``{"prefix": p}`` with
+    optional ``count``, ``description``, ``price``), pool constraints
+    ``ip_version``, ``location``, ``vlan_id``, ``parent_subnet_id``, the
+    assignment fields ``customer_id``, ``price``, ``currency``,
+    ``start_date``, ``end_date``, ``auto_renew``, ``notes`` and ``dry_run``.
+    """
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return error_response('JSON gövdesi gerekli.')
+    requests = payload.get('requests')
+    if not isinstance(requests, list) or not requests \
+            or not all(isinstance(item, dict) for item in requests):
+        return error_response('requests boş olmayan bir nesne listesi olmalı.')
+    
+    customer_id = payload.get('customer_id')
+    if customer_id is not None and Customer.query.get(customer_id) is None:
+        return error_response('Müşteri bulunamadı.', 404)
+    currency = payload.get('currency', 'USD')
+    if currency not in SUPPORTED_CURRENCIES:
+        return error_response('Geçersiz para birimi.')
+    try:
+        ip_version = int(payload.get('ip_version', 4))
+        assignment = {
+            'price': Decimal(str(payload['price'])) if payload.get('price') is not None else None,
+            'currency': currency,
+            'start_date': _parse_date(payload.get('start_date')),
+            'end_date': _parse_date(payload.get('end_date')),
+            'auto_renew': bool(payload.get('auto_renew', False)),
+            'notes': payload.get('notes'),
+        }
+        for item in requests:
+            if item.get('price') is not None:
+                item['price'] = Decimal(str(item['price']))
+    except (ArithmeticError, TypeError, ValueError):
+        return error_response('Geçersiz fiyat, tarih veya IP sürümü.')
+    if ip_version not in (4, 6):
+        return error_response('Geçersiz IP sürümü.')
+    if customer_id is not None and assignment['price'] is None \
+            and any(item.get('price') is None for item in requests):
+        return error_response('Müşteri ataması için fiyat gerekli.')
+    
+    result = allocate_subnets_batch(
+        requests,
+        customer_id=customer_id,
+        assignment=assignment,
+        dry_run=bool(payload.get('dry_run', False)),
+        ip_version=ip_version,
+        location=payload.get('location'),
+        vlan_id=payload.get('vlan_id'),
+        parent_subnet_id=payload.get('parent_subnet_id'),
+    )
+    if not result['success']:
+        return jsonify(result), 409
+    return jsonify(result), 200 if result['dry_run'] else 201
+
+
+@bp.route('/fragmentation', methods=['GET'])
+@login_required
+def fragmentation():
+    """Free-space and fragmentation report of every matching pool."""
+    try:
+        pool_ids = [int(pool_id) for pool_id in request.args.getlist('pool_id')] or None
+        ip_version = request.args.get('ip_version', type=int)
+        min_fragmentation = float(request.args.get('min_index', 0))
+        limit = request.args.get('limit', type=int)
+    except ValueError:
+        return error_response('Geçersiz parametre.')
+    
+    reports = get_fragmentation_report(
+        pool_ids=pool_ids,
+        location=request.args.get('location'),
+        ip_version=ip_version,
+        min_fragmentation=min_fragmentation,
+        include_blocks=request.args.get('blocks') == '1',
+    )
+    return jsonify({'pools': reports[:limit] if limit else reports})
+
+
+@bp.route('/subnets/<int:subnet_id>/free-space', methods=['GET'])
+@login_required
+def subnet_free_space(subnet_id):
+    """Maximal free blocks and merge suggestions of one subnet."""
+    reports = get_fragmentation_report(pool_ids=[subnet_id], include_blocks=True)
+    if not reports:
+        return error_response('Subnet bulunamadı.', 404)
+    return jsonify(reports[0])
+
+
+def _compaction_options():
+    """Mode and dry-run flag from a compaction request body."""
+    if not request.is_json:
+        return None, None, None
+    payload = request.get_json(silent=True) or {}
+    mode = payload.get('mode', 'merge')
+    if mode not in COMPACT_MODES:
+        return None, None, payload
+    return mode, bool(payload.get('dry_run', False)), payload
+
+
+@bp.route('/subnets/<int:subnet_id>/compact', methods=['POST'])
+@login_required
+def compact_subnet_children(subnet_id):
+    """Merge or remove the unused children of one subnet."""
+    mode, dry_run, payload = _compaction_options()
+    if payload is None:
+        return error_response('JSON gövdesi gerekli.')
+    if mode is None:
+        return error_response('Geçersiz mod.')
+    result = compact_subnet(subnet_id, mode, dry_run)
+    if result is None:
+        return error_response('Subnet bulunamadı.', 404)
+    if 'error' in result:
+        return jsonify(result), 409
+    return jsonify(result)
+
+
+@bp.route('/compact', methods=['POST'])
+@login_required
+def compact():
+    """Compact every parent with unused children, optionally by location."""
+    mode, dry_run, payload = _compaction_options()
+    if payload is None:
+        return error_response('JSON gövdesi gerekli.')
+    if mode is None:
+        return error_response('Geçersiz mod.')
+    results = compact_subnets(mode=mode, dry_run=dry_run, location=payload.get('location'))
+    return jsonify({
+        'dry_run': dry_run,
+        'removed_count': sum(len(result['removed_subnet_ids']) for result in results
+                             if 'error' not in result),
+        'results': results,
+    })
+
+
+@bp.route('/audit-logs', methods=['GET'])
+@login_required
+def audit_logs():
+    """Newest-first audit entries with keyset pagination.
+    
+    Filters: ``user_id``, ``entity_type``, ``entity_id``, ``action``,
+    ``since``/``until`` (ISO timestamps); ``cursor`` comes from the previous
+    page's ``next_cursor``; ``fields`` selects the returned keys.
+    """
+    try:
+        since = request.args.get('since')
+        until = request.args.get('until')
+        limit = min(request.args.get('limit', 50, type=int), 1000)
+        items, next_cursor = browse_audit_logs(
+            user_id=request.args.get('user_id', type=int),
+            entity_type=request.args.get('entity_type'),
+            entity_id=request.args.get('entity_id', type=int),
+            action=request.args.get('action'),
+            since=datetime.fromisoformat(since) if since else None,
+            until=datetime.fromisoformat(until) if until else None,
+            cursor=request.args.get('cursor'),
+            limit=max(limit, 1),
+            fields=parse_fields(request.args.get('fields')),
+        )
+    except ValueError as exc:
+        return error_response(f'Geçersiz parametre: {exc}')
+    return json_response({'items': items, 'next_cursor': next_cursor})
+
+
+@bp.route('/exchange-rates', methods=['GET'])
+@login_required
+def exchange_rates():
+    """Rate matrix between the supported currencies, optionally as of a date."""
+    try:
+        as_of = _parse_date(request.args.get('as_of'))
+    except ValueError:
+        return error_response('Geçersiz tarih.')
+    return jsonify({
+        'as_of': as_of.isoformat() if as_of else None,
+        'rates': {source: {target: float(rate_cache.get_rate(source, target, as_of))
+                           for target in SUPPORTED_CURRENCIES}
+                  for source in SUPPORTED_CURRENCIES},
+    })
+
+
+def _page_options():
+    """``cursor``, ``limit`` (default ``ITEMS_PER_PAGE``, at most 1000) and ``fields``."""
+    limit = request.args.get('limit', current_app.config['ITEMS_PER_PAGE'], type=int)
+    return {
+        'cursor': request.args.get('cursor'),
+        'limit': max(min(limit, 1000), 1),
+        'fields': parse_fields(request.args.get('fields')),
+    }
+
+
+@bp.route('/subnets', methods=['GET'])
+@login_required
+def subnets():
+    """Subnets in ``(network_address, id)`` order with keyset pagination.
+    
+    Filters: ``status``, ``location``, ``vlan_id``, ``parent_id`` (0 for
+    top-level subnets) and ``contains`` (an IP address).
+    """
+    try:
+        items, next_cursor = list_subnets(
+            status=request.args.get('status'),
+            location=request.args.get('location'),
+            vlan_id=request.args.get('vlan_id', type=int),
+            parent_id=request.args.get('parent_id', type=int),
+            contains=request.args.get('contains'),
+            **_page_options(),
+        )
+    except ValueError as exc:
+        return error_response(f'Geçersiz parametre: {exc}')
+    return json_response({'items': items, 'next_cursor': next_cursor})
+
+
+@bp.route('/customers', methods=['GET'])
+@login_required
+def customers():
+    """Customers in ``(name, id)`` order; filters ``status`` and ``type``."""
+    try:
+        items, next_cursor = list_customers(
+            status=request.args.get('status'),
+            customer_type=request.args.get('type'),
+            **_page_options(),
+        )
+    except ValueError as exc:
+        return error_response(f'Geçersiz parametre: {exc}')
+    return json_response({'items': items, 'next_cursor': next_cursor})
+
+
+@bp.route('/assignments', methods=['GET'])
+@login_required
+def assignments():
+    """Assignments in id order; filters ``status``, ``customer_id`` and ``subnet_id``."""
+    try:
+        items, next_cursor = list_assignments(
+            status=request.args.get('status'),
+            customer_id=request.args.get('customer_id', type=int),
+            subnet_id=request.args.get('subnet_id', type=int),
+            **_page_options(),
+        )
+    except ValueError as exc:
+        return error_response(f'Geçersiz parametre: {exc}')
+    return json_response({'items': items, 'next_cursor': next_cursor})
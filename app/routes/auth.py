@@ -1,7 +1,8 @@
 """Authentication routes."""
+from urllib.parse import urlparse
+
 from flask import Blueprint, render_template, redirect, url_for, flash, request
 from flask_login import login_user, logout_user, current_user
-from werkzeug.urls import url_parse
 
 from app import db
 from app.models import User
@@ -28,7 +29,7 @@ def login():
         user.update_last_login()
         
         next_page = request.args.get('next')
-        if not next_page or url_parse(next_page).netloc != '':
+        if not next_page or urlparse(next_page).netloc != '':
             next_page = url_for('main.dashboard')
         
         return redirect(next_page)
@@ -0,0 +1,120 @@
+"""Free-space allocator for carving subnets out of a parent network."""
+from bisect import bisect_left, insort
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from app.utils.interval_index import MAX_PREFIX
+
+
+def cidr_blocks(start: int, end: int, bits: int) -> Iterator[Tuple[int, int]]:
+    """Split the integer range ``[start, end]`` into maximal aligned CIDR blocks.
+
+    Yields ``(start, prefix_length)`` pairs in address order; a range never
+    needs more than ``2 * bits`` blocks.
+    """
+    while start <= end:
+        size = start & -start if start else 1 << bits
+        while size > end - start + 1:
+            size >>= 1
+        yield start, bits - size.bit_length() + 1
+        start += size
+
+
+class FreeSpaceMap:
+    """Buddy-style free lists of the maximal free blocks inside one parent.
+
+    Free space is kept as sorted block starts per prefix length, so finding a
+    block of a given size only looks at the head of at most ``bits`` lists
+    instead of enumerating every candidate child network.
+    """
+
+    def __init__(self, version: int, start: int, prefix_length: int,
+                 occupied: Iterable[Tuple[int, int]] = ()):
+        self.version = version
+        self.bits = MAX_PREFIX[version]
+        self.prefix_length = prefix_length
+        self.start = start
+        self.end = start + (1 << (self.bits - prefix_length)) - 1
+        self._free: Dict[int, List[int]] = {}
+
+        cursor = self.start
+        for used_start, used_end in sorted(occupied):
+            if used_end < cursor or used_start > self.end:
+                continue
+            if used_start > cursor:
+                self._add_range(cursor, used_start - 1)
+            cursor = max(cursor, used_end + 1)
+        if cursor <= self.end:
+            self._add_range(cursor, self.end)
+
+    def _add_range(self, start: int, end: int):
+        for block_start, prefix in cidr_blocks(start, end, self.bits):
+            insort(self._free.setdefault(prefix, []), block_start)
+
+    def _take(self, prefix: int, block_start: int):
+        starts = self._free[prefix]
+        del starts[bisect_left(starts, block_start)]
+        if not starts:
+            del self._free[prefix]
+
+    def blocks(self) -> List[Tuple[int, int]]:
+        """All free blocks as ``(start, prefix_length)`` in address order."""
+        return sorted((block_start, prefix) for prefix, starts in self._free.items()
+                      for block_start in starts)
+
+    @property
+    def free_addresses(self) -> int:
+        """Total number of free addresses."""
+        return sum(len(starts) << (self.bits - prefix) for prefix, starts in self._free.items())
+
+    def largest_free_prefix(self) -> Optional[int]:
+        """Prefix length of the largest free block, or None when full."""
+        return min(self._free) if self._free else None
+
+    def _find(self, prefix: int, strategy: str) -> Optional[Tuple[int, int]]:
+        fitting = [p for p in self._free if p <= prefix]
+        if not fitting:
+            return None
+        if strategy == 'best':
+            # Smallest block that fits, keeping large blocks intact
+            block_prefix = max(fitting)
+            return block_prefix, self._free[block_prefix][0]
+        # Lowest address among all blocks that fit
+        return min(((p, self._free[p][0]) for p in fitting), key=lambda item: item[1])
+
+    def fit(self, prefix: int, strategy: str = 'best') -> Optional[Tuple[int, int]]:
+        """The ``(block_prefix, block_start)`` that ``allocate`` would split, if any."""
+        if prefix < self.prefix_length or prefix > self.bits:
+            return None
+        return self._find(prefix, strategy)
+
+    def allocate(self, prefix: int, strategy: str = 'first') -> Optional[int]:
+        """Reserve a block of ``prefix`` length and return its start address.
+
+        ``strategy`` is ``'first'`` (lowest free address) or ``'best'``
+        (smallest free block that fits). The remainder of a split block goes
+        back on the free lists as its buddies.
+        """
+        if prefix < self.prefix_length or prefix > self.bits:
+            return None
+        found = self._find(prefix, strategy)
+        if found is None:
+            return None
+        block_prefix, block_start = found
+        self._take(block_prefix, block_start)
+        for split_prefix in range(block_prefix + 1, prefix + 1):
+            buddy = block_start + (1 << (self.bits - split_prefix))
+            insort(self._free.setdefault(split_prefix, []), buddy)
+        return block_start
+
+    def release(self, block_start: int, prefix: int):
+        """Return a block to the free lists, merging it with free buddies."""
+        while prefix > self.prefix_length:
+            buddy = block_start ^ (1 << (self.bits - prefix))
+            starts = self._free.get(prefix, [])
+            pos = bisect_left(starts, buddy)
+            if pos == len(starts) or starts[pos] != buddy:
+                break
+            self._take(prefix, buddy)
+            block_start = min(block_start, buddy)
+            prefix -= 1
+        insort(self._free.setdefault(prefix, []), block_start)
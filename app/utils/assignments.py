@@ -0,0 +1,271 @@
+"""Set-based assignment lifecycle jobs."""
+import calendar
+import time
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from typing import Iterable, Optional
+
+from flask import current_app
+from sqlalchemy import and_, bindparam, case, exists, func, or_, select, tuple_, update
+
+from app import db
+from app.models import Assignment, AuditLog, Subnet
+from app.utils.exchange_rates import rate_cache
+
+# Assignments expired per UPDATE (and per transaction)
+EXPIRE_CHUNK = 1000
+# Assignments renewed per UPDATE (and per transaction)
+RENEW_CHUNK = 500
+
+
+def _overdue_criterion(today: date):
+    assignments = Assignment.__table__
+    # start_date <= end_date, so the redundant start_date bound lets the
+    # (start_date, end_date) index serve the scan
+    return (assignments.c.status == 'active',
+            assignments.c.start_date < today,
+            assignments.c.end_date < today)
+
+
+def _release_subnets(subnet_ids: Iterable[int], now: datetime) -> int:
+    """Mark assigned subnets without an active assignment available.
+
+    Leaf subnets drop their assigned addresses and the change is added to
+    every ancestor's counters with one recursive query and one batched
+    UPDATE, the same result the model events give row by row. Returns the
+    number of subnets released.
+    """
+    subnets = Subnet.__table__
+    assignments = Assignment.__table__
+    children = subnets.alias('children')
+    has_children = exists().where(children.c.parent_subnet_id == subnets.c.id)
+    still_assigned = exists().where(assignments.c.subnet_id == subnets.c.id,
+                                    assignments.c.status == 'active')
+    rows = db.session.execute(
+        select(subnets.c.id, subnets.c.parent_subnet_id, subnets.c.assigned_ips,
+               subnets.c.reserved_ips, (subnets.c.is_subdivided.is_(True) | has_children).label('inner'))
+        .where(subnets.c.id.in_(list(subnet_ids)), subnets.c.status == 'assigned', ~still_assigned)
+        .with_for_update(of=subnets)
+    ).all()
+    if not rows:
+        return 0
+
+    leaf_ids = [row.id for row in rows if not row.inner]
+    inner_ids = [row.id for row in rows if row.inner]
+    if leaf_ids:
+        db.session.execute(update(subnets).where(subnets.c.id.in_(leaf_ids)).values(
+            status='available',
+            updated_at=now,
+            free_ips=subnets.c.free_ips + subnets.c.assigned_ips + subnets.c.reserved_ips,
+            assigned_ips=0,
+            reserved_ips=0,
+        ))
+    if inner_ids:
+        # Counters of subnets with children are sums over the children
+        db.session.execute(update(subnets).where(subnets.c.id.in_(inner_ids)).values(
+            status='available', updated_at=now))
+
+    deltas = defaultdict(lambda: [0, 0])
+    for row in rows:
+        if not row.inner and row.parent_subnet_id and (row.assigned_ips or row.reserved_ips):
+            delta = deltas[row.parent_subnet_id]
+            delta[0] -= row.assigned_ips or 0
+            delta[1] -= row.reserved_ips or 0
+    if deltas:
+        chain = select(subnets.c.id.label('origin'), subnets.c.id, subnets.c.parent_subnet_id).where(
+            subnets.c.id.in_(list(deltas))).cte('ancestors', recursive=True)
+        chain = chain.union_all(
+            select(chain.c.origin, subnets.c.id, subnets.c.parent_subnet_id).join(
+                chain, subnets.c.id == chain.c.parent_subnet_id)
+        )
+        totals = defaultdict(lambda: [0, 0])
+        for origin, ancestor_id in db.session.execute(select(chain.c.origin, chain.c.id)):
+            total = totals[ancestor_id]
+            total[0] += deltas[origin][0]
+            total[1] += deltas[origin][1]
+        db.session.execute(
+            update(subnets).where(subnets.c.id == bindparam('b_id')).values(
+                assigned_ips=subnets.c.assigned_ips + bindparam('b_assigned'),
+                reserved_ips=subnets.c.reserved_ips + bindparam('b_reserved'),
+                free_ips=subnets.c.free_ips - bindparam('b_assigned') - bindparam('b_reserved'),
+            ),
+            [{'b_id': ancestor_id, 'b_assigned': assigned, 'b_reserved': reserved}
+             for ancestor_id, (assigned, reserved) in totals.items()],
+        )
+    return len(rows)
+
+
+def expire_assignments(today: Optional[date] = None, batch_size: int = EXPIRE_CHUNK,
+                       dry_run: bool = False, user_id: Optional[int] = None) -> dict:
+    """Expire every active assignment whose end date has passed.
+
+    Each chunk is one UPDATE of up to ``batch_size`` assignments plus the
+    release of their subnets, committed together, so a long backlog never
+    holds locks for the whole run and an interrupted run resumes where it
+    stopped. A subnet is released only while no other active assignment
+    still uses it. One audit entry summarizes the run, attributed to
+    ``user_id`` or the logged-in user.
+    """
+    today = today or datetime.utcnow().date()
+    assignments = Assignment.__table__
+    overdue = _overdue_criterion(today)
+    result = {'today': today.isoformat(), 'dry_run': dry_run, 'expired': 0,
+              'released_subnets': 0, 'batches': 0}
+
+    if dry_run:
+        subnets = Subnet.__table__
+        others = assignments.alias('others')
+        kept = exists().where(others.c.subnet_id == assignments.c.subnet_id,
+                              others.c.status == 'active',
+                              or_(others.c.end_date.is_(None), others.c.end_date >= today))
+        released = func.count(case((and_(subnets.c.status == 'assigned', ~kept),
+                                    assignments.c.subnet_id)).distinct())
+        result['expired'], result['released_subnets'] = db.session.execute(
+            select(func.count(), released)
+            .select_from(assignments.join(subnets, subnets.c.id == assignments.c.subnet_id))
+            .where(*overdue)
+        ).one()
+        return result
+
+    while True:
+        now = datetime.utcnow()
+        try:
+            chunk = db.session.execute(
+                select(assignments.c.id).where(*overdue).limit(batch_size)
+            ).scalars().all()
+            if not chunk:
+                db.session.rollback()
+                break
+            # The status guard skips rows another writer changed meanwhile
+            subnet_ids = db.session.execute(
+                update(assignments)
+                .where(assignments.c.id.in_(chunk), assignments.c.status == 'active')
+                .values(status='expired', updated_at=now)
+                .returning(assignments.c.subnet_id)
+            ).scalars().all()
+            released = _release_subnets(set(subnet_ids), now)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        result['expired'] += len(subnet_ids)
+        result['released_subnets'] += released
+        result['batches'] += 1
+
+    if result['expired']:
+        AuditLog.log_action('expire', 'assignment', None,
+                            f'Expired {result["expired"]} assignments ending before '
+                            f'{result["today"]}, released {result["released_subnets"]} subnets',
+                            user_id=user_id)
+    return result
+
+
+def add_months(day: date, months: int) -> date:
+    """``day`` moved by whole months, clamped to the end of shorter months."""
+    month = day.month - 1 + months
+    year = day.year + month // 12
+    month = month % 12 + 1
+    return day.replace(year=year, month=month, day=min(day.day, calendar.monthrange(year, month)[1]))
+
+
+def renew_assignments(lookahead_days: Optional[int] = None, term_months: Optional[int] = None,
+                      currency: Optional[str] = None, batch_size: int = RENEW_CHUNK,
+                      today: Optional[date] = None, dry_run: bool = False,
+                      user_id: Optional[int] = None) -> dict:
+    """Extend active auto-renew assignments ending within the lookahead window.
+
+    Each assignment is extended by as many terms of ``term_months`` as it
+    takes to end after the window, so running again the same day finds
+    nothing left to do. With ``currency`` the price of assignments billed in
+    another currency is converted through the exchange rate cache.
+
+    Assignments are walked by id in chunks of ``batch_size``; each chunk is
+    a single UPDATE, committed on its own, that only touches rows whose end
+    date is still the one read, so overlapping runs never extend twice and
+    an interrupted run is resumed by running it again. Returns counts and
+    throughput; one audit entry summarizes the run.
+    """
+    config = current_app.config
+    today = today or datetime.utcnow().date()
+    if lookahead_days is None:
+        lookahead_days = config.get('ASSIGNMENT_RENEWAL_LOOKAHEAD_DAYS', 7)
+    if term_months is None:
+        term_months = config.get('ASSIGNMENT_RENEWAL_MONTHS', 1)
+    currency = currency or config.get('ASSIGNMENT_RENEWAL_CURRENCY')
+    if term_months < 1 or lookahead_days < 0:
+        raise ValueError('term_months must be positive and lookahead_days not negative')
+
+    assignments = Assignment.__table__
+    horizon = today + timedelta(days=lookahead_days)
+    # As for expiry, the start_date bound lets idx_assignment_dates serve the scan
+    due = (assignments.c.status == 'active',
+           assignments.c.auto_renew.is_(True),
+           assignments.c.start_date <= horizon,
+           assignments.c.end_date <= horizon)
+    result = {'today': today.isoformat(), 'horizon': horizon.isoformat(), 'dry_run': dry_run,
+              'renewed': 0, 'repriced': 0, 'skipped': 0, 'batches': 0}
+
+    started = time.monotonic()
+    last_id = 0
+    while True:
+        now = datetime.utcnow()
+        try:
+            rows = db.session.execute(
+                select(assignments.c.id, assignments.c.end_date, assignments.c.price,
+                       assignments.c.currency)
+                .where(*due, assignments.c.id > last_id)
+                .order_by(assignments.c.id)
+                .limit(batch_size)
+            ).all()
+            if not rows:
+                db.session.rollback()
+                break
+            last_id = rows[-1].id
+
+            end_dates, prices = {}, {}
+            for row in rows:
+                terms = 1
+                while add_months(row.end_date, term_months * terms) <= horizon:
+                    terms += 1
+                end_dates[row.id] = add_months(row.end_date, term_months * terms)
+                if currency and (row.currency or 'USD') != currency:
+                    prices[row.id] = rate_cache.convert(row.price, row.currency or 'USD',
+                                                        currency).quantize(Decimal('0.01'))
+
+            if dry_run:
+                db.session.rollback()
+                renewed = [row.id for row in rows]
+            else:
+                values = {'end_date': case(end_dates, value=assignments.c.id), 'updated_at': now}
+                if prices:
+                    values['price'] = case(prices, value=assignments.c.id, else_=assignments.c.price)
+                    values['currency'] = currency
+                renewed = db.session.execute(
+                    update(assignments)
+                    .where(tuple_(assignments.c.id, assignments.c.end_date).in_(
+                        [(row.id, row.end_date) for row in rows]),
+                        assignments.c.status == 'active', assignments.c.auto_renew.is_(True))
+                    .values(**values)
+                    .returning(assignments.c.id)
+                ).scalars().all()
+                db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        result['renewed'] += len(renewed)
+        result['repriced'] += len(set(renewed) & set(prices))
+        result['skipped'] += len(rows) - len(renewed)
+        result['batches'] += 1
+
+    elapsed = time.monotonic() - started
+    result['seconds'] = round(elapsed, 3)
+    result['per_second'] = round(result['renewed'] / elapsed, 1) if elapsed > 0 else 0.0
+
+    if result['renewed'] and not dry_run:
+        details = (f'Renewed {result["renewed"]} auto-renew assignments ending by '
+                   f'{result["horizon"]} for {term_months} month(s)')
+        if result['repriced']:
+            details += f', repriced {result["repriced"]} in {currency}'
+        AuditLog.log_action('renew', 'assignment', None, details, user_id=user_id)
+    return result
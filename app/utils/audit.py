@@ -0,0 +1,190 @@
+"""Batched audit log writer.
+
+Audit entries recorded during a unit of work are kept in the session and
+written with multi-row INSERTs when it commits, inside the same
+transaction, so a business write costs no extra commit and a rolled back
+transaction leaves no entries. With ``AUDIT_LOG_ASYNC`` the committed
+entries go to a bounded in-process queue instead, written by a background
+thread in batches by size or time and drained on shutdown.
+"""
+import atexit
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import List
+
+from flask import has_request_context, request
+from flask_login import current_user
+from sqlalchemy import event, insert
+
+from app import db
+
+PENDING_KEY = 'pending_audit_logs'
+
+# Background writer, set up by init_app when AUDIT_LOG_ASYNC is on
+_background = None
+# Rows per INSERT statement
+_batch_size = 500
+
+_STOP = object()
+
+
+def _audit_table():
+    from app.models import AuditLog
+    return AuditLog.__table__
+
+
+def _insert_rows(connection, rows: List[dict]):
+    table = _audit_table()
+    for offset in range(0, len(rows), _batch_size):
+        connection.execute(insert(table).values(rows[offset:offset + _batch_size]))
+
+
+def record_changes(session, changes, user_id=None):
+    """Queue ``(action, entity_type, entity_id, details)`` tuples for ``session``.
+
+    The user and request are looked up once for the whole list. Entries are
+    attributed to ``user_id`` when given (e.g. by CLI jobs), otherwise to
+    the logged-in user; without either nothing is recorded. Returns whether
+    anything was.
+    """
+    if user_id is None:
+        if not current_user or not current_user.is_authenticated:
+            return False
+        user_id = current_user.id
+    in_request = has_request_context()
+    context = {
+        'user_id': user_id,
+        'ip_address': request.remote_addr if in_request else None,
+        'user_agent': request.headers.get('User-Agent') if in_request else None,
+        'timestamp': datetime.utcnow(),
+    }
+    session.info.setdefault(PENDING_KEY, []).extend(
+        dict(context, action=action, entity_type=entity_type, entity_id=entity_id, details=details)
+        for action, entity_type, entity_id, details in changes
+    )
+    return True
+
+
+class AuditQueue:
+    """Bounded buffer of committed entries written by a background thread.
+
+    A batch is written once ``batch_size`` rows are waiting or
+    ``flush_interval`` seconds have passed. When the buffer is full, ``put``
+    hands the rows back so the caller can write them itself instead of
+    dropping them.
+    """
+
+    def __init__(self, app, batch_size: int = 500, flush_interval: float = 2.0,
+                 max_size: int = 10000):
+        self.app = app
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max_size)
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='audit-log-writer', daemon=True)
+        self._thread.start()
+
+    def put(self, rows: List[dict]) -> List[dict]:
+        """Queue rows; returns the ones that did not fit."""
+        if self._closed:
+            return rows
+        for position, row in enumerate(rows):
+            try:
+                self._queue.put_nowait(row)
+            except queue.Full:
+                return rows[position:]
+        return []
+
+    def close(self, timeout: float = 10.0):
+        """Write everything still queued and stop the thread."""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    def _run(self):
+        batch = []
+        stopping = False
+        deadline = time.monotonic() + self.flush_interval
+        while not stopping or batch:
+            try:
+                row = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                row = None
+            if row is _STOP:
+                stopping = True
+            elif row is not None:
+                batch.append(row)
+
+            expired = time.monotonic() >= deadline
+            if batch and (stopping or expired or len(batch) >= self.batch_size):
+                self._write(batch)
+                batch = []
+            if expired:
+                deadline = time.monotonic() + self.flush_interval
+
+    def _write(self, rows: List[dict]):
+        try:
+            with self.app.app_context():
+                with db.engine.begin() as connection:
+                    _insert_rows(connection, rows)
+        except Exception:
+            self.app.logger.exception('Could not write %d audit log entries', len(rows))
+
+
+def init_app(app):
+    """Configure batch size and start the background writer if enabled."""
+    global _background, _batch_size
+    _batch_size = app.config.get('AUDIT_LOG_BATCH_SIZE', 500)
+    if _background is not None:
+        _background.close()
+        _background = None
+    if app.config.get('AUDIT_LOG_ASYNC'):
+        _background = AuditQueue(app, _batch_size, app.config.get('AUDIT_LOG_FLUSH_SECONDS', 2.0),
+                                 app.config.get('AUDIT_LOG_QUEUE_SIZE', 10000))
+
+
+def shutdown():
+    """Drain the background writer; registered to run at interpreter exit."""
+    global _background
+    if _background is not None:
+        _background.close()
+        _background = None
+
+
+atexit.register(shutdown)
+
+
+@event.listens_for(db.session, 'before_commit')
+def write_pending_audit_logs(session):
+    """Insert the transaction's entries just before it commits."""
+    # Flush first so entries recorded by this commit's own flush are included
+    session.flush()
+    if _background is not None:
+        return
+    rows = session.info.pop(PENDING_KEY, None)
+    if rows:
+        _insert_rows(session.connection(), rows)
+
+
+@event.listens_for(db.session, 'after_commit')
+def queue_committed_audit_logs(session):
+    """Hand committed entries to the background writer."""
+    if _background is None:
+        return
+    rows = session.info.pop(PENDING_KEY, None)
+    if not rows:
+        return
+    leftover = _background.put(rows)
+    if leftover:
+        with db.engine.begin() as connection:
+            _insert_rows(connection, leftover)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def discard_pending_audit_logs(session):
+    """Entries of a rolled back transaction are never written."""
+    session.info.pop(PENDING_KEY, None)
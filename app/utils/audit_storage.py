@@ -0,0 +1,304 @@
+"""Month partitions, archival and keyset browsing of the audit log.
+
+On PostgreSQL ``audit_logs`` becomes a table partitioned by month on
+``timestamp`` (``audit_logs_pYYYYMM`` plus ``audit_logs_default`` for rows
+no month partition covers), so old months are dropped as whole tables and
+time-range queries only touch the partitions they need. Other databases
+keep a single table and treat each calendar month of the ``timestamp``
+index as a partition.
+"""
+import base64
+import binascii
+import gzip
+import os
+import re
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from sqlalchemy import func, inspect, select, text, tuple_
+from sqlalchemy.schema import CreateIndex
+
+from app import db
+from app.models import AuditLog
+from app.utils.serializers import audit_log_serializer, dumps
+
+TABLE = 'audit_logs'
+DEFAULT_PARTITION = f'{TABLE}_default'
+PARTITION_NAME = re.compile(rf'^{TABLE}_p(\d{{4}})(\d{{2}})$')
+# Rows fetched per round trip while archiving
+ARCHIVE_CHUNK = 5000
+
+
+def month_start(moment: datetime) -> datetime:
+    return datetime(moment.year, moment.month, 1)
+
+
+def add_months(moment: datetime, months: int) -> datetime:
+    index = moment.year * 12 + moment.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: datetime) -> str:
+    return f'{TABLE}_p{month.year:04d}{month.month:02d}'
+
+
+def _is_postgresql(connection) -> bool:
+    return connection.dialect.name == 'postgresql'
+
+
+def is_partitioned(connection) -> bool:
+    """Whether ``audit_logs`` is a natively partitioned table."""
+    if not _is_postgresql(connection):
+        return False
+    return bool(connection.execute(text(
+        "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid "
+        "WHERE c.relname = :name AND c.relnamespace = 'public'::regnamespace"
+    ), {'name': TABLE}).first())
+
+
+def month_partitions(connection) -> List[Tuple[datetime, str]]:
+    """``(month, table name)`` of the existing month partitions, oldest first."""
+    names = connection.execute(text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "JOIN pg_class p ON p.oid = i.inhparent WHERE p.relname = :name"
+    ), {'name': TABLE}).scalars()
+    months = []
+    for name in names:
+        match = PARTITION_NAME.match(name)
+        if match:
+            months.append((datetime(int(match.group(1)), int(match.group(2)), 1), name))
+    return sorted(months)
+
+
+def _create_month_partition(connection, month: datetime):
+    """Add one month partition, moving its rows out of the default partition."""
+    name = partition_name(month)
+    start, end = month, add_months(month, 1)
+    bounds = {'start': start, 'end': end}
+    in_default = connection.execute(text(
+        f'SELECT 1 FROM {DEFAULT_PARTITION} WHERE timestamp >= :start AND timestamp < :end LIMIT 1'
+    ), bounds).first()
+    if in_default is None:
+        connection.execute(text(
+            f"CREATE TABLE {name} PARTITION OF {TABLE} "
+            f"FOR VALUES FROM ('{start:%Y-%m-%d}') TO ('{end:%Y-%m-%d}')"))
+        return
+    # A partition cannot be attached while the default partition still
+    # holds rows of its range, so they move first
+    connection.execute(text(f'CREATE TABLE {name} (LIKE {TABLE} INCLUDING DEFAULTS)'))
+    connection.execute(text(
+        f'WITH moved AS (DELETE FROM {DEFAULT_PARTITION} '
+        f'WHERE timestamp >= :start AND timestamp < :end RETURNING *) '
+        f'INSERT INTO {name} SELECT * FROM moved'), bounds)
+    connection.execute(text(
+        f"ALTER TABLE {TABLE} ATTACH PARTITION {name} "
+        f"FOR VALUES FROM ('{start:%Y-%m-%d}') TO ('{end:%Y-%m-%d}')"))
+
+
+def _convert_to_partitioned(connection):
+    """Rebuild a plain ``audit_logs`` table as a partitioned one, keeping its rows."""
+    old = f'{TABLE}_unpartitioned'
+    connection.execute(text(f'ALTER TABLE {TABLE} RENAME TO {old}'))
+    # The id sequence belongs to the old table and would be dropped with it
+    sequence = connection.execute(text(
+        "SELECT pg_get_serial_sequence(:table, 'id')"), {'table': old}).scalar()
+    if sequence:
+        connection.execute(text(f'ALTER SEQUENCE {sequence} OWNED BY NONE'))
+    connection.execute(text(
+        f'CREATE TABLE {TABLE} (LIKE {old} INCLUDING DEFAULTS) PARTITION BY RANGE (timestamp)'))
+    # Unique keys of a partitioned table must include the partition key
+    connection.execute(text(f'ALTER TABLE {TABLE} ADD PRIMARY KEY (id, timestamp)'))
+    connection.execute(text(f'ALTER TABLE {TABLE} ALTER COLUMN timestamp SET NOT NULL'))
+    connection.execute(text(
+        f'ALTER TABLE {TABLE} ADD FOREIGN KEY (user_id) REFERENCES users (id)'))
+    connection.execute(text(f'CREATE TABLE {DEFAULT_PARTITION} PARTITION OF {TABLE} DEFAULT'))
+
+    first, last = connection.execute(text(
+        f'SELECT min(timestamp), max(timestamp) FROM {old}')).first()
+    if first is not None:
+        month = month_start(first.replace(tzinfo=None))
+        while month <= last.replace(tzinfo=None):
+            _create_month_partition(connection, month)
+            month = add_months(month, 1)
+    # Rows without a timestamp are kept, stamped with the conversion time
+    columns = [column.name for column in AuditLog.__table__.columns]
+    selected = ['COALESCE(timestamp, now())' if name == 'timestamp' else name
+                for name in columns]
+    copied = connection.execute(text(
+        f'INSERT INTO {TABLE} ({", ".join(columns)}) '
+        f'SELECT {", ".join(selected)} FROM {old}')).rowcount
+    total = connection.execute(text(f'SELECT count(*) FROM {old}')).scalar()
+    if copied != total:
+        raise RuntimeError(f'copied {copied} of {total} audit log rows, keeping {old}')
+    connection.execute(text(f'DROP TABLE {old}'))
+    if sequence:
+        connection.execute(text(f'ALTER SEQUENCE {sequence} OWNED BY {TABLE}.id'))
+    for index in AuditLog.__table__.indexes:
+        connection.execute(CreateIndex(index))
+
+
+def ensure_audit_partitions(months_ahead: int = 3) -> List[str]:
+    """Partition the audit log by month and create partitions ahead of time.
+
+    Converts an existing plain table on first use and creates the partitions
+    from the current month up to ``months_ahead`` months on; meant to run
+    from a scheduled job. Returns the partitions created. A no-op outside
+    PostgreSQL.
+    """
+    # Work on the session's connection: a second connection would wait on
+    # the locks of the session's own open transaction
+    connection = db.session.connection()
+    if not _is_postgresql(connection) or not inspect(connection).has_table(TABLE):
+        return []
+    try:
+        before = {name for _, name in month_partitions(connection)}
+        if not is_partitioned(connection):
+            connection.execute(text(f'LOCK TABLE {TABLE} IN ACCESS EXCLUSIVE MODE'))
+            _convert_to_partitioned(connection)
+
+        existing = {month for month, _ in month_partitions(connection)}
+        current = month_start(datetime.utcnow())
+        for offset in range(months_ahead + 1):
+            month = add_months(current, offset)
+            if month not in existing:
+                _create_month_partition(connection, month)
+        created = [name for _, name in month_partitions(connection) if name not in before]
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return created
+
+
+def _stream_to_file(connection, statement, path: str) -> int:
+    """Write the rows of a query to a gzip NDJSON file; returns the row count."""
+    partial = f'{path}.partial'
+    count = 0
+    result = connection.execute(
+        statement.execution_options(stream_results=True, yield_per=ARCHIVE_CHUNK))
+    with gzip.open(partial, 'wb') as archive:
+        for row in result.mappings():
+            archive.write(dumps(dict(row)) + b'\n')
+            count += 1
+    os.replace(partial, path)
+    return count
+
+
+def archive_audit_logs(older_than_months: int, output_dir: str,
+                       dry_run: bool = False) -> List[dict]:
+    """Move whole months older than the cutoff to ``audit_logs-YYYY-MM.ndjson.gz``.
+
+    Each month is streamed to its file and only then dropped (a partition
+    table on PostgreSQL, a timestamp range elsewhere), one transaction per
+    month. Rows of those months still in the default partition are
+    archived and deleted along with them.
+    """
+    cutoff = add_months(month_start(datetime.utcnow()), -older_than_months)
+    table = AuditLog.__table__
+
+    connection = db.session.connection()
+    partitioned = is_partitioned(connection)
+    if partitioned:
+        months = {month for month, _ in month_partitions(connection) if month < cutoff}
+        source = DEFAULT_PARTITION
+    else:
+        source = TABLE
+        months = set()
+    # Months with rows outside any month partition
+    first = connection.execute(text(f'SELECT min(timestamp) FROM {source}')).scalar()
+    if first is not None:
+        if isinstance(first, str):
+            first = datetime.fromisoformat(first)
+        month = month_start(first.replace(tzinfo=None))
+        while month < cutoff:
+            months.add(month)
+            month = add_months(month, 1)
+
+    if not dry_run:
+        os.makedirs(output_dir, exist_ok=True)
+    results = []
+    for month in sorted(months):
+        in_month = (table.c.timestamp >= month, table.c.timestamp < add_months(month, 1))
+        name = partition_name(month)
+        try:
+            connection = db.session.connection()
+            partition_exists = partitioned and inspect(connection).has_table(name)
+            if dry_run:
+                rows = connection.execute(
+                    select(func.count()).select_from(table).where(*in_month)).scalar()
+                path = None
+            else:
+                path = os.path.join(output_dir, f'{TABLE}-{month:%Y-%m}.ndjson.gz')
+                rows = _stream_to_file(connection,
+                                       select(table).where(*in_month).order_by(table.c.id), path)
+                if partition_exists:
+                    connection.execute(text(f'DROP TABLE {name}'))
+                # Whatever is left of the month sits in the default partition
+                connection.execute(table.delete().where(*in_month))
+            # One transaction per month keeps locks and undo short
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        if rows or partition_exists:
+            results.append({'month': f'{month:%Y-%m}', 'rows': rows, 'file': path})
+    return results
+
+
+def browse_audit_logs(user_id: Optional[int] = None, entity_type: Optional[str] = None,
+                      entity_id: Optional[int] = None, action: Optional[str] = None,
+                      since: Optional[datetime] = None, until: Optional[datetime] = None,
+                      cursor: Optional[str] = None, limit: int = 50,
+                      fields: Optional[List[str]] = None) -> Tuple[List[dict], Optional[str]]:
+    """Newest-first audit entries after ``cursor`` and the cursor of the next page.
+
+    Keyset pagination on ``(timestamp, id)``: every page is an index range
+    scan however deep it is, and a time range only reads the partitions it
+    covers. The cursor is opaque to clients. Entries without a timestamp,
+    which only unpartitioned tables can hold, have no place in that order and
+    are left out.
+    """
+    query = select(AuditLog).where(AuditLog.timestamp.is_not(None))
+    if user_id is not None:
+        query = query.where(AuditLog.user_id == user_id)
+    if entity_type is not None:
+        query = query.where(AuditLog.entity_type == entity_type)
+    if entity_id is not None:
+        query = query.where(AuditLog.entity_id == entity_id)
+    if action is not None:
+        query = query.where(AuditLog.action == action)
+    if since is not None:
+        query = query.where(AuditLog.timestamp >= since)
+    if until is not None:
+        query = query.where(AuditLog.timestamp < until)
+    if cursor:
+        last_timestamp, last_id = decode_cursor(cursor)
+        query = query.where(tuple_(AuditLog.timestamp, AuditLog.id) < (last_timestamp, last_id))
+    query = query.order_by(AuditLog.timestamp.desc(), AuditLog.id.desc()).limit(limit + 1)
+
+    fields = audit_log_serializer.field_names(fields)
+    keys = [name for name in ('timestamp', 'id') if name not in fields]
+    items = audit_log_serializer.serialize(query, fields + keys)
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = encode_cursor(items[-1]['timestamp'], items[-1]['id'])
+    for item in items:
+        for key in keys:
+            del item[key]
+    return items, next_cursor
+
+
+def encode_cursor(timestamp: str, entry_id: int) -> str:
+    """URL-safe cursor from an entry's ISO timestamp and id."""
+    return base64.urlsafe_b64encode(f'{timestamp}~{entry_id}'.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """Split a browse cursor; raises ValueError when it is malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+    except (binascii.Error, UnicodeDecodeError) as exc:
+        raise ValueError('invalid cursor') from exc
+    timestamp, _, entry_id = raw.rpartition('~')
+    return datetime.fromisoformat(timestamp), int(entry_id)
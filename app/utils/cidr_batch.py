@@ -0,0 +1,373 @@
+"""Vectorized CIDR engine for validating and comparing large batches of networks.
+
+Networks are parsed once into NumPy arrays: ``uint32`` addresses for IPv4 and
+``(hi, lo)`` ``uint64`` pairs for IPv6. Overlap, containment and duplicate
+checks then run as sorts and ``searchsorted`` lookups over whole arrays.
+Every result is an array of row indices (positions in the input, or subnet
+ids for batches loaded from the database), never per-row dicts.
+"""
+import socket
+from functools import partial
+from typing import Iterable, Optional, Tuple
+
+import numpy as np
+
+from app.utils.interval_index import MAX_PREFIX
+
+_FAMILIES = {4: socket.AF_INET, 6: socket.AF_INET6}
+_EMPTY_INDEX = np.empty(0, dtype=np.int64)
+_ALL_ONES = np.uint64(0xFFFFFFFFFFFFFFFF)
+
+
+def _low_mask(bits: np.ndarray) -> np.ndarray:
+    """``uint64`` masks with the lowest ``bits`` (0..64) bits set."""
+    bits = np.asarray(bits, dtype=np.uint64)
+    shifted = (np.uint64(1) << np.minimum(bits, np.uint64(63))) - np.uint64(1)
+    return np.where(bits >= 64, _ALL_ONES, shifted)
+
+
+def address_array(version: int, values) -> np.ndarray:
+    """Python integer addresses as ``uint32`` or ``(hi, lo)`` ``uint64`` pairs."""
+    if version == 4:
+        return np.array(values, dtype=np.uint32)
+    return np.array([(value >> 64, value & 0xFFFFFFFFFFFFFFFF) for value in values],
+                    dtype=np.uint64).reshape(-1, 2)
+
+
+def address_keys(version: int, start: np.ndarray) -> np.ndarray:
+    """One sortable, ``searchsorted``-able key per address.
+    
+    IPv6 pairs become 16-byte big-endian strings, which order exactly like
+    the 128-bit integers they encode.
+    """
+    if version == 4:
+        return start
+    return np.ascontiguousarray(start.astype('>u8')).view('S16').ravel()
+
+
+class CIDRBatch:
+    """Parsed networks of one address family as parallel arrays.
+
+    ``start`` is ``uint32`` of shape ``(n,)`` for IPv4 and ``uint64`` of shape
+    ``(n, 2)`` holding the high and low halves for IPv6. ``index`` maps each
+    row back to its input position or subnet id.
+    """
+
+    def __init__(self, version: int, start: np.ndarray, prefix: np.ndarray,
+                 index: np.ndarray):
+        self.version = version
+        self.bits = MAX_PREFIX[version]
+        self.start = start
+        self.prefix = prefix.astype(np.uint8, copy=False)
+        self.index = index.astype(np.int64, copy=False)
+
+    @classmethod
+    def empty(cls, version: int) -> 'CIDRBatch':
+        shape = (0,) if version == 4 else (0, 2)
+        dtype = np.uint32 if version == 4 else np.uint64
+        return cls(version, np.empty(shape, dtype=dtype), np.empty(0, dtype=np.uint8),
+                   _EMPTY_INDEX)
+
+    def __len__(self):
+        return len(self.prefix)
+
+    def take(self, rows: np.ndarray) -> 'CIDRBatch':
+        """A new batch holding only the given rows."""
+        return CIDRBatch(self.version, self.start[rows], self.prefix[rows], self.index[rows])
+
+    def host_mask(self, prefix=None):
+        """Host bits of each row (or of one prefix length), per address half."""
+        prefix = self.prefix if prefix is None else prefix
+        host_bits = self.bits - np.asarray(prefix, dtype=np.int64)
+        if self.version == 4:
+            return _low_mask(host_bits).astype(np.uint32)
+        return _low_mask(np.maximum(host_bits - 64, 0)), _low_mask(np.minimum(host_bits, 64))
+
+    def masked(self, start: np.ndarray, prefix) -> np.ndarray:
+        """``start`` truncated to the network of the given prefix length."""
+        mask = self.host_mask(prefix)
+        if self.version == 4:
+            return start & ~mask
+        return np.stack([start[:, 0] & ~mask[0], start[:, 1] & ~mask[1]], axis=1)
+
+    @property
+    def end(self) -> np.ndarray:
+        """Last address of every row."""
+        mask = self.host_mask()
+        if self.version == 4:
+            return self.start | mask
+        return np.stack([self.start[:, 0] | mask[0], self.start[:, 1] | mask[1]], axis=1)
+
+    def has_host_bits(self) -> np.ndarray:
+        """Rows whose address is not aligned to its prefix."""
+        mask = self.host_mask()
+        if self.version == 4:
+            return (self.start & mask) != 0
+        return ((self.start[:, 0] & mask[0]) | (self.start[:, 1] & mask[1])) != 0
+
+    def keys(self, start: Optional[np.ndarray] = None) -> np.ndarray:
+        """Sortable keys of ``start`` (by default the rows' own addresses)."""
+        return address_keys(self.version, self.start if start is None else start)
+
+    def to_strings(self):
+        """Render the rows back to CIDR strings (for reports, not hot paths)."""
+        if self.version == 4:
+            packed = self.start.astype('>u4').tobytes()
+            width = 4
+        else:
+            packed = self.start.astype('>u8').tobytes()
+            width = 16
+        family = _FAMILIES[self.version]
+        return [f"{socket.inet_ntop(family, packed[i * width:(i + 1) * width])}/{prefix}"
+                for i, prefix in enumerate(self.prefix.tolist())]
+
+
+class ParsedCIDRs:
+    """Result of parsing a batch: one CIDRBatch per family plus invalid rows."""
+
+    def __init__(self, v4: CIDRBatch, v6: CIDRBatch, invalid: np.ndarray):
+        self.v4 = v4
+        self.v6 = v6
+        self.invalid = invalid
+
+    def __iter__(self):
+        return iter((self.v4, self.v6))
+
+    def family(self, version: int) -> CIDRBatch:
+        return self.v4 if version == 4 else self.v6
+
+
+def _build(version: int, packed: bytearray, prefixes, positions) -> CIDRBatch:
+    if not len(positions):
+        return CIDRBatch.empty(version)
+    if version == 4:
+        start = np.frombuffer(bytes(packed), dtype='>u4').astype(np.uint32)
+    else:
+        start = np.frombuffer(bytes(packed), dtype='>u8').astype(np.uint64).reshape(-1, 2)
+    return CIDRBatch(version, start, np.array(prefixes, dtype=np.uint8),
+                     np.array(positions, dtype=np.int64))
+
+
+def parse_cidrs(cidrs: Iterable[str], strict: bool = True) -> ParsedCIDRs:
+    """Parse CIDR strings into per-family arrays.
+
+    A missing prefix means a single address, as with ``ipaddress``. With
+    ``strict`` a network with host bits set is invalid; otherwise it is
+    truncated to its network address. Invalid input positions are returned
+    in ``invalid``.
+    """
+    packed = {4: bytearray(), 6: bytearray()}
+    prefixes = {4: [], 6: []}
+    positions = {4: [], 6: []}
+    invalid = []
+
+    for position, cidr in enumerate(cidrs):
+        address, slash, prefix = str(cidr).partition('/')
+        version = 6 if ':' in address else 4
+        try:
+            raw = socket.inet_pton(_FAMILIES[version], address)
+        except OSError:
+            invalid.append(position)
+            continue
+        if not slash:
+            prefix_length = MAX_PREFIX[version]
+        elif prefix.isascii() and prefix.isdigit() and int(prefix) <= MAX_PREFIX[version]:
+            prefix_length = int(prefix)
+        else:
+            invalid.append(position)
+            continue
+        packed[version] += raw
+        prefixes[version].append(prefix_length)
+        positions[version].append(position)
+
+    invalid = np.array(invalid, dtype=np.int64)
+    batches = []
+    for version in (4, 6):
+        batch = _build(version, packed[version], prefixes[version], positions[version])
+        misaligned = batch.has_host_bits()
+        if misaligned.any():
+            if strict:
+                invalid = np.concatenate([invalid, batch.index[misaligned]])
+                batch = batch.take(~misaligned)
+            else:
+                batch.start = batch.masked(batch.start, batch.prefix)
+        batches.append(batch)
+    invalid.sort()
+    return ParsedCIDRs(batches[0], batches[1], invalid)
+
+
+def parse_ips(ips: Iterable[str]) -> ParsedCIDRs:
+    """Parse bare IP addresses as single-address networks; prefixes are invalid."""
+    ips = ips if isinstance(ips, list) else list(ips)
+    # Fast path for single-family input: inet_pton over the whole list runs
+    # without a Python-level loop and rejects anything with a prefix
+    for version in (4, 6):
+        try:
+            packed = b''.join(map(partial(socket.inet_pton, _FAMILIES[version]), ips))
+        except (OSError, TypeError):
+            continue
+        positions = np.arange(len(ips), dtype=np.int64)
+        batch = _build(version, packed, np.full(len(ips), MAX_PREFIX[version]), positions)
+        other = CIDRBatch.empty(10 - version)
+        return ParsedCIDRs(*((batch, other) if version == 4 else (other, batch)), _EMPTY_INDEX)
+    return parse_cidrs(ip if '/' not in ip else '' for ip in map(str, ips))
+
+
+def from_ranges(rows: Iterable[Tuple[int, int, int, int]]) -> ParsedCIDRs:
+    """Build batches from ``(index, version, start, prefix_length)`` integer rows."""
+    columns = {4: ([], [], []), 6: ([], [], [])}
+    for index, version, start, prefix_length in rows:
+        starts, prefixes, indexes = columns[version]
+        starts.append(start)
+        prefixes.append(prefix_length)
+        indexes.append(index)
+
+    batches = []
+    for version in (4, 6):
+        starts, prefixes, indexes = columns[version]
+        if not indexes:
+            batches.append(CIDRBatch.empty(version))
+            continue
+        batches.append(CIDRBatch(version, address_array(version, starts),
+                                 np.array(prefixes, dtype=np.uint8),
+                                 np.array(indexes, dtype=np.int64)))
+    return ParsedCIDRs(batches[0], batches[1], _EMPTY_INDEX)
+
+
+def load_subnets(query=None) -> ParsedCIDRs:
+    """Load stored subnets into batches indexed by subnet id.
+
+    ``query`` may narrow the subnets (any query over ``Subnet``); by default
+    every subnet is loaded, reading only the derived integer columns.
+    """
+    from app import db
+    from app.models import Subnet
+
+    if query is None:
+        query = db.session.query(Subnet)
+    rows = query.with_entities(Subnet.id, Subnet.ip_version, Subnet.range_start,
+                               Subnet.prefix_length).filter(Subnet.ip_version.isnot(None))
+    return from_ranges(rows)
+
+
+def _expand(lo: np.ndarray, hi: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Flatten the half-open ranges ``[lo[i], hi[i])`` into (row, position) pairs."""
+    counts = hi - lo
+    total = int(counts.sum())
+    if not total:
+        return _EMPTY_INDEX, _EMPTY_INDEX
+    rows = np.repeat(np.arange(len(lo)), counts)
+    offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+    return rows, np.repeat(lo, counts) + offsets
+
+
+def _sorted_by_start(batch: CIDRBatch) -> np.ndarray:
+    keys = batch.keys()
+    return np.lexsort((batch.prefix, keys)) if len(batch) else _EMPTY_INDEX
+
+
+def _overlap_rows(a: CIDRBatch, b: CIDRBatch) -> Tuple[np.ndarray, np.ndarray]:
+    """Row pairs ``(i, j)`` where ``a[i]`` and ``b[j]`` overlap.
+
+    CIDR blocks are either disjoint or nested, so the blocks of ``b``
+    overlapping ``a[i]`` are those starting inside it (one ``searchsorted``
+    range each) plus its strict supernets, looked up by their aligned start
+    once per prefix length present in ``b``.
+    """
+    if not len(a) or not len(b):
+        return _EMPTY_INDEX, _EMPTY_INDEX
+
+    order = _sorted_by_start(b)
+    b_keys = b.keys()[order]
+    lo = np.searchsorted(b_keys, a.keys(), side='left')
+    hi = np.searchsorted(b_keys, a.keys(a.end), side='right')
+    rows_a, positions = _expand(lo, hi)
+    pairs_a, pairs_b = [rows_a], [order[positions]]
+
+    for prefix in np.unique(b.prefix).tolist():
+        candidates = np.flatnonzero(a.prefix > prefix)
+        if not len(candidates):
+            continue
+        ancestor = a.masked(a.start[candidates], prefix)
+        ancestor_keys = a.keys(ancestor)
+        strict = ancestor_keys != a.keys(a.start[candidates])
+        candidates, ancestor_keys = candidates[strict], ancestor_keys[strict]
+
+        same_prefix = np.flatnonzero(b.prefix == prefix)
+        same_prefix = same_prefix[np.argsort(b.keys()[same_prefix], kind='stable')]
+        prefix_keys = b.keys()[same_prefix]
+        lo = np.searchsorted(prefix_keys, ancestor_keys, side='left')
+        hi = np.searchsorted(prefix_keys, ancestor_keys, side='right')
+        rows, positions = _expand(lo, hi)
+        pairs_a.append(candidates[rows])
+        pairs_b.append(same_prefix[positions])
+
+    rows_a, rows_b = np.concatenate(pairs_a), np.concatenate(pairs_b)
+    order = np.lexsort((rows_b, rows_a))
+    return rows_a[order], rows_b[order]
+
+
+def overlap_pairs(a: CIDRBatch, b: CIDRBatch) -> Tuple[np.ndarray, np.ndarray]:
+    """Index pairs of overlapping networks between two batches of one family."""
+    rows_a, rows_b = _overlap_rows(a, b)
+    return a.index[rows_a], b.index[rows_b]
+
+
+def parsed_overlap_pairs(a: ParsedCIDRs, b: ParsedCIDRs) -> Tuple[np.ndarray, np.ndarray]:
+    """``overlap_pairs`` over both address families, ordered by ``a`` index."""
+    found = [overlap_pairs(a.family(version), b.family(version)) for version in (4, 6)]
+    index_a = np.concatenate([pair[0] for pair in found])
+    index_b = np.concatenate([pair[1] for pair in found])
+    order = np.lexsort((index_b, index_a))
+    return index_a[order], index_b[order]
+
+
+def self_overlap_pairs(batch: CIDRBatch) -> Tuple[np.ndarray, np.ndarray]:
+    """Index pairs of overlapping networks within one batch, each pair once."""
+    rows_a, rows_b = _overlap_rows(batch, batch)
+    keep = rows_a < rows_b
+    return batch.index[rows_a[keep]], batch.index[rows_b[keep]]
+
+
+def overlapping(a: CIDRBatch, b: CIDRBatch) -> np.ndarray:
+    """Indexes of the rows of ``a`` overlapping anything in ``b``."""
+    rows_a, _ = _overlap_rows(a, b)
+    return a.index[np.unique(rows_a)]
+
+
+def duplicates(batch: CIDRBatch) -> np.ndarray:
+    """Indexes of rows repeating an earlier row's network exactly."""
+    if not len(batch):
+        return _EMPTY_INDEX
+    order = np.lexsort((np.arange(len(batch)), batch.prefix, batch.keys()))
+    keys, prefixes = batch.keys()[order], batch.prefix[order]
+    repeated = np.zeros(len(batch), dtype=bool)
+    repeated[1:] = (keys[1:] == keys[:-1]) & (prefixes[1:] == prefixes[:-1])
+    return np.sort(batch.index[order[repeated]])
+
+
+def most_specific_containing(a: CIDRBatch, b: CIDRBatch) -> np.ndarray:
+    """For each row of ``a``, the index of the longest ``b`` network holding it.
+
+    ``a`` is typically a batch of addresses from ``parse_ips``. Rows that no
+    network contains get ``-1``.
+    """
+    result = np.full(len(a), -1, dtype=np.int64)
+    if not len(a) or not len(b):
+        return result
+
+    pending = np.ones(len(a), dtype=bool)
+    for prefix in np.unique(b.prefix)[::-1].tolist():
+        candidates = np.flatnonzero(pending & (a.prefix >= prefix))
+        if not len(candidates):
+            continue
+        same_prefix = np.flatnonzero(b.prefix == prefix)
+        same_prefix = same_prefix[np.argsort(b.keys()[same_prefix], kind='stable')]
+        prefix_keys = b.keys()[same_prefix]
+        network_keys = a.keys(a.masked(a.start[candidates], prefix))
+        positions = np.searchsorted(prefix_keys, network_keys, side='left')
+        found = positions < len(prefix_keys)
+        found[found] = prefix_keys[positions[found]] == network_keys[found]
+        result[candidates[found]] = b.index[same_prefix[positions[found]]]
+        pending[candidates[found]] = False
+    return result
@@ -0,0 +1,231 @@
+"""In-process exchange rate cache, provider refresh and as-of conversion."""
+import json
+import os
+import threading
+import time
+from bisect import bisect_right
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional, Tuple
+from urllib.parse import unquote, urlparse
+
+SUPPORTED_CURRENCIES = ('USD', 'EUR', 'TRY')
+ONE = Decimal('1.0')
+
+
+class RateCache:
+    """Matrix of current rates plus the full rate history, loaded in bulk.
+
+    Current rates and the history come from one query each and are reloaded
+    once the TTL (``EXCHANGE_RATE_CACHE_HOURS``) runs out or a rate row
+    changes, so rates written by other processes show up within the TTL.
+    An as-of lookup is a binary search over a pair's dates. Missing pairs are
+    derived from the inverse or a cross rate before falling back to 1.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._rates: Optional[Dict[Tuple[str, str], Decimal]] = None
+        self._history: Optional[
+            Dict[Tuple[str, str], Tuple[List[date], List[Decimal]]]
+        ] = None
+        self._expires = 0.0
+        self._history_expires = 0.0
+
+    def invalidate(self):
+        """Drop cached rates so the next lookup reloads them."""
+        with self._lock:
+            self._rates = None
+            self._history = None
+
+    def _ttl(self) -> float:
+        from flask import current_app
+        return current_app.config.get('EXCHANGE_RATE_CACHE_HOURS', 24) * 3600
+
+    def rates(self) -> Dict[Tuple[str, str], Decimal]:
+        """Current ``(from, to) -> rate`` matrix."""
+        with self._lock:
+            if self._rates is None or time.monotonic() >= self._expires:
+                from app import db
+                from app.models import ExchangeRate
+
+                rows = db.session.query(ExchangeRate.from_currency,
+                                        ExchangeRate.to_currency, ExchangeRate.rate)
+                self._rates = {(source, target): Decimal(str(rate))
+                               for source, target, rate in rows}
+                self._expires = time.monotonic() + self._ttl()
+            return self._rates
+
+    def history(self) -> Dict[Tuple[str, str], Tuple[List[date], List[Decimal]]]:
+        """Per pair, effective dates in ascending order and their rates."""
+        with self._lock:
+            if self._history is None or time.monotonic() >= self._history_expires:
+                from app import db
+                from app.models import ExchangeRateHistory
+
+                history = {}
+                rows = db.session.query(
+                    ExchangeRateHistory.from_currency, ExchangeRateHistory.to_currency,
+                    ExchangeRateHistory.effective_date, ExchangeRateHistory.rate
+                ).order_by(ExchangeRateHistory.effective_date)
+                for source, target, effective_date, rate in rows:
+                    dates, rates = history.setdefault((source, target), ([], []))
+                    dates.append(effective_date)
+                    rates.append(Decimal(str(rate)))
+                self._history = history
+                self._history_expires = time.monotonic() + self._ttl()
+            return self._history
+
+    def _matrix(self, as_of: Optional[date]) -> Dict[Tuple[str, str], Decimal]:
+        if as_of is None:
+            return self.rates()
+        if isinstance(as_of, datetime):
+            as_of = as_of.date()
+        matrix = {}
+        for pair, (dates, rates) in self.history().items():
+            position = bisect_right(dates, as_of)
+            if position:
+                matrix[pair] = rates[position - 1]
+        return matrix
+
+    def get_rate(self, from_currency: str, to_currency: str,
+                 as_of: Optional[date] = None) -> Decimal:
+        """Rate from one currency to another, optionally as of a date.
+
+        Dates before the first recorded rate of a pair use the current rate.
+        """
+        if from_currency == to_currency:
+            return ONE
+        for matrix in ((self._matrix(as_of), self.rates()) if as_of is not None
+                       else (self.rates(),)):
+            rate = _lookup(matrix, from_currency, to_currency)
+            if rate is not None:
+                return rate
+        return ONE
+
+    def convert(self, amount, from_currency: str, to_currency: str,
+                as_of: Optional[date] = None) -> Decimal:
+        """``amount`` in ``to_currency``."""
+        rate = self.get_rate(from_currency, to_currency, as_of)
+        return Decimal(str(amount or 0)) * rate
+
+    def total(self, amounts: Iterable[Tuple], to_currency: str) -> Decimal:
+        """Sum of ``(amount, currency)`` or ``(amount, currency, as_of)`` tuples."""
+        total = Decimal('0')
+        rates = {}
+        for item in amounts:
+            amount, currency = item[0], item[1]
+            as_of = item[2] if len(item) > 2 else None
+            key = (currency, as_of)
+            if key not in rates:
+                rates[key] = self.get_rate(currency, to_currency, as_of)
+            total += Decimal(str(amount or 0)) * rates[key]
+        return total
+
+
+def _direct(matrix, from_currency: str, to_currency: str) -> Optional[Decimal]:
+    rate = matrix.get((from_currency, to_currency))
+    if rate is not None:
+        return rate
+    inverse = matrix.get((to_currency, from_currency))
+    return ONE / inverse if inverse else None
+
+
+def _lookup(matrix, from_currency: str, to_currency: str) -> Optional[Decimal]:
+    rate = _direct(matrix, from_currency, to_currency)
+    if rate is not None:
+        return rate
+    # Cross rate through any currency linked to both sides
+    for middle in {currency for pair in matrix for currency in pair}:
+        first = _direct(matrix, from_currency, middle)
+        if first is not None:
+            second = _direct(matrix, middle, to_currency)
+            if second is not None:
+                return first * second
+    return None
+
+
+# Shared process-wide cache; rate writes invalidate it through model events
+rate_cache = RateCache()
+
+
+def fetch_provider_rates(base_currency: str,
+                         url: Optional[str] = None) -> Tuple[date, Dict[str, Decimal]]:
+    """Rates for one base currency from the configured provider.
+
+    The provider answers ``GET <EXCHANGE_RATE_API_URL><BASE>`` with
+    ``{"date": "YYYY-MM-DD", "rates": {"EUR": 0.92, ...}}``. A ``file://``
+    URL reads ``<directory>/<BASE>.json`` instead, which serves as a local
+    stub.
+    """
+    from flask import current_app
+
+    url = url or current_app.config['EXCHANGE_RATE_API_URL']
+    parsed = urlparse(url)
+    if parsed.scheme == 'file':
+        with open(os.path.join(unquote(parsed.path), f'{base_currency}.json')) as stub:
+            payload = json.load(stub)
+    else:
+        import requests
+
+        response = requests.get(f'{url}{base_currency}', timeout=10)
+        response.raise_for_status()
+        payload = response.json()
+
+    if payload.get('date'):
+        effective_date = date.fromisoformat(payload['date'])
+    else:
+        effective_date = date.today()
+    rates = {currency: Decimal(str(rate))
+             for currency, rate in payload.get('rates', {}).items()}
+    return effective_date, rates
+
+
+def refresh_exchange_rates(currencies: Iterable[str] = SUPPORTED_CURRENCIES,
+                           url: Optional[str] = None) -> List[dict]:
+    """Store the provider's current rates between ``currencies`` and record history.
+
+    Current rows are updated in place, one history row per pair and
+    effective date is written (replacing a same-day one) and the cache is
+    reloaded. Returns the stored rates.
+    """
+    from app import db
+    from app.models import ExchangeRate, ExchangeRateHistory
+
+    currencies = list(currencies)
+    current = {(rate.from_currency, rate.to_currency): rate
+               for rate in ExchangeRate.query.all()}
+    fetched = []
+    for base in currencies:
+        effective_date, rates = fetch_provider_rates(base, url)
+        for target in currencies:
+            if target != base and target in rates:
+                fetched.append((base, target, rates[target], effective_date))
+
+    dates = {effective_date for _, _, _, effective_date in fetched}
+    existing = {
+        (row.from_currency, row.to_currency, row.effective_date): row
+        for row in ExchangeRateHistory.query.filter(
+            ExchangeRateHistory.effective_date.in_(dates))
+    } if dates else {}
+    now = datetime.utcnow()
+    for base, target, rate, effective_date in fetched:
+        row = current.get((base, target))
+        if row is None:
+            db.session.add(ExchangeRate(from_currency=base, to_currency=target,
+                                        rate=rate, updated_at=now))
+        else:
+            row.rate = rate
+            row.updated_at = now
+        history = existing.get((base, target, effective_date))
+        if history is None:
+            db.session.add(ExchangeRateHistory(
+                from_currency=base, to_currency=target, rate=rate,
+                effective_date=effective_date))
+        else:
+            history.rate = rate
+    db.session.commit()
+    rate_cache.invalidate()
+    return [{'from_currency': base, 'to_currency': target, 'rate': float(rate),
+             'effective_date': effective_date.isoformat()}
+            for base, target, rate, effective_date in fetched]
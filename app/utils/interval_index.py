@@ -0,0 +1,294 @@
+"""In-memory interval index for fast subnet overlap lookups."""
+import ipaddress
+import threading
+import time
+from bisect import bisect_left, insort
+from typing import Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import func
+
+MAX_PREFIX = {4: 32, 6: 128}
+
+
+class NetworkRange:
+    """Compact integer form of a CIDR block.
+
+    Holds only the version, first and last address and prefix length, so the
+    network utilities can compare, contain and count without building
+    ``ipaddress`` objects. Unpacks as ``(version, start, end, prefix_length)``.
+    """
+    __slots__ = ('version', 'start', 'end', 'prefix_length')
+
+    def __init__(self, version: int, start: int, prefix_length: int):
+        self.version = version
+        self.start = start
+        self.end = start + (1 << (MAX_PREFIX[version] - prefix_length)) - 1
+        self.prefix_length = prefix_length
+
+    @classmethod
+    def parse(cls, network_address: str, prefix_length: int) -> Optional['NetworkRange']:
+        """Build from an address and prefix, or None unless it is a valid network."""
+        try:
+            address = ipaddress.ip_address(network_address)
+            prefix_length = int(prefix_length)
+        except (TypeError, ValueError):
+            return None
+        start = int(address)
+        host_bits = address.max_prefixlen - prefix_length
+        if not 0 <= host_bits <= address.max_prefixlen or start & ((1 << host_bits) - 1):
+            return None
+        return cls(address.version, start, prefix_length)
+
+    @classmethod
+    def from_cidr(cls, cidr: str) -> Optional['NetworkRange']:
+        """Build from ``address/prefix`` notation, or None when invalid."""
+        network_address, _, prefix_length = str(cidr).partition('/')
+        if not prefix_length:
+            return None
+        return cls.parse(network_address, prefix_length)
+
+    @property
+    def num_addresses(self) -> int:
+        return self.end - self.start + 1
+
+    @property
+    def usable_addresses(self) -> int:
+        """Addresses excluding the IPv4 network and broadcast addresses."""
+        if self.version == 4 and self.prefix_length < 31:
+            return self.num_addresses - 2
+        return self.num_addresses
+
+    def address(self, value: int) -> str:
+        """Format an integer address of this family."""
+        if self.version == 4:
+            return str(ipaddress.IPv4Address(value))
+        return str(ipaddress.IPv6Address(value))
+
+    def network(self):
+        """The equivalent ``ipaddress`` network object."""
+        return ipaddress.ip_network((self.address(self.start), self.prefix_length))
+
+    def contains(self, value: int, version: Optional[int] = None) -> bool:
+        """Whether integer address ``value`` falls inside the block."""
+        if version is not None and version != self.version:
+            return False
+        return self.start <= value <= self.end
+
+    def overlaps(self, other: 'NetworkRange') -> bool:
+        return (self.version == other.version
+                and self.start <= other.end and other.start <= self.end)
+
+    def __iter__(self):
+        return iter((self.version, self.start, self.end, self.prefix_length))
+
+    def __eq__(self, other):
+        if not isinstance(other, NetworkRange):
+            return NotImplemented
+        return tuple(self) == tuple(other)
+
+    def __hash__(self):
+        return hash(tuple(self))
+
+    def __str__(self):
+        return f"{self.address(self.start)}/{self.prefix_length}"
+
+    def __repr__(self):
+        return f"NetworkRange('{self}')"
+
+
+def network_range(network_address: str, prefix_length: int) -> Optional[NetworkRange]:
+    """Convert a network into an integer (version, start, end, prefix) range."""
+    return NetworkRange.parse(network_address, prefix_length)
+
+
+def subnet_table_stamp(session=None) -> tuple:
+    """``(rows, highest id, latest update)`` of the subnets table.
+
+    Inserts, deletes and updates that set ``updated_at`` all change it,
+    whichever process or statement made them.
+    """
+    from app import db
+    from app.models import Subnet
+
+    session = session if session is not None else db.session
+    return tuple(session.query(func.count(Subnet.id), func.max(Subnet.id),
+                               func.max(Subnet.updated_at)).one())
+
+
+class TableStamp:
+    """Tells whether an in-memory copy of the subnets table is still current.
+
+    The stamp taken at load time is compared with the database at most every
+    ``SUBNET_LOOKUP_CHECK_SECONDS``, so writes by other workers, CLI jobs and
+    bulk statements are picked up without a query per lookup. Writes this
+    process commits through the ORM are already applied to the copy and
+    move the stamp forward with ``advance`` instead. A copy built with
+    ``load`` alone has no stamp and is kept as is.
+    """
+
+    def __init__(self):
+        self.value = None
+        self.checked_at = 0.0
+
+    def set(self, value):
+        self.value = value
+        self.checked_at = time.monotonic()
+
+    def advance(self, before, after):
+        """Take ``after`` if the copy was current at ``before``.
+
+        ``before`` and ``after`` bracket a transaction whose changes the copy
+        already holds; a copy stamped at any other state reloads as usual.
+        """
+        if self.value is not None and self.value == before:
+            self.set(after)
+
+    def is_current(self) -> bool:
+        if self.value is None:
+            return True
+        from flask import current_app
+
+        now = time.monotonic()
+        if now - self.checked_at < current_app.config.get('SUBNET_LOOKUP_CHECK_SECONDS', 5):
+            return True
+        self.checked_at = now
+        return subnet_table_stamp() == self.value
+
+
+class SubnetIntervalIndex:
+    """Sorted integer ranges per address family for O(log n + k) overlap queries.
+
+    CIDR blocks never partially overlap: two blocks are either disjoint or one
+    contains the other. An overlap query for ``[start, end]`` is therefore the
+    union of the blocks that start inside the range (found with a bisect over
+    the sorted starts) and the ancestors of ``start``, which are looked up
+    directly by their aligned start for each prefix length in use.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._loaded = False
+        self.stamp = TableStamp()
+        self._reset()
+
+    def _reset(self):
+        self._entries: Dict[int, List[Tuple[int, int, int]]] = {4: [], 6: []}
+        self._by_block: Dict[Tuple[int, int, int], Set[int]] = {}
+        self._prefix_counts: Dict[int, Dict[int, int]] = {4: {}, 6: {}}
+        self._ranges: Dict[int, NetworkRange] = {}
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    def invalidate(self):
+        """Drop the index so the next query rebuilds it from the database."""
+        with self._lock:
+            self._reset()
+            self._loaded = False
+
+    def load(self, rows, stamp=None):
+        """Rebuild the index from ``(id, NetworkRange)`` rows."""
+        with self._lock:
+            self._reset()
+            for subnet_id, rng in rows:
+                self._add(subnet_id, rng)
+            for entries in self._entries.values():
+                entries.sort()
+            self.stamp.set(stamp)
+            self._loaded = True
+
+    def ensure_loaded(self):
+        """Load the index from the ``subnets`` table on first use or once stale."""
+        if self._loaded and self.stamp.is_current():
+            return
+        from app import db
+        from app.models import Subnet
+
+        # Stamp first: a change racing with the load shows up as stale later
+        stamp = subnet_table_stamp()
+        rows = db.session.query(Subnet.id, Subnet.network_address, Subnet.prefix_length,
+                                Subnet.ip_version, Subnet.range_start)
+        self.load(
+            ((subnet_id, NetworkRange(version, start, prefix_length) if version is not None
+              else network_range(network_address, prefix_length))
+             for subnet_id, network_address, prefix_length, version, start in rows),
+            stamp,
+        )
+
+    def _add(self, subnet_id, rng, sort=False):
+        if rng is None:
+            return
+        version, start, end, prefix = rng
+        self._ranges[subnet_id] = rng
+        if sort:
+            insort(self._entries[version], (start, end, subnet_id))
+        else:
+            self._entries[version].append((start, end, subnet_id))
+        self._by_block.setdefault((version, start, prefix), set()).add(subnet_id)
+        counts = self._prefix_counts[version]
+        counts[prefix] = counts.get(prefix, 0) + 1
+
+    def _remove(self, subnet_id):
+        rng = self._ranges.pop(subnet_id, None)
+        if rng is None:
+            return
+        version, start, end, prefix = rng
+        entries = self._entries[version]
+        pos = bisect_left(entries, (start, end, subnet_id))
+        if pos < len(entries) and entries[pos] == (start, end, subnet_id):
+            del entries[pos]
+        block = self._by_block.get((version, start, prefix))
+        if block is not None:
+            block.discard(subnet_id)
+            if not block:
+                del self._by_block[(version, start, prefix)]
+        counts = self._prefix_counts[version]
+        counts[prefix] -= 1
+        if not counts[prefix]:
+            del counts[prefix]
+
+    def upsert(self, subnet_id: int, network_address: str, prefix_length: int):
+        """Insert or move a subnet; a no-op until the index has been loaded."""
+        with self._lock:
+            if not self._loaded:
+                return
+            self._remove(subnet_id)
+            self._add(subnet_id, network_range(network_address, prefix_length), sort=True)
+
+    def discard(self, subnet_id: int):
+        """Remove a subnet from the index."""
+        with self._lock:
+            if self._loaded:
+                self._remove(subnet_id)
+
+    def overlapping(self, version: int, start: int, end: int, prefix: int,
+                    exclude_id: Optional[int] = None) -> List[int]:
+        """Return the ids of indexed subnets overlapping ``[start, end]``, sorted."""
+        self.ensure_loaded()
+        with self._lock:
+            entries = self._entries[version]
+            found = set()
+
+            # Blocks that start inside the range: contained in it, or the same start
+            pos = bisect_left(entries, (start,))
+            while pos < len(entries) and entries[pos][0] <= end:
+                found.add(entries[pos][2])
+                pos += 1
+
+            # Ancestors: aligned supernets of the range starting strictly before it
+            bits = MAX_PREFIX[version]
+            for ancestor_prefix in self._prefix_counts[version]:
+                if ancestor_prefix >= prefix:
+                    continue
+                host_bits = bits - ancestor_prefix
+                ancestor_start = (start >> host_bits) << host_bits
+                if ancestor_start < start:
+                    found.update(self._by_block.get((version, ancestor_start, ancestor_prefix), ()))
+
+            found.discard(exclude_id)
+            return sorted(found)
+
+
+# Shared process-wide index kept current by the Subnet model events
+subnet_index = SubnetIntervalIndex()
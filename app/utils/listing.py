@@ -0,0 +1,112 @@
+"""Keyset-paginated listings of subnets, customers and assignments."""
+import base64
+import binascii
+import ipaddress
+import json
+from typing import List, Optional, Sequence, Tuple
+
+from sqlalchemy import select, tuple_
+
+from app.models import Assignment, Customer, Subnet
+from app.utils.network import containing_ip_criterion
+from app.utils.serializers import (Serializer, assignment_serializer, customer_serializer,
+                                   subnet_serializer)
+
+
+def encode_cursor(values: Sequence) -> str:
+    """URL-safe cursor from the sort key values of a page's last item."""
+    raw = json.dumps(list(values), separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str, size: int) -> list:
+    """Sort key values of a cursor; raises ValueError when it is malformed."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (binascii.Error, UnicodeDecodeError, json.JSONDecodeError) as exc:
+        raise ValueError('invalid cursor') from exc
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError('invalid cursor')
+    return values
+
+
+def keyset_page(serializer: Serializer, query, keys: Sequence[Tuple[str, object]],
+                cursor: Optional[str] = None, limit: int = 20,
+                fields: Optional[List[str]] = None) -> Tuple[List[dict], Optional[str]]:
+    """One page of ``query`` in ``keys`` order and the cursor of the next page.
+
+    ``keys`` pairs a serializer field with the column it reads and must end
+    in a unique column. The page starts after the cursor's key with a row
+    value comparison, so a deep page is the same index range scan as the
+    first one. Key fields not requested are fetched for the cursor only.
+    """
+    columns = [column for _, column in keys]
+    if cursor:
+        query = query.where(tuple_(*columns) > tuple(decode_cursor(cursor, len(keys))))
+    query = query.order_by(*columns).limit(limit + 1)
+
+    fields = serializer.field_names(fields)
+    extra = [name for name, _ in keys if name not in fields]
+    items = serializer.serialize(query, fields + extra)
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = encode_cursor([items[-1][name] for name, _ in keys])
+    for item in items:
+        for name in extra:
+            del item[name]
+    return items, next_cursor
+
+
+def list_subnets(status: Optional[str] = None, location: Optional[str] = None,
+                 vlan_id: Optional[int] = None, parent_id: Optional[int] = None,
+                 contains: Optional[str] = None, cursor: Optional[str] = None,
+                 limit: int = 20, fields: Optional[List[str]] = None):
+    """Subnets ordered by ``(network_address, id)``.
+
+    ``parent_id`` 0 selects top-level subnets; ``contains`` selects the
+    subnets holding an address.
+    """
+    query = select(Subnet)
+    if status is not None:
+        query = query.where(Subnet.status == status)
+    if location is not None:
+        query = query.where(Subnet.location == location)
+    if vlan_id is not None:
+        query = query.where(Subnet.vlan_id == vlan_id)
+    if parent_id is not None:
+        query = query.where(Subnet.parent_subnet_id == parent_id if parent_id
+                            else Subnet.parent_subnet_id.is_(None))
+    if contains is not None:
+        query = query.where(containing_ip_criterion(ipaddress.ip_address(contains)))
+    return keyset_page(subnet_serializer, query,
+                       [('network_address', Subnet.network_address), ('id', Subnet.id)],
+                       cursor, limit, fields)
+
+
+def list_customers(status: Optional[str] = None, customer_type: Optional[str] = None,
+                   cursor: Optional[str] = None, limit: int = 20,
+                   fields: Optional[List[str]] = None):
+    """Customers ordered by ``(name, id)``."""
+    query = select(Customer)
+    if status is not None:
+        query = query.where(Customer.status == status)
+    if customer_type is not None:
+        query = query.where(Customer.type == customer_type)
+    return keyset_page(customer_serializer, query, [('name', Customer.name), ('id', Customer.id)],
+                       cursor, limit, fields)
+
+
+def list_assignments(status: Optional[str] = None, customer_id: Optional[int] = None,
+                     subnet_id: Optional[int] = None, cursor: Optional[str] = None,
+                     limit: int = 20, fields: Optional[List[str]] = None):
+    """Assignments ordered by id."""
+    query = select(Assignment)
+    if status is not None:
+        query = query.where(Assignment.status == status)
+    if customer_id is not None:
+        query = query.where(Assignment.customer_id == customer_id)
+    if subnet_id is not None:
+        query = query.where(Assignment.subnet_id == subnet_id)
+    return keyset_page(assignment_serializer, query, [('id', Assignment.id)],
+                       cursor, limit, fields)
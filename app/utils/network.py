@@ -1,9 +1,33 @@
 """Network utilities for CIDR calculations and subnet management."""
 import ipaddress
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from datetime import datetime
 from typing import List, Optional, Tuple
 
+from sqlalchemy import (and_, bindparam, case, cast, delete, exists, func, insert, literal, or_,
+                        select, tuple_, update)
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm.attributes import flag_modified
+
 from app import db
-from app.models import Subnet
+from app.models import (Assignment, AuditLog, Customer, HostAllocation, Subnet,
+                        invalidate_subnet_lookups, subnet_status_counts, summarize_changes)
+from app.utils.allocator import FreeSpaceMap, cidr_blocks
+from app.utils.audit import record_changes
+from app.utils.cidr_batch import load_subnets, parse_cidrs, parsed_overlap_pairs
+from app.utils.interval_index import MAX_PREFIX, NetworkRange, network_range, subnet_index
+from app.utils.prefix_lookup import prefix_table
+
+# Largest eager or bulk split: 2^16 children, e.g. a /8 into /24s
+MAX_SUBDIVIDE_BITS = 16
+# Rows per multi-row INSERT statement in bulk subdivision
+BULK_INSERT_CHUNK = 5000
+# Ids per IN (...) list when loading owner details
+OWNER_LOOKUP_CHUNK = 1000
+# Ids per DELETE statement when compacting
+COMPACT_DELETE_CHUNK = 1000
+COMPACT_MODES = ('merge', 'collapse')
 
 
 def validate_cidr(cidr_str: str) -> bool:
@@ -60,104 +84,534 @@ def calculate_network_info(network_address: str, prefix_length: int) -> dict:
         return {}
 
 
-def check_subnet_overlap(network_address: str, prefix_length: int, exclude_id: Optional[int] = None) -> List[dict]:
-    """Check for subnet overlaps with existing subnets."""
+def uses_native_cidr() -> bool:
+    """Whether the database stores subnets as native PostgreSQL cidr values."""
+    return db.engine.dialect.name == 'postgresql'
+
+
+def _ancestor_blocks(version: int, start: int, prefix_length: int) -> List[Tuple[int, int]]:
+    """Aligned (start, prefix) pairs of every supernet of a block, itself included."""
+    bits = MAX_PREFIX[version]
+    return [((start >> (bits - p)) << (bits - p), p) for p in range(prefix_length + 1)]
+
+
+def find_overlapping_subnets(network_address: str, prefix_length: int,
+                             exclude_id: Optional[int] = None) -> List[Subnet]:
+    """Return existing subnets overlapping a network, ordered by id."""
+    rng = network_range(network_address, prefix_length)
+    if rng is None:
+        return []
+    
+    # PostgreSQL answers with the GiST-indexed && operator; other backends
+    # use the in-memory interval index.
+    if uses_native_cidr():
+        query = Subnet.query.filter(
+            Subnet.network_cidr.op('&&')(cast(str(rng), postgresql.CIDR)))
+        if exclude_id:
+            query = query.filter(Subnet.id != exclude_id)
+        return query.order_by(Subnet.id).all()
+    
+    overlapping_ids = subnet_index.overlapping(*rng, exclude_id=exclude_id)
+    if not overlapping_ids:
+        return []
+    return Subnet.query.filter(Subnet.id.in_(overlapping_ids)).order_by(Subnet.id).all()
+
+
+def _within_criterion(network):
+    """SQL filter for subnets contained in (or equal to) a network."""
+    if uses_native_cidr():
+        return Subnet.network_cidr.op('<<=')(cast(str(network), postgresql.CIDR))
+    start = int(network.network_address)
+    return and_(
+        Subnet.ip_version == network.version,
+        Subnet.range_start.between(start, start + network.num_addresses - 1),
+        Subnet.prefix_length >= network.prefixlen
+    )
+
+
+def find_subnets_within(subnet_cidr: str) -> List[Subnet]:
+    """Return existing subnets contained in (or equal to) a network."""
     try:
-        new_network = ipaddress.ip_network(f"{network_address}/{prefix_length}")
+        network = ipaddress.ip_network(subnet_cidr)
     except ValueError:
         return []
     
-    overlapping_subnets = []
-    query = Subnet.query
-    if exclude_id:
-        query = query.filter(Subnet.id != exclude_id)
-    
-    existing_subnets = query.all()
+    return Subnet.query.filter(_within_criterion(network)).order_by(
+        Subnet.range_start, Subnet.prefix_length).all()
+
+
+def build_free_space_map(parent_cidr: str) -> Optional[FreeSpaceMap]:
+    """Build the free-space map of a network from the subnets stored inside it.
     
-    for subnet in existing_subnets:
-        try:
-            existing_network = ipaddress.ip_network(subnet.cidr)
-            if new_network.overlaps(existing_network):
-                overlapping_subnets.append({
-                    'id': subnet.id,
-                    'cidr': subnet.cidr,
-                    'status': subnet.status,
-                    'location': subnet.location,
-                    'description': subnet.description
-                })
-        except ValueError:
-            continue
+    A stored subnet equal to the parent itself does not occupy it; only the
+    subnets nested inside do.
+    """
+    try:
+        parent_network = ipaddress.ip_network(parent_cidr)
+    except ValueError:
+        return None
     
-    return overlapping_subnets
+    occupied = db.session.query(Subnet.range_start, Subnet.range_end).filter(
+        _within_criterion(parent_network),
+        Subnet.prefix_length > parent_network.prefixlen
+    )
+    return FreeSpaceMap(parent_network.version, int(parent_network.network_address),
+                        parent_network.prefixlen, occupied)
 
 
-def find_available_subnets(parent_cidr: str, desired_prefix: int, count: int = 1) -> List[str]:
-    """Find available subnets within a parent network."""
+def containing_ip_criterion(ip):
+    """SQL filter for subnets holding an address."""
+    if uses_native_cidr():
+        return Subnet.network_cidr.op('>>=')(cast(str(ip), postgresql.INET))
+    return and_(
+        Subnet.ip_version == ip.version,
+        tuple_(Subnet.range_start, Subnet.prefix_length).in_(
+            _ancestor_blocks(ip.version, int(ip), MAX_PREFIX[ip.version]))
+    )
+
+
+def find_subnets_containing_ip(ip_address: str) -> List[Subnet]:
+    """Return the subnets holding an IP address, most specific first."""
     try:
-        parent_network = ipaddress.ip_network(parent_cidr)
+        ip = ipaddress.ip_address(ip_address)
     except ValueError:
         return []
     
-    if desired_prefix <= parent_network.prefixlen:
+    return Subnet.query.filter(containing_ip_criterion(ip)).order_by(
+        Subnet.prefix_length.desc()).all()
+
+
+def get_ip_owner_details(subnet_ids: List[int]) -> dict:
+    """Subnet, active assignment and customer for each subnet id.
+    
+    Loads only the columns needed for the lookup output, in one query per
+    chunk of ids, and returns ``{subnet_id: details}``.
+    """
+    details = {}
+    for offset in range(0, len(subnet_ids), OWNER_LOOKUP_CHUNK):
+        chunk = subnet_ids[offset:offset + OWNER_LOOKUP_CHUNK]
+        rows = db.session.query(
+            Subnet.id, Subnet.network_address, Subnet.prefix_length, Subnet.status,
+            Subnet.location, Subnet.vlan_id, Assignment.id.label('assignment_id'),
+            Assignment.end_date, Customer.id.label('customer_id'), Customer.name
+        ).outerjoin(
+            Assignment, and_(Assignment.subnet_id == Subnet.id, Assignment.status == 'active')
+        ).outerjoin(Customer, Customer.id == Assignment.customer_id).filter(Subnet.id.in_(chunk))
+        
+        for row in rows:
+            if row.id in details and row.assignment_id is None:
+                continue
+            details[row.id] = {
+                'subnet': {
+                    'id': row.id,
+                    'cidr': f"{row.network_address}/{row.prefix_length}",
+                    'status': row.status,
+                    'location': row.location,
+                    'vlan_id': row.vlan_id,
+                },
+                'assignment': {
+                    'id': row.assignment_id,
+                    'end_date': row.end_date.isoformat() if row.end_date else None,
+                } if row.assignment_id else None,
+                'customer': {
+                    'id': row.customer_id,
+                    'name': row.name,
+                } if row.customer_id else None,
+            }
+    return details
+
+
+def resolve_ip_owners(ip_addresses: List[str]) -> List[dict]:
+    """Most specific owning subnet, assignment and customer of each address.
+    
+    Addresses are resolved in one vectorized pass through the in-memory
+    prefix table; results follow the input order.
+    """
+    owners, invalid = prefix_table.lookup_many(ip_addresses)
+    invalid = set(invalid.tolist())
+    details = get_ip_owner_details(sorted({owner for owner in owners.tolist() if owner >= 0}))
+    
+    results = []
+    for position, (ip_address, owner) in enumerate(zip(ip_addresses, owners.tolist())):
+        result = {'ip': ip_address, 'valid': position not in invalid,
+                  'subnet': None, 'assignment': None, 'customer': None}
+        result.update(details.get(owner, {}))
+        results.append(result)
+    return results
+
+
+def check_subnet_overlap(network_address: str, prefix_length: int, exclude_id: Optional[int] = None) -> List[dict]:
+    """Check for subnet overlaps with existing subnets."""
+    return [{
+        'id': subnet.id,
+        'cidr': subnet.cidr,
+        'status': subnet.status,
+        'location': subnet.location,
+        'description': subnet.description
+    } for subnet in find_overlapping_subnets(network_address, prefix_length, exclude_id)]
+
+
+def check_subnet_overlap_batch(cidrs: List[str]):
+    """Batch form of ``check_subnet_overlap`` for imports and audits.
+    
+    Returns ``(invalid, positions, subnet_ids)`` index arrays: the input
+    positions that are not valid networks, and each (input position, existing
+    subnet id) pair that overlaps, ordered by position.
+    """
+    parsed = parse_cidrs(cidrs)
+    positions, subnet_ids = parsed_overlap_pairs(parsed, load_subnets())
+    return parsed.invalid, positions, subnet_ids
+
+
+def find_available_subnets(parent_cidr: str, desired_prefix: int, count: int = 1,
+                           strategy: str = 'first') -> List[str]:
+    """Find available subnets within a parent network.
+    
+    ``strategy`` is ``'first'`` for the lowest free addresses or ``'best'`` to
+    carve from the smallest free blocks that fit.
+    """
+    free_space = build_free_space_map(parent_cidr)
+    if free_space is None or desired_prefix <= free_space.prefix_length:
         return []
     
+    network_class = ipaddress.IPv4Network if free_space.version == 4 else ipaddress.IPv6Network
     available_subnets = []
     
-    try:
-        # Generate all possible subnets of desired size
-        all_subnets = list(parent_network.subnets(new_prefix=desired_prefix))
-        
-        # Get existing subnets that might conflict
-        existing_subnets = Subnet.query.all()
-        existing_networks = []
-        
-        for subnet in existing_subnets:
-            try:
-                existing_networks.append(ipaddress.ip_network(subnet.cidr))
-            except ValueError:
+    while len(available_subnets) < count:
+        block_start = free_space.allocate(desired_prefix, strategy)
+        if block_start is None:
+            break
+        available_subnets.append(str(network_class((block_start, desired_prefix))))
+    
+    return available_subnets
+
+
+def allocate_child_subnet(parent_subnet_id: int, prefix_length: int, strategy: str = 'first',
+                          **fields) -> Optional[Subnet]:
+    """Carve one child subnet of ``prefix_length`` out of a parent and save it.
+    
+    Works from the occupied ranges inside the parent only, so delegating a
+    /48, /56 or /64 costs the same in a /32 as in a /44. Extra keyword
+    arguments (status, location, vlan_id, description) are set on the child.
+    A lazily subdivided parent only hands out its virtual children: the first
+    one without a row is materialized, and other prefix lengths are refused.
+    """
+    parent = Subnet.query.get(parent_subnet_id)
+    if not parent:
+        return None
+    if parent.virtual_child_prefix and prefix_length != parent.virtual_child_prefix:
+        return None
+    
+    free_space = build_free_space_map(parent.cidr)
+    if free_space is None or prefix_length <= free_space.prefix_length:
+        return None
+    
+    block_start = free_space.allocate(prefix_length, strategy)
+    if block_start is None:
+        return None
+    
+    network_class = ipaddress.IPv4Network if free_space.version == 4 else ipaddress.IPv6Network
+    child_network = network_class((block_start, prefix_length))
+    if parent.virtual_child_prefix:
+        child = materialize_virtual_child(parent.id, str(child_network))
+        for name, value in fields.items():
+            setattr(child, name, value)
+        db.session.commit()
+        return child
+    
+    fields.setdefault('location', parent.location)
+    child = Subnet(
+        network_address=str(child_network.network_address),
+        prefix_length=prefix_length,
+        parent_subnet_id=parent.id,
+        **fields
+    )
+    db.session.add(child)
+    db.session.commit()
+    return child
+
+
+def hosts_to_prefix(hosts: int, ip_version: int = 4) -> int:
+    """Prefix length of the smallest subnet holding ``hosts`` addresses."""
+    if ip_version == 4:
+        return suggest_subnet_size(hosts)
+    # IPv6 host subnets are never smaller than a /64
+    return min(64, 128 - max(hosts - 1, 0).bit_length())
+
+
+def _allocation_pools(ip_version: int, location: Optional[str] = None,
+                      vlan_id: Optional[int] = None, parent_subnet_id: Optional[int] = None,
+                      lock: bool = False) -> List[Subnet]:
+    """Subnets that may be carved into: available ones and subdivided containers."""
+    query = Subnet.query.filter(
+        Subnet.ip_version == ip_version,
+        or_(Subnet.status == 'available',
+            and_(Subnet.status == 'reserved', Subnet.is_subdivided.is_(True)))
+    )
+    if location is not None:
+        query = query.filter(Subnet.location == location)
+    if vlan_id is not None:
+        query = query.filter(Subnet.vlan_id == vlan_id)
+    if parent_subnet_id is not None:
+        parent = Subnet.query.get(parent_subnet_id)
+        if parent is None or parent.network is None:
+            return []
+        query = query.filter(_within_criterion(parent.network))
+    if lock:
+        query = query.with_for_update()
+    return query.order_by(Subnet.range_start, Subnet.prefix_length).all()
+
+
+def _build_pool_maps(pools: List[Subnet]) -> dict:
+    """Free-space maps of many pools from a single query of their contents.
+    
+    The contents are read with one range scan from the lowest pool start to
+    the highest pool end. Rows outside every pool are dropped with a bisect
+    over the outermost pool ranges; a stored subnet then occupies every pool
+    it sits strictly inside, found by looking up its aligned supernet for
+    each pool prefix length.
+    """
+    if not pools:
+        return {}
+    occupied = {pool.id: [] for pool in pools}
+    pools_by_block = defaultdict(list)
+    for pool in pools:
+        rng = pool.address_range
+        pools_by_block[(rng.start, rng.prefix_length)].append(pool.id)
+    version = pools[0].address_range.version
+    bits = MAX_PREFIX[version]
+    pool_prefixes = sorted({prefix for _, prefix in pools_by_block})
+    
+    # CIDR blocks nest or are disjoint, so the outermost ones are sorted and disjoint
+    outer_starts, outer_ends = [], []
+    for start, prefix in sorted(pools_by_block):
+        if outer_ends and start <= outer_ends[-1]:
+            continue
+        outer_starts.append(start)
+        outer_ends.append(start + (1 << (bits - prefix)) - 1)
+    
+    rows = db.session.query(Subnet.range_start, Subnet.range_end, Subnet.prefix_length).filter(
+        Subnet.ip_version == version,
+        Subnet.range_start.between(outer_starts[0], outer_ends[-1]),
+        Subnet.prefix_length > pool_prefixes[0])
+    for start, end, prefix_length in rows:
+        position = bisect_right(outer_starts, start) - 1
+        if position < 0 or end > outer_ends[position]:
+            continue
+        for pool_prefix in pool_prefixes:
+            if pool_prefix >= prefix_length:
+                break
+            host_bits = bits - pool_prefix
+            for pool_id in pools_by_block.get(((start >> host_bits) << host_bits, pool_prefix), ()):
+                occupied[pool_id].append((start, end))
+    
+    return {pool.id: FreeSpaceMap(version, pool.address_range.start, pool.prefix_length,
+                                  occupied[pool.id])
+            for pool in pools}
+
+
+def plan_batch_allocation(requests: List[dict], ip_version: int = 4,
+                          location: Optional[str] = None, vlan_id: Optional[int] = None,
+                          parent_subnet_id: Optional[int] = None,
+                          lock: bool = False) -> Tuple[List[dict], List[dict]]:
+    """Place a list of subnet requests across all matching pools in one pass.
+    
+    Each request gives ``prefix`` or ``hosts`` (plus an optional ``count``).
+    Requests are placed largest first, each into the smallest free block that
+    fits across every pool (best-fit decreasing); ties go to the fullest pool
+    and then the lowest address, so large free blocks stay intact. An empty
+    available leaf that fits a request exactly is used as is instead of
+    getting an identical child. Returns ``(placements, errors)``.
+    """
+    items, errors = [], []
+    for index, request_item in enumerate(requests):
+        try:
+            if request_item.get('prefix') is not None:
+                prefix = int(request_item['prefix'])
+            else:
+                prefix = hosts_to_prefix(int(request_item['hosts']), ip_version)
+            count = int(request_item.get('count', 1))
+        except (KeyError, TypeError, ValueError):
+            errors.append({'index': index, 'error': 'prefix or hosts is required'})
+            continue
+        if not 0 < prefix <= MAX_PREFIX[ip_version] or count < 1:
+            errors.append({'index': index, 'error': 'invalid prefix or count'})
+            continue
+        items.extend((prefix, index, request_item) for _ in range(count))
+    if errors:
+        return [], errors
+    
+    pools = _allocation_pools(ip_version, location, vlan_id, parent_subnet_id, lock=lock)
+    pools_by_id = {pool.id: pool for pool in pools}
+    free_maps = _build_pool_maps(pools)
+    
+    placements = []
+    for prefix, index, request_item in sorted(items, key=lambda item: (item[0], item[1])):
+        best = None
+        for pool_id, free_space in free_maps.items():
+            pool = pools_by_id[pool_id]
+            # Containers are only carved; an available leaf may be used whole
+            if prefix < pool.prefix_length or (prefix == pool.prefix_length
+                                               and pool.status != 'available'):
                 continue
+            # A lazily subdivided pool only yields its virtual children
+            if pool.virtual_child_prefix and prefix != pool.virtual_child_prefix:
+                continue
+            found = free_space.fit(prefix)
+            if found is None:
+                continue
+            block_prefix, block_start = found
+            rank = (-block_prefix, free_space.free_addresses, block_start)
+            if best is None or rank < best[0]:
+                best = (rank, pool_id)
+        if best is None:
+            errors.append({'index': index, 'error': f'no free /{prefix} in the matching pools'})
+            continue
         
-        # Find non-overlapping subnets
-        for subnet in all_subnets:
-            is_available = True
-            
-            for existing in existing_networks:
-                if subnet.overlaps(existing):
-                    is_available = False
-                    break
-            
-            if is_available:
-                available_subnets.append(str(subnet))
-                if len(available_subnets) >= count:
-                    break
-        
-    except ValueError:
-        pass
+        pool_id = best[1]
+        pool, free_space = pools_by_id[pool_id], free_maps[pool_id]
+        block_start = free_space.allocate(prefix, 'best')
+        rng = NetworkRange(ip_version, block_start, prefix)
+        placements.append({
+            'index': index,
+            'cidr': str(rng),
+            'prefix_length': prefix,
+            'pool_id': pool.id,
+            'pool_cidr': pool.cidr,
+            'reuse_pool': prefix == pool.prefix_length,
+            'description': request_item.get('description'),
+        })
+    placements.sort(key=lambda placement: placement['index'])
+    return placements, errors
+
+
+def allocate_subnets_batch(requests: List[dict], customer_id: Optional[int] = None,
+                           assignment: Optional[dict] = None, dry_run: bool = False,
+                           **constraints) -> dict:
+    """Plan and create a batch of subnets, with assignments, in one transaction.
     
-    return available_subnets
+    ``constraints`` are the pool filters of ``plan_batch_allocation``. When
+    ``customer_id`` is given every subnet is assigned to that customer using
+    the ``assignment`` fields (price, currency, start_date, end_date,
+    auto_renew, notes; a request may override ``price``); otherwise the
+    subnets are reserved. With ``dry_run`` the plan is returned without
+    writing anything. Nothing is written unless every request fits.
+    """
+    assignment = assignment or {}
+    if customer_id:
+        missing_price = [{'index': index, 'error': 'price is required'}
+                         for index, request_item in enumerate(requests)
+                         if request_item.get('price', assignment.get('price')) is None]
+        if missing_price:
+            return {'success': False, 'dry_run': dry_run, 'allocations': [],
+                    'errors': missing_price}
+    
+    placements, errors = plan_batch_allocation(requests, lock=not dry_run, **constraints)
+    result = {'success': not errors, 'dry_run': dry_run,
+              'allocations': placements, 'errors': errors}
+    if errors or dry_run:
+        if not dry_run:
+            db.session.rollback()
+        return result
+    
+    status = 'assigned' if customer_id else 'reserved'
+    subnets = []
+    try:
+        for placement in placements:
+            pool = Subnet.query.get(placement['pool_id'])
+            if placement['reuse_pool']:
+                subnet = pool
+                subnet.status = status
+                if placement['description']:
+                    subnet.description = placement['description']
+            elif pool.virtual_child_prefix:
+                subnet = materialize_virtual_child(pool.id, placement['cidr'])
+                subnet.status = status
+                subnet.vlan_id = pool.vlan_id
+                if placement['description']:
+                    subnet.description = placement['description']
+            else:
+                rng = NetworkRange.from_cidr(placement['cidr'])
+                subnet = Subnet(
+                    network_address=rng.address(rng.start),
+                    prefix_length=rng.prefix_length,
+                    parent_subnet_id=pool.id,
+                    status=status,
+                    location=pool.location,
+                    vlan_id=pool.vlan_id,
+                    description=placement['description']
+                )
+                db.session.add(subnet)
+            subnets.append(subnet)
+            
+            if customer_id:
+                price = requests[placement['index']].get('price', assignment.get('price'))
+                db.session.add(Assignment(
+                    subnet=subnet,
+                    customer_id=customer_id,
+                    price=price,
+                    currency=assignment.get('currency', 'USD'),
+                    start_date=assignment.get('start_date') or datetime.utcnow().date(),
+                    end_date=assignment.get('end_date'),
+                    auto_renew=assignment.get('auto_renew', False),
+                    notes=assignment.get('notes')
+                ))
+        db.session.flush()
+        for placement, subnet in zip(placements, subnets):
+            placement['subnet_id'] = subnet.id
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return result
 
 
-def auto_subdivide_subnet(subnet_id: int, target_prefix: int = 24) -> List[dict]:
-    """Automatically subdivide a subnet into smaller subnets."""
+def auto_subdivide_subnet(subnet_id: int, target_prefix: int = 24, mode: str = 'eager') -> List[dict]:
+    """Automatically subdivide a subnet into smaller subnets.
+    
+    ``mode`` selects how children are written:
+    
+    * ``'eager'`` adds one ORM object (and audit entry) per child.
+    * ``'bulk'`` writes all children with multi-row INSERTs and records a
+      single summary audit entry.
+    * ``'lazy'`` only marks the parent as virtually subdivided; a child row is
+      created by ``materialize_virtual_child`` when it is first assigned or
+      edited. Returns an empty list.
+    
+    Eager and bulk splits of more than ``MAX_SUBDIVIDE_BITS`` bits raise
+    ``ValueError``; lazy mode has no such limit.
+    """
     subnet = Subnet.query.get(subnet_id)
     if not subnet:
         return []
     
-    try:
-        parent_network = ipaddress.ip_network(subnet.cidr)
-    except ValueError:
+    parent_network = subnet.network
+    if parent_network is None:
+        return []
+    
+    if target_prefix <= parent_network.prefixlen or target_prefix > parent_network.max_prefixlen:
         return []
     
-    if target_prefix <= parent_network.prefixlen:
+    if mode == 'lazy':
+        subnet.is_subdivided = True
+        subnet.virtual_child_prefix = target_prefix
+        subnet.status = 'reserved'  # Parent is now reserved
+        db.session.commit()
         return []
     
+    # A /32 split into /64s would be 2^32 rows; use lazy mode or allocate_child_subnet
+    if target_prefix - parent_network.prefixlen > MAX_SUBDIVIDE_BITS:
+        raise ValueError(f'splitting {subnet.cidr} into /{target_prefix} subnets exceeds '
+                         f'{MAX_SUBDIVIDE_BITS} bits; use lazy mode')
+    
+    if mode == 'bulk':
+        return _bulk_subdivide(subnet, parent_network, target_prefix)
+    
     created_subnets = []
     
     try:
         # Generate subnets
-        child_subnets = list(parent_network.subnets(new_prefix=target_prefix))
-        
-        for i, child_network in enumerate(child_subnets):
+        for i, child_network in enumerate(parent_network.subnets(new_prefix=target_prefix)):
             # Create new subnet record
             new_subnet = Subnet(
                 network_address=str(child_network.network_address),
@@ -184,52 +638,545 @@ def auto_subdivide_subnet(subnet_id: int, target_prefix: int = 24) -> List[dict]
     return created_subnets
 
 
-def calculate_subnet_utilization(subnet_id: int) -> dict:
-    """Calculate detailed utilization statistics for a subnet."""
-    subnet = Subnet.query.get(subnet_id)
-    if not subnet:
-        return {}
+def _bulk_subdivide(subnet: Subnet, parent_network, target_prefix: int) -> List[dict]:
+    """Write all children of a subdivision with multi-row INSERTs."""
+    parent_cidr = subnet.cidr
+    address_class = type(parent_network.network_address)
+    parent_start = int(parent_network.network_address)
+    child_size = 1 << (parent_network.max_prefixlen - target_prefix)
+    child_count = 1 << (target_prefix - parent_network.prefixlen)
+    
+    rows = []
+    for i in range(child_count):
+        # Children are computed arithmetically and the derived columns and
+        # counters filled here, since bulk inserts skip the mapper events
+        start = parent_start + i * child_size
+        network_address = str(address_class(start))
+        rows.append({
+            'network_address': network_address,
+            'prefix_length': target_prefix,
+            'parent_subnet_id': subnet.id,
+            'status': 'available',
+            'location': subnet.location,
+            'description': f'Auto-subdivided from {parent_cidr} #{i+1}',
+            'network_cidr': f'{network_address}/{target_prefix}',
+            'ip_version': parent_network.version,
+            'range_start': start,
+            'range_end': start + child_size - 1,
+            'assigned_ips': 0,
+            'reserved_ips': 0,
+            'free_ips': child_size,
+        })
     
+    subnets_table = Subnet.__table__
+    created_subnets = []
     try:
-        network = ipaddress.ip_network(subnet.cidr)
-    except ValueError:
-        return {}
+        for offset in range(0, len(rows), BULK_INSERT_CHUNK):
+            chunk = rows[offset:offset + BULK_INSERT_CHUNK]
+            ids = db.session.execute(
+                insert(subnets_table).returning(subnets_table.c.id, sort_by_parameter_order=True),
+                chunk
+            ).scalars().all()
+            for subnet_id, row in zip(ids, chunk):
+                created_subnets.append({
+                    'id': subnet_id,
+                    'cidr': f"{row['network_address']}/{target_prefix}",
+                    'network_address': row['network_address'],
+                    'prefix_length': target_prefix,
+                    'status': row['status'],
+                    'location': row['location'],
+                    'description': row['description'],
+                    'parent_subnet_id': subnet.id,
+                })
+        
+        subnet.is_subdivided = True
+        subnet.status = 'reserved'  # Parent is now reserved
+        # One summary entry, committed with the children, covers the parent too
+        summarize_changes(db.session, 'subnet', [subnet.id])
+        record_changes(db.session, [(
+            'subdivide', 'subnet', subnet.id,
+            f'Subdivided {parent_cidr} into {len(rows)} /{target_prefix} subnets')])
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        return []
     
-    total_ips = network.num_addresses
-    usable_ips = total_ips - 2 if network.version == 4 and network.prefixlen < 31 else total_ips
+    invalidate_subnet_lookups()
+    return created_subnets
+
+
+def materialize_virtual_child(parent_subnet_id: int, child_cidr: str) -> Optional[Subnet]:
+    """Get or create the row of one child of a lazily subdivided subnet.
     
-    # Count assigned IPs from child subnets
-    assigned_ips = 0
-    reserved_ips = 0
+    The new child is flushed but not committed, so it can be saved in the
+    same transaction as the assignment or edit that needed it.
+    """
+    parent = Subnet.query.get(parent_subnet_id)
+    if not parent or not parent.virtual_child_prefix:
+        return None
     
-    for child in subnet.children:
-        child_network = ipaddress.ip_network(child.cidr)
-        child_ips = child_network.num_addresses
-        
-        if child.status == 'assigned':
-            assigned_ips += child_ips
-        elif child.status == 'reserved':
-            reserved_ips += child_ips
+    child_range = NetworkRange.from_cidr(child_cidr)
+    parent_range = parent.address_range
+    if child_range is None or parent_range is None:
+        return None
     
-    # If no children, check if the subnet itself is assigned
-    if not subnet.children and subnet.status == 'assigned':
-        assigned_ips = usable_ips
+    if (child_range.prefix_length != parent.virtual_child_prefix
+            or not parent_range.contains(child_range.start, child_range.version)):
+        return None
     
-    available_ips = usable_ips - assigned_ips - reserved_ips
-    utilization_percent = (assigned_ips / usable_ips * 100) if usable_ips > 0 else 0
+    network_address = child_range.address(child_range.start)
+    child = Subnet.query.filter_by(parent_subnet_id=parent.id, network_address=network_address,
+                                   prefix_length=child_range.prefix_length).first()
+    if child:
+        return child
+    
+    position = (child_range.start - parent_range.start) >> (
+        MAX_PREFIX[child_range.version] - child_range.prefix_length)
+    child = Subnet(
+        network_address=network_address,
+        prefix_length=child_range.prefix_length,
+        parent_subnet_id=parent.id,
+        status='available',
+        location=parent.location,
+        description=f'Auto-subdivided from {parent.cidr} #{position + 1}'
+    )
+    db.session.add(child)
+    db.session.flush()
+    return child
+
+
+def calculate_subnet_utilization(subnet_id: int) -> dict:
+    """Calculate detailed utilization statistics for a subnet."""
+    subnet = Subnet.query.get(subnet_id)
+    if not subnet:
+        return {}
+    
+    # The counters already hold the totals rolled up from all descendants
+    assigned_ips = subnet.assigned_ips or 0
+    reserved_ips = subnet.reserved_ips or 0
+    available_ips = subnet.free_ips or 0
+    total_ips = assigned_ips + reserved_ips + available_ips
+    utilization_percent = (assigned_ips / total_ips * 100) if total_ips > 0 else 0
     
     return {
         'total_ips': total_ips,
-        'usable_ips': usable_ips,
+        'usable_ips': subnet.usable_ips,
         'assigned_ips': assigned_ips,
         'reserved_ips': reserved_ips,
         'available_ips': max(0, available_ips),
         'utilization_percent': round(utilization_percent, 2),
-        'children_count': len(subnet.children),
+        'children_count': Subnet.query.filter_by(parent_subnet_id=subnet.id).count(),
+        'virtual_children_count': subnet.virtual_children_count,
         'is_fully_utilized': utilization_percent >= 100
     }
 
 
+def find_subnets_by_utilization(min_utilization: float = 80.0, limit: Optional[int] = None,
+                                **filters) -> List[Subnet]:
+    """Subnets at or above ``min_utilization`` percent, most utilized first.
+
+    The filter and sort run in the database through the ``Subnet.utilization``
+    expression; extra keyword arguments are passed to ``filter_by``.
+    """
+    query = Subnet.query.filter_by(**filters).filter(
+        Subnet.utilization >= min_utilization
+    ).order_by(Subnet.utilization.desc(), Subnet.id)
+    if limit:
+        query = query.limit(limit)
+    return query.all()
+
+
+def _unused_subnet_criterion():
+    """SQL condition for subnets that can be dropped without losing anything.
+    
+    Available leaves with no virtual children, no assignment history and no
+    allocated hosts. Shared by the fragmentation report and compaction.
+    """
+    subnets = Subnet.__table__
+    children = subnets.alias('children')
+    assignments = Assignment.__table__
+    host_allocations = HostAllocation.__table__
+    return and_(
+        subnets.c.status == 'available',
+        subnets.c.virtual_child_prefix.is_(None),
+        ~exists().where(children.c.parent_subnet_id == subnets.c.id),
+        ~exists().where(assignments.c.subnet_id == subnets.c.id),
+        ~exists().where(host_allocations.c.subnet_id == subnets.c.id,
+                        host_allocations.c.allocated_count > 0),
+    )
+
+
+def _pool_fragmentation(pool, children: List, include_blocks: bool, max_merges: int) -> dict:
+    """Free-space summary of one pool from its direct children's integer ranges.
+    
+    Only the space of a pool that can be carved into is free, the same pools
+    batch allocation uses: available subnets and subdivided reserved ones.
+    Every child occupies its range whatever its status.
+    """
+    version, start, prefix_length = pool.ip_version, pool.range_start, pool.prefix_length
+    rng = NetworkRange(version, start, prefix_length)
+    bits = MAX_PREFIX[version]
+    if pool.status == 'available' or (pool.status == 'reserved' and pool.is_subdivided):
+        occupied = [(child.range_start, child.range_end) for child in children]
+    else:
+        occupied = [(rng.start, rng.end)]
+        children = []
+    free_space = FreeSpaceMap(version, start, prefix_length, occupied)
+    blocks = free_space.blocks()
+    free_addresses = free_space.free_addresses
+    largest_prefix = free_space.largest_free_prefix()
+    largest_size = 1 << (bits - largest_prefix) if largest_prefix is not None else 0
+    largest_start = free_space.fit(largest_prefix, 'first')[1] if blocks else None
+    
+    by_prefix = defaultdict(int)
+    for _, block_prefix in blocks:
+        by_prefix[block_prefix] += 1
+    
+    # Merges: maximal blocks that would appear if the unused children were
+    # folded back into the free space around them
+    reclaimable = sorted((child.range_start, child.id) for child in children if child.reclaimable)
+    merges = []
+    if reclaimable:
+        relaxed = FreeSpaceMap(version, start, prefix_length,
+                               ((child.range_start, child.range_end)
+                                for child in children if not child.reclaimable))
+        free_starts = [free_start for free_start, _ in blocks]
+        for block_start, block_prefix in relaxed.blocks():
+            block_end = block_start + (1 << (bits - block_prefix)) - 1
+            first = bisect_left(reclaimable, (block_start,))
+            last = bisect_right(reclaimable, (block_end, float('inf')))
+            subnet_ids = [child_id for _, child_id in reclaimable[first:last]]
+            pieces = len(subnet_ids) + bisect_right(free_starts, block_end) \
+                - bisect_left(free_starts, block_start)
+            if subnet_ids and pieces > 1:
+                merges.append({
+                    'cidr': str(NetworkRange(version, block_start, block_prefix)),
+                    'prefix_length': block_prefix,
+                    'subnet_ids': subnet_ids,
+                    'pieces': pieces,
+                })
+        merges.sort(key=lambda merge: (merge['prefix_length'], -merge['pieces']))
+    
+    report = {
+        'id': pool.id,
+        'cidr': str(rng),
+        'location': pool.location,
+        'status': pool.status,
+        'total_addresses': rng.num_addresses,
+        'free_addresses': free_addresses,
+        'free_percent': round(free_addresses / rng.num_addresses * 100, 2),
+        'free_block_count': len(blocks),
+        'largest_free_block': (str(NetworkRange(version, largest_start, largest_prefix))
+                               if blocks else None),
+        'largest_free_prefix': largest_prefix,
+        'fragmentation_index': round(1 - largest_size / free_addresses, 4) if free_addresses else 0.0,
+        'free_blocks_by_prefix': dict(sorted(by_prefix.items())),
+        'merges': merges[:max_merges],
+    }
+    if include_blocks:
+        report['free_blocks'] = [str(NetworkRange(version, block_start, block_prefix))
+                                 for block_start, block_prefix in blocks]
+    return report
+
+
+def get_fragmentation_report(pool_ids: Optional[List[int]] = None, location: Optional[str] = None,
+                             ip_version: Optional[int] = None, min_fragmentation: float = 0.0,
+                             include_blocks: bool = False, max_merges: int = 10) -> List[dict]:
+    """Free space of each pool collapsed into maximal CIDR blocks.
+    
+    A pool is a root subnet or any subnet with children (or any subnet named
+    in ``pool_ids``); its free space is the part not covered by a direct
+    child. Per pool the report gives the largest allocatable block, a
+    fragmentation index (0 when all free space is one block, approaching 1
+    as it scatters into small pieces) and the merges that would restore
+    large blocks by folding unused children back in (available leaves
+    without assignments or allocated hosts). Two queries over the integer
+    range columns cover the whole database. Most fragmented pools come first.
+    """
+    subnets = Subnet.__table__
+    children = subnets.alias('children')
+    has_children = exists().where(children.c.parent_subnet_id == subnets.c.id)
+    
+    pool_query = select(
+        subnets.c.id, subnets.c.ip_version, subnets.c.range_start, subnets.c.prefix_length,
+        subnets.c.location, subnets.c.status, subnets.c.is_subdivided
+    ).where(subnets.c.ip_version.isnot(None))
+    if pool_ids is not None:
+        pool_query = pool_query.where(subnets.c.id.in_(pool_ids))
+    else:
+        pool_query = pool_query.where(or_(subnets.c.parent_subnet_id.is_(None),
+                                          subnets.c.virtual_child_prefix.isnot(None),
+                                          has_children))
+    if location is not None:
+        pool_query = pool_query.where(subnets.c.location == location)
+    if ip_version is not None:
+        pool_query = pool_query.where(subnets.c.ip_version == ip_version)
+    pools = db.session.execute(pool_query).all()
+    if not pools:
+        return []
+    
+    child_query = select(
+        subnets.c.id, subnets.c.parent_subnet_id, subnets.c.range_start, subnets.c.range_end,
+        _unused_subnet_criterion().label('reclaimable')
+    ).where(subnets.c.parent_subnet_id.isnot(None), subnets.c.ip_version.isnot(None))
+    if pool_ids is not None or location is not None or ip_version is not None:
+        child_query = child_query.where(
+            subnets.c.parent_subnet_id.in_([pool.id for pool in pools]))
+    children_by_pool = defaultdict(list)
+    for child in db.session.execute(child_query):
+        children_by_pool[child.parent_subnet_id].append(child)
+    
+    reports = [_pool_fragmentation(pool, children_by_pool.get(pool.id, []), include_blocks,
+                                   max_merges)
+               for pool in pools]
+    reports = [report for report in reports
+               if report['fragmentation_index'] >= min_fragmentation]
+    reports.sort(key=lambda report: (-report['fragmentation_index'], report['id']))
+    return reports
+
+
+def _compaction_plan(parent, children: List, mode: str) -> Tuple[List[int], List[Tuple[int, int, int]], bool]:
+    """Children to delete, merged blocks to create and whether the parent collapses.
+    
+    Merged blocks are ``(start, prefix_length, pieces)``. Runs of adjacent
+    unused children are cut into maximal aligned CIDR blocks; a block made
+    of two or more children replaces them.
+    """
+    unused = sorted((child.range_start, child.range_end, child.id)
+                    for child in children if child.unused)
+    if not unused:
+        return [], [], False
+    every_child_unused = len(unused) == len(children)
+    
+    if mode == 'collapse':
+        if not every_child_unused:
+            return [], [], False
+        return [child_id for _, _, child_id in unused], [], True
+    if parent.virtual_child_prefix is not None:
+        # Dropping materialized children returns them to the virtual pool
+        return [child_id for _, _, child_id in unused], [], False
+    
+    bits = MAX_PREFIX[parent.ip_version]
+    removed, blocks = [], []
+    
+    def merge_run(run):
+        position = 0
+        for block_start, block_prefix in cidr_blocks(run[0][0], run[-1][1], bits):
+            block_end = block_start + (1 << (bits - block_prefix)) - 1
+            members = []
+            while position < len(run) and run[position][1] <= block_end:
+                members.append(run[position][2])
+                position += 1
+            if len(members) > 1:
+                removed.extend(members)
+                blocks.append((block_start, block_prefix, len(members)))
+    
+    run = []
+    for child in unused:
+        if run and child[0] != run[-1][1] + 1:
+            merge_run(run)
+            run = []
+        run.append(child)
+    merge_run(run)
+    
+    if len(blocks) == 1 and blocks[0][:2] == (parent.range_start, parent.prefix_length):
+        # The children tile the whole parent: merging would recreate it
+        return removed, [], True
+    return removed, blocks, False
+
+
+def compact_subnet(subnet_id: int, mode: str = 'merge', dry_run: bool = False) -> Optional[dict]:
+    """Fold a subnet's unused children back together.
+    
+    ``collapse`` deletes every child and turns the parent back into an
+    available leaf, and only applies when all children are unused. ``merge``
+    replaces each run of adjacent unused siblings with the largest aligned
+    blocks they tile. Children are deleted and created with set-based
+    statements that re-check the unused condition, so a child assigned in
+    the meantime makes the whole operation roll back. Returns None when the
+    subnet does not exist.
+    """
+    if mode not in COMPACT_MODES:
+        raise ValueError(f'mode must be one of {COMPACT_MODES}')
+    
+    query = Subnet.query.filter_by(id=subnet_id)
+    if not dry_run:
+        query = query.with_for_update()
+    parent = query.first()
+    if parent is None:
+        return None
+    
+    subnets = Subnet.__table__
+    children = db.session.execute(
+        select(subnets.c.id, subnets.c.range_start, subnets.c.range_end,
+               _unused_subnet_criterion().label('unused'))
+        .where(subnets.c.parent_subnet_id == parent.id, subnets.c.ip_version.isnot(None))
+    ).all()
+    removed_ids, blocks, collapse = (_compaction_plan(parent, children, mode)
+                                     if parent.ip_version is not None else ([], [], False))
+    
+    result = {
+        'subnet_id': parent.id,
+        'cidr': parent.cidr,
+        'mode': mode,
+        'dry_run': dry_run,
+        'removed_subnet_ids': removed_ids,
+        'created': [str(NetworkRange(parent.ip_version, block_start, block_prefix))
+                    for block_start, block_prefix, _ in blocks],
+        'collapsed': collapse,
+    }
+    if dry_run or not removed_ids:
+        if not dry_run:
+            db.session.rollback()
+        return result
+    
+    host_allocations = HostAllocation.__table__
+    try:
+        deleted = 0
+        for offset in range(0, len(removed_ids), COMPACT_DELETE_CHUNK):
+            chunk = removed_ids[offset:offset + COMPACT_DELETE_CHUNK]
+            db.session.execute(delete(host_allocations).where(
+                host_allocations.c.subnet_id.in_(chunk), host_allocations.c.allocated_count == 0))
+            deleted += db.session.execute(delete(subnets).where(
+                subnets.c.id.in_(chunk), subnets.c.parent_subnet_id == parent.id,
+                _unused_subnet_criterion())).rowcount
+        if deleted != len(removed_ids):
+            db.session.rollback()
+            result['error'] = 'children changed during compaction'
+            return result
+        
+        # Bulk statements skip the mapper events, so the merged rows carry
+        # their derived columns; unused children hold no assigned or
+        # reserved addresses, so the ancestors' counters stay the same
+        bits = MAX_PREFIX[parent.ip_version]
+        rows = []
+        for block_start, block_prefix, pieces in blocks:
+            block_size = 1 << (bits - block_prefix)
+            rng = NetworkRange(parent.ip_version, block_start, block_prefix)
+            rows.append({
+                'network_address': rng.address(block_start),
+                'prefix_length': block_prefix,
+                'parent_subnet_id': parent.id,
+                'status': 'available',
+                'location': parent.location,
+                'description': f'Merged from {pieces} subnets',
+                'network_cidr': str(rng),
+                'ip_version': parent.ip_version,
+                'range_start': block_start,
+                'range_end': block_start + block_size - 1,
+                'assigned_ips': 0,
+                'reserved_ips': 0,
+                'free_ips': block_size,
+            })
+        for offset in range(0, len(rows), BULK_INSERT_CHUNK):
+            db.session.execute(insert(subnets), rows[offset:offset + BULK_INSERT_CHUNK])
+        
+        if collapse:
+            if parent.is_subdivided and parent.status == 'reserved':
+                parent.status = 'available'
+            parent.is_subdivided = False
+            parent.virtual_child_prefix = None
+            # Recount the parent as a leaf even if nothing else changed
+            flag_modified(parent, 'status')
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    
+    invalidate_subnet_lookups()
+    details = f'Compacted {result["cidr"]}: removed {len(removed_ids)} subnets'
+    if result['created']:
+        details += f', created {", ".join(result["created"])}'
+    if collapse:
+        details += ', restored parent'
+    AuditLog.log_action('compact', 'subnet', result['subnet_id'], details)
+    return result
+
+
+def compact_subnets(subnet_ids: Optional[List[int]] = None, mode: str = 'merge',
+                    dry_run: bool = False, location: Optional[str] = None) -> List[dict]:
+    """Compact every parent with unused children, deepest parents first.
+    
+    Candidates come from one grouped query. Each parent is compacted in its
+    own transaction, so locks stay short on large trees. A collapsed parent
+    may itself become an unused child, so passes repeat until nothing
+    collapses (a dry run makes a single pass). Returns the results of the
+    parents that changed or would change.
+    """
+    if mode not in COMPACT_MODES:
+        raise ValueError(f'mode must be one of {COMPACT_MODES}')
+    
+    subnets = Subnet.__table__
+    parents = subnets.alias('parents')
+    unused_count = func.sum(case((_unused_subnet_criterion(), 1), else_=0))
+    query = (
+        select(parents.c.id)
+        .join(subnets, subnets.c.parent_subnet_id == parents.c.id)
+        .where(parents.c.ip_version.isnot(None))
+        .group_by(parents.c.id, parents.c.prefix_length, parents.c.virtual_child_prefix)
+        .order_by(parents.c.prefix_length.desc(), parents.c.id)
+    )
+    if mode == 'collapse':
+        query = query.having(unused_count == func.count())
+    else:
+        query = query.having(or_(unused_count > 1,
+                                 and_(parents.c.virtual_child_prefix.isnot(None), unused_count > 0)))
+    if subnet_ids is not None:
+        query = query.where(parents.c.id.in_(subnet_ids))
+    if location is not None:
+        query = query.where(parents.c.location == location)
+    
+    results = []
+    while True:
+        collapsed = False
+        for parent_id in db.session.execute(query).scalars().all():
+            result = compact_subnet(parent_id, mode, dry_run)
+            if result and result['removed_subnet_ids']:
+                results.append(result)
+                collapsed = collapsed or (result['collapsed'] and 'error' not in result)
+        if dry_run or not collapsed:
+            return results
+
+
+def rebuild_subnet_counters(batch_size: int = 5000) -> int:
+    """Recompute every subnet's utilization counters from scratch.
+    
+    Used to backfill existing databases and to repair drift; normal writes keep
+    the counters current through the model events. Returns the subnets updated.
+    """
+    rows = db.session.query(Subnet.id, Subnet.parent_subnet_id, Subnet.status,
+                            Subnet.is_subdivided, Subnet.ip_version, Subnet.prefix_length).all()
+    
+    parent_ids = {row.parent_subnet_id for row in rows if row.parent_subnet_id}
+    child_sums = defaultdict(lambda: [0, 0])
+    counters = []
+    # Children always have longer prefixes than their parent, so visiting the
+    # longest prefixes first finishes every child before its parent
+    for row in sorted(rows, key=lambda r: r.prefix_length, reverse=True):
+        total = 1 << (MAX_PREFIX[row.ip_version] - row.prefix_length) if row.ip_version else 0
+        if row.is_subdivided or row.id in parent_ids:
+            assigned, reserved = child_sums.pop(row.id, (0, 0))
+        else:
+            assigned, reserved = subnet_status_counts(row.status, total)
+        if row.parent_subnet_id:
+            sums = child_sums[row.parent_subnet_id]
+            sums[0] += assigned
+            sums[1] += reserved
+        counters.append({'b_id': row.id, 'assigned_ips': assigned, 'reserved_ips': reserved,
+                         'free_ips': total - assigned - reserved})
+    
+    subnets_table = Subnet.__table__
+    statement = update(subnets_table).where(subnets_table.c.id == bindparam('b_id')).values(
+        assigned_ips=bindparam('assigned_ips'),
+        reserved_ips=bindparam('reserved_ips'),
+        free_ips=bindparam('free_ips'),
+    )
+    for offset in range(0, len(counters), batch_size):
+        db.session.execute(statement, counters[offset:offset + batch_size])
+    db.session.commit()
+    return len(counters)
+
+
 def suggest_subnet_size(required_hosts: int) -> int:
     """Suggest appropriate subnet prefix length for required host count."""
     # Add network and broadcast addresses for IPv4
@@ -244,32 +1191,75 @@ def suggest_subnet_size(required_hosts: int) -> int:
     return 8  # Largest possible subnet /8
 
 
-def get_subnet_hierarchy(subnet_id: int) -> dict:
-    """Get the complete hierarchy for a subnet (parents and children)."""
-    subnet = Subnet.query.get(subnet_id)
-    if not subnet:
-        return {}
+def get_subnet_hierarchy(subnet_id: int, max_depth: Optional[int] = None,
+                         subtree_only: bool = False) -> dict:
+    """Get the complete hierarchy for a subnet (parents and children).
     
-    def build_hierarchy(s):
-        return {
-            'id': s.id,
-            'cidr': s.cidr,
-            'status': s.status,
-            'location': s.location,
-            'description': s.description,
-            'utilization': s.utilization,
-            'children': [build_hierarchy(child) for child in s.children]
-        }
+    The tree is fetched with a single recursive query and assembled in memory.
+    With ``subtree_only`` it starts at the subnet itself instead of its root,
+    and ``max_depth`` limits how many levels below the start are returned.
+    Nodes cut off by the depth limit report ``has_children`` so a UI can
+    expand them with a further subtree call.
+    """
+    subnets = Subnet.__table__
+    
+    if subtree_only:
+        start = select(subnets.c.id).where(subnets.c.id == subnet_id).scalar_subquery()
+    else:
+        # Walk up to the root inside the same statement
+        ancestors = select(subnets.c.id, subnets.c.parent_subnet_id).where(
+            subnets.c.id == subnet_id).cte('ancestors', recursive=True)
+        ancestors = ancestors.union_all(
+            select(subnets.c.id, subnets.c.parent_subnet_id).join(
+                ancestors, subnets.c.id == ancestors.c.parent_subnet_id)
+        )
+        start = select(ancestors.c.id).where(
+            ancestors.c.parent_subnet_id.is_(None)).scalar_subquery()
     
-    # Find root parent
-    root = subnet
-    while root.parent:
-        root = root.parent
+    tree = select(subnets.c.id, literal(0).label('depth')).where(
+        subnets.c.id == start).cte('tree', recursive=True)
+    descendants = select(subnets.c.id, (tree.c.depth + 1).label('depth')).join(
+        tree, subnets.c.parent_subnet_id == tree.c.id)
+    if max_depth is not None:
+        descendants = descendants.where(tree.c.depth < max_depth)
+    tree = tree.union_all(descendants)
     
-    # Build complete hierarchy from root
-    hierarchy = build_hierarchy(root)
+    children = subnets.alias('children')
+    rows = db.session.execute(
+        select(subnets.c.id, subnets.c.parent_subnet_id, subnets.c.network_address,
+               subnets.c.prefix_length, subnets.c.status, subnets.c.location,
+               subnets.c.description, subnets.c.assigned_ips, subnets.c.reserved_ips,
+               subnets.c.free_ips, subnets.c.virtual_child_prefix, tree.c.depth,
+               exists().where(children.c.parent_subnet_id == subnets.c.id).label('has_children'))
+        .join(tree, subnets.c.id == tree.c.id)
+        .order_by(tree.c.depth, subnets.c.range_start, subnets.c.prefix_length)
+    ).all()
+    if not rows:
+        return {}
+    
+    nodes = {}
+    for row in rows:
+        assigned_ips = row.assigned_ips or 0
+        total_ips = assigned_ips + (row.reserved_ips or 0) + (row.free_ips or 0)
+        node = {
+            'id': row.id,
+            'cidr': f"{row.network_address}/{row.prefix_length}",
+            'status': row.status,
+            'location': row.location,
+            'description': row.description,
+            'utilization': (assigned_ips / total_ips * 100) if total_ips > 0 else 0.0,
+            'children': [],
+            'has_children': bool(row.has_children),
+            # Lazily subdivided: children not listed above exist only virtually
+            'virtual_child_prefix': row.virtual_child_prefix,
+            'virtual_children_count': (1 << (row.virtual_child_prefix - row.prefix_length)
+                                       if row.virtual_child_prefix else 0)
+        }
+        nodes[row.id] = node
+        if row.depth > 0:
+            nodes[row.parent_subnet_id]['children'].append(node)
     
-    return hierarchy
+    return nodes[rows[0].id]
 
 
 def ip_in_subnet(ip_address: str, subnet_cidr: str) -> bool:
@@ -284,29 +1274,73 @@ def ip_in_subnet(ip_address: str, subnet_cidr: str) -> bool:
 
 def get_next_available_ip(subnet_cidr: str, exclude_ips: List[str] = None) -> Optional[str]:
     """Get the next available IP address in a subnet."""
-    if exclude_ips is None:
-        exclude_ips = []
-    
     try:
         network = ipaddress.ip_network(subnet_cidr)
-        
-        # For /31 and /32, use all addresses
-        if network.prefixlen >= 31:
-            start_ip = network.network_address
-            end_ip = network.broadcast_address
-        else:
-            # Skip network and broadcast addresses
-            start_ip = network.network_address + 1
-            end_ip = network.broadcast_address - 1
-        
-        current_ip = start_ip
-        while current_ip <= end_ip:
-            ip_str = str(current_ip)
-            if ip_str not in exclude_ips:
-                return ip_str
-            current_ip += 1
-            
     except ValueError:
-        pass
+        return None
+    
+    # For /31 and /32, use all addresses
+    if network.prefixlen >= 31:
+        start_ip = int(network.network_address)
+        end_ip = int(network.broadcast_address)
+    else:
+        # Skip network and broadcast addresses
+        start_ip = int(network.network_address) + 1
+        end_ip = int(network.broadcast_address) - 1
+    
+    # Walk the sorted exclusions instead of the address space, so a /64 costs
+    # the same as a /24
+    excluded = set()
+    for ip_str in exclude_ips or []:
+        try:
+            ip = ipaddress.ip_address(ip_str)
+        except ValueError:
+            continue
+        if ip.version == network.version:
+            excluded.add(int(ip))
+    
+    candidate = start_ip
+    for ip in sorted(excluded):
+        if ip < candidate:
+            continue
+        if ip > candidate:
+            break
+        candidate += 1
+    
+    if candidate > end_ip:
+        return None
+    return str(type(network.network_address)(candidate))
+
+
+def allocate_ip(subnet_id: int, ip_address: Optional[str] = None) -> Optional[str]:
+    """Allocate a host address from a subnet's allocation bitmap.
+    
+    Allocates ``ip_address`` when given, otherwise the lowest free address.
+    Returns the allocated address, or None if it is taken or the subnet is full.
+    """
+    subnet = Subnet.query.get(subnet_id)
+    if not subnet:
+        return None
+    
+    try:
+        host_map = HostAllocation.for_subnet(subnet, lock=True)
+    except ValueError:
+        return None
+    
+    if ip_address is None:
+        allocated = host_map.allocate_next()
+    else:
+        allocated = ip_address if host_map.allocate(ip_address) else None
+    
+    db.session.commit()
+    return allocated
+
+
+def release_ip(subnet_id: int, ip_address: str) -> bool:
+    """Return a host address to a subnet's allocation bitmap."""
+    host_map = HostAllocation.query.filter_by(subnet_id=subnet_id).with_for_update().first()
+    if not host_map or not host_map.release(ip_address):
+        return False
     
-    return None
+    db.session.commit()
+    return True
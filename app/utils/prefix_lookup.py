@@ -0,0 +1,203 @@
+"""Longest-prefix-match table resolving IP addresses to their owning subnet."""
+import ipaddress
+import threading
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+from app.utils.cidr_batch import CIDRBatch, address_array, address_keys, parse_ips
+from app.utils.interval_index import (MAX_PREFIX, NetworkRange, TableStamp, network_range,
+                                      subnet_table_stamp)
+
+
+class PrefixLookupTable:
+    """Most specific containing subnet for single addresses and large batches.
+
+    Plays the role of a level-compressed radix trie. Each address family
+    keeps one hash table per prefix length in use, so a single lookup is at
+    most one probe per prefix length and a subnet change is an O(1) update.
+    Batch lookups use a flattened form: since CIDR blocks are either nested
+    or disjoint, the address space splits into consecutive segments that each
+    have exactly one most specific owner. Resolving an address is then a single
+    ``searchsorted`` over the segment starts. The segments of a family are
+    rebuilt from the hash tables on the first batch after that family changes.
+    When identical blocks are nested, the most recently created subnet wins.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._loaded = False
+        self.stamp = TableStamp()
+        self._reset()
+
+    def _reset(self):
+        self._tables: Dict[int, Dict[int, Dict[int, int]]] = {4: {}, 6: {}}
+        self._members: Dict[Tuple[int, int, int], Set[int]] = {}
+        self._ranges: Dict[int, NetworkRange] = {}
+        self._prefixes: Dict[int, List[int]] = {4: [], 6: []}
+        self._segments: Dict[int, Optional[Tuple[np.ndarray, np.ndarray]]] = {4: None, 6: None}
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    def invalidate(self):
+        """Drop the table so the next lookup rebuilds it from the database."""
+        with self._lock:
+            self._reset()
+            self._loaded = False
+
+    def load(self, rows, stamp=None):
+        """Rebuild the table from ``(id, NetworkRange)`` rows."""
+        with self._lock:
+            self._reset()
+            for subnet_id, rng in rows:
+                self._add(subnet_id, rng)
+            self.stamp.set(stamp)
+            self._loaded = True
+
+    def ensure_loaded(self):
+        """Load the table from the ``subnets`` table on first use or once stale."""
+        if self._loaded and self.stamp.is_current():
+            return
+        from app import db
+        from app.models import Subnet
+
+        stamp = subnet_table_stamp()
+        rows = db.session.query(Subnet.id, Subnet.network_address, Subnet.prefix_length,
+                                Subnet.ip_version, Subnet.range_start)
+        self.load(
+            ((subnet_id, NetworkRange(version, start, prefix_length) if version is not None
+              else network_range(network_address, prefix_length))
+             for subnet_id, network_address, prefix_length, version, start in rows),
+            stamp,
+        )
+
+    def _refresh_owner(self, version: int, prefix: int, start: int):
+        members = self._members.get((version, prefix, start))
+        table = self._tables[version].get(prefix)
+        if members:
+            if table is None:
+                table = self._tables[version][prefix] = {}
+                self._prefixes[version] = sorted(self._tables[version], reverse=True)
+            table[start] = max(members)
+        elif table is not None:
+            table.pop(start, None)
+            if not table:
+                del self._tables[version][prefix]
+                self._prefixes[version] = sorted(self._tables[version], reverse=True)
+        self._segments[version] = None
+
+    def _add(self, subnet_id: int, rng: Optional[NetworkRange]):
+        if rng is None:
+            return
+        self._ranges[subnet_id] = rng
+        key = (rng.version, rng.prefix_length, rng.start)
+        self._members.setdefault(key, set()).add(subnet_id)
+        self._refresh_owner(*key)
+
+    def _remove(self, subnet_id: int):
+        rng = self._ranges.pop(subnet_id, None)
+        if rng is None:
+            return
+        key = (rng.version, rng.prefix_length, rng.start)
+        members = self._members.get(key)
+        if members is not None:
+            members.discard(subnet_id)
+            if not members:
+                del self._members[key]
+        self._refresh_owner(*key)
+
+    def upsert(self, subnet_id: int, network_address: str, prefix_length: int):
+        """Insert or move a subnet; a no-op until the table has been loaded."""
+        with self._lock:
+            if not self._loaded:
+                return
+            self._remove(subnet_id)
+            self._add(subnet_id, network_range(network_address, prefix_length))
+
+    def discard(self, subnet_id: int):
+        """Remove a subnet from the table."""
+        with self._lock:
+            if self._loaded:
+                self._remove(subnet_id)
+
+    def lookup(self, ip_address: str) -> Optional[int]:
+        """Id of the most specific subnet containing an address, or None."""
+        try:
+            ip = ipaddress.ip_address(ip_address)
+        except ValueError:
+            return None
+        self.ensure_loaded()
+        value, bits = int(ip), MAX_PREFIX[ip.version]
+        with self._lock:
+            tables = self._tables[ip.version]
+            for prefix in self._prefixes[ip.version]:
+                host_bits = bits - prefix
+                owner = tables[prefix].get((value >> host_bits) << host_bits)
+                if owner is not None:
+                    return owner
+        return None
+
+    def _build_segments(self, version: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Flatten one family into segment start keys and their owner ids."""
+        blocks = sorted(
+            (start, prefix, owner)
+            for prefix, table in self._tables[version].items()
+            for start, owner in table.items()
+        )
+        last_address = (1 << MAX_PREFIX[version]) - 1
+        starts: List[int] = []
+        owners: List[int] = []
+
+        def begin(address, owner):
+            if starts and starts[-1] == address:
+                owners[-1] = owner
+            else:
+                starts.append(address)
+                owners.append(owner)
+
+        stack: List[Tuple[int, int]] = []
+        for start, prefix, owner in blocks:
+            while stack and stack[-1][0] < start:
+                end, _ = stack.pop()
+                begin(end + 1, stack[-1][1] if stack else -1)
+            stack.append((start + (1 << (MAX_PREFIX[version] - prefix)) - 1, owner))
+            begin(start, owner)
+        while stack:
+            end, _ = stack.pop()
+            if end < last_address:
+                begin(end + 1, stack[-1][1] if stack else -1)
+
+        keys = address_keys(version, address_array(version, starts))
+        return keys, np.array(owners, dtype=np.int64)
+
+    def lookup_batch(self, batch: CIDRBatch) -> np.ndarray:
+        """Owner ids for every address of a parsed batch, ``-1`` when none."""
+        self.ensure_loaded()
+        with self._lock:
+            segments = self._segments[batch.version]
+            if segments is None:
+                segments = self._segments[batch.version] = self._build_segments(batch.version)
+        keys, owners = segments
+        if not len(keys):
+            return np.full(len(batch), -1, dtype=np.int64)
+        positions = np.searchsorted(keys, batch.keys(), side='right') - 1
+        return np.where(positions >= 0, owners[np.maximum(positions, 0)], -1)
+
+    def lookup_many(self, ips: Iterable[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """Owner ids aligned with the input addresses, plus invalid positions.
+
+        Invalid addresses and addresses outside every subnet get ``-1``.
+        """
+        ips = ips if isinstance(ips, list) else list(ips)
+        parsed = parse_ips(ips)
+        result = np.full(len(ips), -1, dtype=np.int64)
+        for batch in parsed:
+            if len(batch):
+                result[batch.index] = self.lookup_batch(batch)
+        return result, parsed.invalid
+
+
+# Shared process-wide table kept current by the Subnet model events
+prefix_table = PrefixLookupTable()
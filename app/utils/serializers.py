@@ -0,0 +1,277 @@
+"""Column-projecting list serializers for the JSON API."""
+import json
+from datetime import datetime
+from decimal import Decimal
+from typing import Callable, Dict, List, Optional, Sequence
+
+from flask import Response
+from sqlalchemy import Select, select
+from sqlalchemy.orm import Query, aliased
+
+from app import db
+from app.models import Assignment, AuditLog, Customer, ExchangeRate, Subnet, User
+from app.utils.interval_index import MAX_PREFIX, network_range
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional speedup
+    orjson = None
+
+
+class Field:
+    """One output key: the columns it reads and how to turn them into a value.
+
+    ``columns`` name attributes of the serialized model, or ``join.attr`` for
+    a related model reached through one of the serializer's joins. A field
+    with ``batch`` reads its first column as a key, calls ``batch(keys)``
+    once per result set and converts the entry found for each row.
+    """
+
+    __slots__ = ('columns', 'convert', 'batch', 'default')
+
+    def __init__(self, columns: Sequence[str], convert: Optional[Callable] = None,
+                 batch: Optional[Callable] = None, default=None):
+        self.columns = tuple(columns)
+        self.convert = convert
+        self.batch = batch
+        self.default = default
+
+
+class Serializer:
+    """Turns a query of one model into dicts with a single SELECT.
+
+    Only the columns behind the requested fields are selected; many-to-one
+    fields are outer joins to aliased targets, so they neither clash with
+    joins already in the query nor cost a query per row. Batch fields add
+    one query per result set, so the query count never depends on the
+    number of rows.
+    """
+
+    def __init__(self, model, fields: Dict[str, Field], joins: Optional[Dict] = None):
+        self.model = model
+        self.fields = fields
+        self.joins = joins or {}
+
+    def field_names(self, fields: Optional[Sequence[str]] = None) -> List[str]:
+        """Validate a sparse fieldset; all fields when none is given."""
+        if not fields:
+            return list(self.fields)
+        unknown = [name for name in fields if name not in self.fields]
+        if unknown:
+            raise ValueError(f'unknown fields: {", ".join(unknown)}')
+        return list(dict.fromkeys(fields))
+
+    def statement(self, query=None, fields: Optional[Sequence[str]] = None):
+        """The projected SELECT and, per field, the positions of its columns."""
+        if query is None:
+            statement = select(self.model)
+        elif isinstance(query, Query):
+            statement = query.statement
+        elif isinstance(query, Select):
+            statement = query
+        else:
+            raise TypeError('query must be a Query or Select')
+
+        names = self.field_names(fields)
+        aliases = {}
+        columns, positions = [], {}
+        for name in names:
+            indexes = []
+            for column in self.fields[name].columns:
+                join, _, attribute = column.rpartition('.')
+                if join:
+                    if join not in aliases:
+                        target, onclause = self.joins[join]
+                        aliases[join] = aliased(target)
+                        statement = statement.outerjoin(aliases[join],
+                                                        onclause(self.model, aliases[join]))
+                    expression = getattr(aliases[join], attribute)
+                else:
+                    expression = getattr(self.model, attribute)
+                indexes.append(len(columns))
+                columns.append(expression.label(f'c{len(columns)}'))
+            positions[name] = indexes
+        return statement.with_only_columns(*columns, maintain_column_froms=True), positions
+
+    def serialize(self, query=None, fields: Optional[Sequence[str]] = None) -> List[dict]:
+        """Rows of ``query`` (default: every row) as dicts of the requested fields."""
+        statement, positions = self.statement(query, fields)
+        rows = db.session.execute(statement).all()
+
+        batches = {}
+        for name, indexes in positions.items():
+            field = self.fields[name]
+            if field.batch is not None and field.batch not in batches:
+                keys = list({row[indexes[0]] for row in rows})
+                batches[field.batch] = field.batch(keys) if keys else {}
+
+        plan = [(name, indexes, self.fields[name]) for name, indexes in positions.items()]
+        items = []
+        for row in rows:
+            item = {}
+            for name, indexes, field in plan:
+                if field.batch is not None:
+                    value = batches[field.batch].get(row[indexes[0]], field.default)
+                    item[name] = field.convert(value) if field.convert else value
+                elif field.convert is not None:
+                    item[name] = field.convert(*(row[index] for index in indexes))
+                else:
+                    item[name] = row[indexes[0]]
+            items.append(item)
+        return items
+
+
+def _isoformat(value):
+    return value.isoformat() if value else None
+
+
+def _cidr(network_address, prefix_length):
+    return f'{network_address}/{prefix_length}' if network_address else None
+
+
+def _total_ips(ip_version, network_address, prefix_length):
+    if ip_version is None:
+        rng = network_range(network_address, prefix_length)
+        return rng.num_addresses if rng else 0
+    return 1 << (MAX_PREFIX[ip_version] - prefix_length)
+
+
+def _usable_ips(ip_version, network_address, prefix_length):
+    if ip_version is None:
+        rng = network_range(network_address, prefix_length)
+        return rng.usable_addresses if rng else 0
+    total = 1 << (MAX_PREFIX[ip_version] - prefix_length)
+    return total - 2 if ip_version == 4 and prefix_length < 31 else total
+
+
+def _utilization(assigned_ips, reserved_ips, free_ips):
+    assigned_ips = assigned_ips or 0
+    total_ips = assigned_ips + (reserved_ips or 0) + (free_ips or 0)
+    return round(assigned_ips / total_ips * 100, 2) if total_ips > 0 else 0.0
+
+
+def _is_expired(end_date):
+    return datetime.utcnow().date() > end_date if end_date else False
+
+
+def _days_remaining(end_date):
+    return max(0, (end_date - datetime.utcnow().date()).days) if end_date else None
+
+
+SIZE_COLUMNS = ('ip_version', 'network_address', 'prefix_length')
+COUNTER_COLUMNS = ('assigned_ips', 'reserved_ips', 'free_ips')
+
+# Field sets mirror each model's to_dict
+subnet_serializer = Serializer(Subnet, {
+    'id': Field(['id']),
+    'cidr': Field(['network_address', 'prefix_length'], _cidr),
+    'network_address': Field(['network_address']),
+    'prefix_length': Field(['prefix_length']),
+    'status': Field(['status']),
+    'location': Field(['location']),
+    'vlan_id': Field(['vlan_id']),
+    'description': Field(['description']),
+    'total_ips': Field(SIZE_COLUMNS, _total_ips),
+    'usable_ips': Field(SIZE_COLUMNS, _usable_ips),
+    'utilization': Field(COUNTER_COLUMNS, _utilization),
+    'parent_subnet_id': Field(['parent_subnet_id']),
+    'is_subdivided': Field(['is_subdivided']),
+    'virtual_child_prefix': Field(['virtual_child_prefix']),
+    'created_at': Field(['created_at'], _isoformat),
+    'updated_at': Field(['updated_at'], _isoformat),
+})
+
+customer_serializer = Serializer(Customer, {
+    'id': Field(['id']),
+    'name': Field(['name']),
+    'type': Field(['type']),
+    'email': Field(['email']),
+    'phone': Field(['phone']),
+    'address': Field(['address']),
+    'status': Field(['status']),
+    'created_at': Field(['created_at'], _isoformat),
+    'updated_at': Field(['updated_at'], _isoformat),
+    'notes': Field(['notes']),
+    'active_assignments_count': Field(['id'], lambda totals: totals[0],
+                                      batch=Customer.assignment_totals, default=(0, 0)),
+    'total_assigned_ips': Field(['id'], lambda totals: totals[1],
+                                batch=Customer.assignment_totals, default=(0, 0)),
+})
+
+assignment_serializer = Serializer(Assignment, {
+    'id': Field(['id']),
+    'subnet_id': Field(['subnet_id']),
+    'subnet_cidr': Field(['subnet.network_address', 'subnet.prefix_length'], _cidr),
+    'customer_id': Field(['customer_id']),
+    'customer_name': Field(['customer.name']),
+    'start_date': Field(['start_date'], _isoformat),
+    'end_date': Field(['end_date'], _isoformat),
+    'price': Field(['price'], lambda price: float(price) if price else 0),
+    'currency': Field(['currency']),
+    'status': Field(['status']),
+    'is_expired': Field(['end_date'], _is_expired),
+    'days_remaining': Field(['end_date'], _days_remaining),
+    'auto_renew': Field(['auto_renew']),
+    'notes': Field(['notes']),
+    'created_at': Field(['created_at'], _isoformat),
+}, joins={
+    'subnet': (Subnet, lambda model, target: model.subnet_id == target.id),
+    'customer': (Customer, lambda model, target: model.customer_id == target.id),
+})
+
+audit_log_serializer = Serializer(AuditLog, {
+    'id': Field(['id']),
+    'user_id': Field(['user_id']),
+    'username': Field(['user.username']),
+    'action': Field(['action']),
+    'entity_type': Field(['entity_type']),
+    'entity_id': Field(['entity_id']),
+    'details': Field(['details']),
+    'ip_address': Field(['ip_address']),
+    'user_agent': Field(['user_agent']),
+    'timestamp': Field(['timestamp'], _isoformat),
+}, joins={
+    'user': (User, lambda model, target: model.user_id == target.id),
+})
+
+exchange_rate_serializer = Serializer(ExchangeRate, {
+    'id': Field(['id']),
+    'from_currency': Field(['from_currency']),
+    'to_currency': Field(['to_currency']),
+    'rate': Field(['rate'], float),
+    'updated_at': Field(['updated_at'], _isoformat),
+})
+
+
+def parse_fields(value: Optional[str]) -> Optional[List[str]]:
+    """Split a ``fields=a,b`` query parameter; None when absent."""
+    if not value:
+        return None
+    return [name.strip() for name in value.split(',') if name.strip()]
+
+
+def _default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def dumps(data) -> bytes:
+    """Encode with orjson when installed, the standard library otherwise.
+
+    orjson rejects integers wider than 64 bits, such as IPv6 address counts,
+    so those payloads fall back to the standard encoder.
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(data, default=_default)
+        except TypeError:
+            pass
+    return json.dumps(data, default=_default, separators=(',', ':')).encode()
+
+
+def json_response(data, status: int = 200) -> Response:
+    """Flask response with a body encoded by ``dumps``."""
+    return Response(dumps(data), status=status, mimetype='application/json')
@@ -0,0 +1,62 @@
+"""Short-lived cache of the user columns loaded for each authenticated request."""
+import threading
+import time
+from typing import Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import select
+
+# Everything a request reads from the logged-in user; the password hash and
+# timestamps stay in the database
+USER_COLUMNS = ('id', 'username', 'email', 'is_admin', 'is_active')
+
+
+class UserCache:
+    """Per-process map of user id to column values, kept for a TTL.
+
+    Each load remembers the cache version it started under. Invalidating a
+    user bumps the version, so a load that raced with an update to that
+    user is returned to its caller but not stored. Changes made by other
+    processes show up once an entry's TTL runs out.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: Dict[int, Tuple[float, dict]] = {}
+        self._version = 0
+
+    def load(self, user_id: int, ttl: float) -> Optional[dict]:
+        """Column values of a user, read with one narrow query on a miss."""
+        if ttl > 0:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > time.monotonic():
+                return entry[1]
+
+        from app import db
+        from app.models import User
+
+        version = self._version
+        row = db.session.execute(
+            select(*(getattr(User, column) for column in USER_COLUMNS)).where(User.id == user_id)
+        ).first()
+        if row is None:
+            return None
+        values = dict(row._mapping)
+        if ttl > 0:
+            with self._lock:
+                if self._version == version:
+                    self._entries[user_id] = (time.monotonic() + ttl, values)
+        return values
+
+    def invalidate(self, user_ids: Optional[Iterable[int]] = None):
+        """Drop the given users, or every user, from the cache."""
+        with self._lock:
+            self._version += 1
+            if user_ids is None:
+                self._entries.clear()
+            else:
+                for user_id in user_ids:
+                    self._entries.pop(user_id, None)
+
+
+# Shared process-wide cache; user writes invalidate it through model events
+user_cache = UserCache()
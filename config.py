@@ -58,9 +58,32 @@ class Config:
         'https://api.exchangerate-api.com/v4/latest/'
     EXCHANGE_RATE_CACHE_HOURS = 24
     
+    # Seconds a logged-in user's columns are reused across requests (0 disables)
+    USER_CACHE_SECONDS = int(os.environ.get('USER_CACHE_SECONDS', 60))
+    
     # Pagination
     ITEMS_PER_PAGE = 20
     
+    # IP ownership lookups
+    IP_LOOKUP_MAX_BATCH = int(os.environ.get('IP_LOOKUP_MAX_BATCH', 100000))
+    IP_LOOKUP_CHUNK = int(os.environ.get('IP_LOOKUP_CHUNK', 100000))
+    # Seconds between checks that the in-memory subnet lookups still match
+    # the database (other workers and CLI jobs write it too)
+    SUBNET_LOOKUP_CHECK_SECONDS = float(os.environ.get('SUBNET_LOOKUP_CHECK_SECONDS', 5))
+    
+    # Audit log writer: entries are inserted in batches per transaction, or
+    # after commit by a background thread when AUDIT_LOG_ASYNC is set
+    AUDIT_LOG_ASYNC = os.environ.get('AUDIT_LOG_ASYNC', '').lower() in ('1', 'true', 'yes')
+    AUDIT_LOG_BATCH_SIZE = int(os.environ.get('AUDIT_LOG_BATCH_SIZE', 500))
+    AUDIT_LOG_FLUSH_SECONDS = float(os.environ.get('AUDIT_LOG_FLUSH_SECONDS', 2.0))
+    AUDIT_LOG_QUEUE_SIZE = int(os.environ.get('AUDIT_LOG_QUEUE_SIZE', 10000))
+    
+    # Assignment auto-renewal: extend auto-renew assignments ending within
+    # the lookahead window by whole terms, optionally repricing into one currency
+    ASSIGNMENT_RENEWAL_LOOKAHEAD_DAYS = int(os.environ.get('ASSIGNMENT_RENEWAL_LOOKAHEAD_DAYS', 7))
+    ASSIGNMENT_RENEWAL_MONTHS = int(os.environ.get('ASSIGNMENT_RENEWAL_MONTHS', 1))
+    ASSIGNMENT_RENEWAL_CURRENCY = os.environ.get('ASSIGNMENT_RENEWAL_CURRENCY')
+    
     # Logging
     LOG_TO_STDOUT = os.environ.get('LOG_TO_STDOUT')
     LOG_LEVEL = os.environ.get('LOG_LEVEL') or 'INFO'
@@ -85,8 +108,8 @@ class TestingConfig(Config):
     TESTING = True
     WTF_CSRF_ENABLED = False
     
-    # Use SQLite for testing
-    SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+    # Use SQLite for testing; TEST_DATABASE_URL runs the suite on PostgreSQL
+    SQLALCHEMY_DATABASE_URI = os.environ.get('TEST_DATABASE_URL') or 'sqlite:///:memory:'
     SQLALCHEMY_ENGINE_OPTIONS = {}
     
     # Disable login for testing
@@ -8,6 +8,7 @@ from wtforms import (StringField, PasswordField, BooleanField, SelectField,
 from wtforms.validators import DataRequired, Email, Length, Optional, ValidationError, NumberRange
 
 from app.models import User, Customer, Subnet
+from app.utils.network import check_subnet_overlap
 
 
 class LoginForm(FlaskForm):
@@ -135,20 +136,14 @@ class SubnetForm(FlaskForm):
             return False
 
         # Check overlap with existing subnets
-        existing_subnets = Subnet.query.all()
-        for subnet in existing_subnets:
-            if hasattr(self, 'subnet_id') and subnet.id == self.subnet_id:
-                continue  # Skip self in edit mode
-            
-            try:
-                existing_network = ipaddress.ip_network(subnet.cidr)
-                if new_network.overlaps(existing_network):
-                    self.network_address.errors.append(
-                        f'Bu ağ {subnet.cidr} ile çakışıyor'
-                    )
-                    return False
-            except ValueError:
-                continue
+        exclude_id = getattr(self, 'subnet_id', None)  # Skip self in edit mode
+        overlapping = check_subnet_overlap(str(new_network.network_address),
+                                           new_network.prefixlen, exclude_id=exclude_id)
+        if overlapping:
+            self.network_address.errors.append(
+                f'Bu ağ {overlapping[0]["cidr"]} ile çakışıyor'
+            )
+            return False
 
         return True
 
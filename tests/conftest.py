@@ -0,0 +1,92 @@
+"""Shared fixtures: an application with a fresh database per test."""
+import ipaddress
+
+import pytest
+from flask_login import login_user
+
+from app import create_app, db
+from app.models import Customer, Subnet, User, invalidate_subnet_lookups
+from app.utils.exchange_rates import rate_cache
+from app.utils.network import rebuild_subnet_counters
+from app.utils.user_cache import user_cache
+
+
+def _reset_caches():
+    invalidate_subnet_lookups()
+    rate_cache.invalidate()
+    user_cache.invalidate()
+
+
+@pytest.fixture
+def app():
+    app = create_app('testing')
+    with app.app_context():
+        db.create_all()
+        _reset_caches()
+        yield app
+        db.session.remove()
+        db.drop_all()
+        _reset_caches()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def add_subnet(app):
+    """Create and commit a subnet from CIDR notation."""
+    def add(cidr, parent=None, **columns):
+        network = ipaddress.ip_network(cidr)
+        subnet = Subnet(network_address=str(network.network_address),
+                        prefix_length=network.prefixlen,
+                        parent_subnet_id=parent.id if parent is not None else None,
+                        **columns)
+        db.session.add(subnet)
+        db.session.commit()
+        return subnet
+    return add
+
+
+@pytest.fixture
+def customer(app):
+    customer = Customer(name='Acme', email='noc@acme.example', type='company')
+    db.session.add(customer)
+    db.session.commit()
+    return customer
+
+
+@pytest.fixture
+def counters(app):
+    """Utilization counters by subnet id, asserted to match a full rebuild."""
+    def snapshot():
+        rows = db.session.query(Subnet.id, Subnet.assigned_ips, Subnet.reserved_ips,
+                                Subnet.free_ips)
+        return {row.id: tuple(row[1:]) for row in rows}
+
+    def check():
+        db.session.expire_all()
+        maintained = snapshot()
+        rebuild_subnet_counters()
+        db.session.commit()
+        assert snapshot() == maintained
+        return maintained
+    return check
+
+
+@pytest.fixture
+def user(app):
+    user = User(username='operator', email='operator@example.com')
+    user.set_password('secret')
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+@pytest.fixture
+def logged_in(app, user):
+    """A request context with ``user`` logged in, so changes are audited."""
+    with app.test_request_context():
+        login_user(user)
+        yield user
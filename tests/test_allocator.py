@@ -0,0 +1,83 @@
+"""Tests for the buddy free-space allocator and subnet carving."""
+import pytest
+
+from app.utils.allocator import FreeSpaceMap, cidr_blocks
+from app.utils.interval_index import NetworkRange
+from app.utils.network import allocate_child_subnet, find_available_subnets
+
+
+def _range(cidr):
+    rng = NetworkRange.from_cidr(cidr)
+    return rng.start, rng.end
+
+
+def _cidrs(version, blocks):
+    return [str(NetworkRange(version, start, prefix)) for start, prefix in blocks]
+
+
+def test_cidr_blocks_split_ranges_into_maximal_aligned_blocks():
+    start, _ = _range('10.0.0.0/24')
+    assert _cidrs(4, cidr_blocks(start + 1, start + 254, 32)) == [
+        '10.0.0.1/32', '10.0.0.2/31', '10.0.0.4/30', '10.0.0.8/29', '10.0.0.16/28',
+        '10.0.0.32/27', '10.0.0.64/26', '10.0.0.128/26', '10.0.0.192/27', '10.0.0.224/28',
+        '10.0.0.240/29', '10.0.0.248/30', '10.0.0.252/31', '10.0.0.254/32']
+    assert list(cidr_blocks(0, (1 << 32) - 1, 32)) == [(0, 0)]
+
+
+def test_free_space_map_lists_the_gaps_between_occupied_ranges():
+    start, _ = _range('10.0.0.0/24')
+    free = FreeSpaceMap(4, start, 24, [_range('10.0.0.64/26'), _range('10.0.0.0/27')])
+    assert _cidrs(4, free.blocks()) == ['10.0.0.32/27', '10.0.0.128/25']
+    assert free.free_addresses == 160
+    assert free.largest_free_prefix() == 25
+
+
+def test_first_fit_and_best_fit(app):
+    start, _ = _range('10.0.0.0/24')
+    occupied = [_range('10.0.0.64/26'), _range('10.0.0.0/27')]
+
+    first = FreeSpaceMap(4, start, 24, occupied)
+    assert str(NetworkRange(4, first.allocate(28), 28)) == '10.0.0.32/28'
+    best = FreeSpaceMap(4, start, 24, occupied)
+    assert str(NetworkRange(4, best.allocate(25, 'best'), 25)) == '10.0.0.128/25'
+    assert str(NetworkRange(4, best.allocate(28, 'best'), 28)) == '10.0.0.32/28'
+    assert best.allocate(26) is None and best.allocate(23) is None and best.allocate(33) is None
+
+
+def test_release_merges_free_buddies():
+    start, _ = _range('10.0.0.0/24')
+    free = FreeSpaceMap(4, start, 24)
+    blocks = [free.allocate(26) for _ in range(4)]
+    assert free.free_addresses == 0 and free.allocate(32) is None
+    for block_start in blocks:
+        free.release(block_start, 26)
+    assert _cidrs(4, free.blocks()) == ['10.0.0.0/24']
+
+
+def test_find_available_subnets_skips_existing_children(app, add_subnet):
+    parent = add_subnet('192.168.0.0/24')
+    add_subnet('192.168.0.0/26', parent=parent, status='assigned')
+    add_subnet('192.168.0.128/27', parent=parent)
+
+    assert find_available_subnets('192.168.0.0/24', 26, count=3) == [
+        '192.168.0.64/26', '192.168.0.192/26']
+    assert find_available_subnets('192.168.0.0/24', 27, strategy='best') == ['192.168.0.160/27']
+    assert find_available_subnets('192.168.0.0/24', 24) == []
+    assert find_available_subnets('not a network', 26) == []
+
+
+def test_ipv6_delegation_works_from_occupied_ranges(app, add_subnet):
+    parent = add_subnet('2001:db8::/32')
+    first = allocate_child_subnet(parent.id, 48)
+    second = allocate_child_subnet(parent.id, 48, status='assigned')
+    assert (first.cidr, second.cidr) == ('2001:db8::/48', '2001:db8:1::/48')
+    assert second.status == 'assigned' and second.parent_subnet_id == parent.id
+    assert allocate_child_subnet(parent.id, 64, strategy='best').cidr == '2001:db8:2::/64'
+    assert allocate_child_subnet(parent.id, 32) is None
+
+
+@pytest.mark.parametrize('prefix', [8, 16])
+def test_large_ipv4_parents_are_not_enumerated(app, add_subnet, prefix):
+    add_subnet(f'10.0.0.0/{prefix}')
+    assert find_available_subnets(f'10.0.0.0/{prefix}', 32, count=2) == [
+        '10.0.0.0/32', '10.0.0.1/32']
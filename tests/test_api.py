@@ -0,0 +1,36 @@
+"""Tests for the JSON API routes."""
+import pytest
+
+
+@pytest.fixture
+def csrf_client(app):
+    app.config['WTF_CSRF_ENABLED'] = True
+    return app.test_client()
+
+
+def test_json_posts_need_no_csrf_token(csrf_client, add_subnet):
+    subnet = add_subnet('10.0.0.0/24')
+
+    response = csrf_client.post('/api/v1/ip-lookup', json={'ips': ['10.0.0.1']})
+    assert response.status_code == 200
+    assert response.get_json()['results'][0]['subnet']['id'] == subnet.id
+
+    response = csrf_client.post('/api/v1/allocations',
+                                json={'requests': [{'prefix': 28}], 'dry_run': True})
+    assert response.status_code == 200
+
+    assert csrf_client.post(f'/api/v1/subnets/{subnet.id}/compact',
+                            json={'dry_run': True}).status_code == 200
+    assert csrf_client.post('/api/v1/compact', json={'dry_run': True}).status_code == 200
+
+
+def test_compaction_requires_a_json_body(csrf_client, add_subnet):
+    subnet = add_subnet('10.0.0.0/24')
+    assert csrf_client.post(f'/api/v1/subnets/{subnet.id}/compact',
+                            data={'mode': 'merge'}).status_code == 400
+    assert csrf_client.post('/api/v1/compact').status_code == 400
+
+
+def test_forms_outside_the_api_keep_csrf_protection(csrf_client):
+    response = csrf_client.post('/login', data={'username': 'x', 'password': 'y'})
+    assert response.status_code == 400
@@ -0,0 +1,130 @@
+"""Tests for the assignment expiry sweeper and the auto-renewal engine."""
+from datetime import date
+from decimal import Decimal
+
+import pytest
+
+from app import db
+from app.models import Assignment, AuditLog, ExchangeRate
+from app.utils.assignments import add_months, expire_assignments, renew_assignments
+
+TODAY = date(2025, 3, 10)
+
+
+@pytest.fixture
+def assign(add_subnet, customer):
+    """Create an active assignment, on a new assigned subnet unless one is given."""
+    def create(end_date, subnet=None, cidr=None, **columns):
+        if subnet is None:
+            subnet = add_subnet(cidr, status='assigned')
+        columns.setdefault('price', Decimal('10.00'))
+        assignment = Assignment(subnet_id=subnet.id, customer_id=customer.id,
+                                start_date=date(2024, 1, 1), end_date=end_date, **columns)
+        db.session.add(assignment)
+        db.session.commit()
+        return assignment
+    return create
+
+
+def test_overdue_assignments_expire_and_release_their_subnets(app, add_subnet, assign,
+                                                              counters, user):
+    pool = add_subnet('10.0.0.0/24')
+    leaf = add_subnet('10.0.0.0/26', parent=pool, status='assigned')
+    shared = add_subnet('10.0.0.64/26', parent=pool, status='assigned')
+    overdue = assign(date(2025, 3, 1), subnet=leaf)
+    assign(date(2025, 2, 1), subnet=shared)
+    still_active = assign(date(2025, 12, 31), subnet=shared)
+    current = assign(date(2025, 3, 10), cidr='10.1.0.0/24')
+    ids = (overdue.id, still_active.id, current.id, pool.id, leaf.id, shared.id)
+
+    assert counters()[pool.id] == (128, 0, 128)
+    preview = expire_assignments(today=TODAY, dry_run=True)
+    assert (preview['expired'], preview['released_subnets']) == (2, 1)
+
+    result = expire_assignments(today=TODAY, batch_size=1, user_id=user.id)
+    assert (result['expired'], result['released_subnets'], result['batches']) == (2, 1, 2)
+
+    db.session.expire_all()
+    statuses = {a.id: a.status for a in Assignment.query}
+    assert statuses[ids[0]] == 'expired'
+    assert statuses[ids[1]] == statuses[ids[2]] == 'active'
+    values = counters()
+    assert values[ids[4]] == (0, 0, 64) and values[ids[5]] == (64, 0, 0)
+    assert values[ids[3]] == (64, 0, 192)
+    assert [entry.action for entry in AuditLog.query] == ['expire']
+
+    assert expire_assignments(today=TODAY)['expired'] == 0
+
+
+def test_add_months_clamps_to_the_end_of_the_month():
+    assert add_months(date(2025, 1, 31), 1) == date(2025, 2, 28)
+    assert add_months(date(2024, 1, 31), 1) == date(2024, 2, 29)
+    assert add_months(date(2025, 11, 15), 3) == date(2026, 2, 15)
+    assert add_months(date(2025, 3, 31), -1) == date(2025, 2, 28)
+
+
+def test_due_auto_renew_assignments_are_extended_once(app, assign, user):
+    soon = assign(date(2025, 3, 15), cidr='10.0.0.0/24', auto_renew=True)
+    overdue = assign(date(2025, 1, 20), cidr='10.0.1.0/24', auto_renew=True)
+    manual = assign(date(2025, 3, 12), cidr='10.0.2.0/24')
+    later = assign(date(2025, 5, 1), cidr='10.0.3.0/24', auto_renew=True)
+    ids = (soon.id, overdue.id, manual.id, later.id)
+
+    preview = renew_assignments(lookahead_days=7, term_months=1, today=TODAY, dry_run=True)
+    assert preview['renewed'] == 2
+
+    result = renew_assignments(lookahead_days=7, term_months=1, today=TODAY, batch_size=1,
+                               user_id=user.id)
+    assert (result['renewed'], result['skipped'], result['batches']) == (2, 0, 2)
+    db.session.expire_all()
+    end_dates = {a.id: a.end_date for a in Assignment.query}
+    assert end_dates[ids[0]] == date(2025, 4, 15)
+    # Extended by as many terms as needed to end after the window
+    assert end_dates[ids[1]] == date(2025, 3, 20)
+    assert end_dates[ids[2]] == date(2025, 3, 12)
+    assert end_dates[ids[3]] == date(2025, 5, 1)
+    assert [entry.action for entry in AuditLog.query] == ['renew']
+
+    assert renew_assignments(lookahead_days=7, today=TODAY)['renewed'] == 0
+
+
+def test_renewal_reprices_into_another_currency(app, assign):
+    db.session.add(ExchangeRate(from_currency='USD', to_currency='TRY', rate=Decimal('32.5')))
+    db.session.commit()
+    usd = assign(date(2025, 3, 12), cidr='10.0.0.0/24', auto_renew=True, currency='USD')
+    lira = assign(date(2025, 3, 12), cidr='10.0.1.0/24', auto_renew=True, currency='TRY')
+    ids = (usd.id, lira.id)
+
+    result = renew_assignments(lookahead_days=7, term_months=12, currency='TRY', today=TODAY)
+    assert (result['renewed'], result['repriced']) == (2, 1)
+    db.session.expire_all()
+    usd, lira = (db.session.get(Assignment, assignment_id) for assignment_id in ids)
+    assert (usd.price, usd.currency, usd.end_date) == (Decimal('325.00'), 'TRY',
+                                                       date(2026, 3, 12))
+    assert (lira.price, lira.currency) == (Decimal('10.00'), 'TRY')
+
+
+def test_renewal_rejects_bad_terms(app):
+    with pytest.raises(ValueError):
+        renew_assignments(term_months=0, today=TODAY)
+    with pytest.raises(ValueError):
+        renew_assignments(lookahead_days=-1, today=TODAY)
+
+
+def test_expire_command_reports_its_counts(app, assign):
+    assign(date(2020, 1, 1), cidr='10.0.0.0/24')
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=['expire-assignments', '--dry-run'])
+    assert result.exit_code == 0
+    assert result.output.startswith('1 assignments would be expired, 1 subnets released')
+
+    result = runner.invoke(args=['expire-assignments', '--user', 'nobody'])
+    assert result.exit_code != 0 and 'unknown user nobody' in result.output
+
+
+def test_renew_command_reports_its_counts(app, assign):
+    assign(date.today(), cidr='10.0.0.0/24', auto_renew=True)
+    result = app.test_cli_runner().invoke(args=['renew-assignments', '--dry-run'])
+    assert result.exit_code == 0
+    assert result.output.startswith('1 assignments ending by')
+    assert 'would be renewed' in result.output
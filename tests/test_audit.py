@@ -0,0 +1,83 @@
+"""Tests for batched and asynchronous audit log writing."""
+import pytest
+
+from app import db
+from app.models import AuditLog, Customer, Subnet
+from app.utils import audit
+
+
+def _entries():
+    return [(entry.action, entry.entity_type, entry.details)
+            for entry in AuditLog.query.order_by(AuditLog.id)]
+
+
+def test_changes_are_written_with_the_transaction(app, logged_in):
+    customer = Customer(name='Acme', email='noc@acme.example')
+    db.session.add_all([customer, Subnet(network_address='10.0.0.0', prefix_length=24)])
+    db.session.flush()
+    customer.name = 'Acme Ltd'
+    db.session.flush()
+    assert AuditLog.query.count() == 0
+    db.session.commit()
+
+    assert _entries() == [('create', 'customer', 'Created customer: Acme'),
+                          ('create', 'subnet', 'Created subnet: 10.0.0.0/24'),
+                          ('update', 'customer', 'Updated customer: Acme Ltd')]
+    assert {entry.user_id for entry in AuditLog.query} == {logged_in.id}
+
+
+def test_rolled_back_changes_leave_no_entries(app, logged_in):
+    db.session.add(Customer(name='Ghost', email='ghost@example.com'))
+    db.session.flush()
+    db.session.rollback()
+    db.session.add(Customer(name='Real', email='real@example.com'))
+    db.session.commit()
+    assert _entries() == [('create', 'customer', 'Created customer: Real')]
+
+
+def test_entries_need_a_user(app, user):
+    db.session.add(Customer(name='Anonymous', email='anon@example.com'))
+    db.session.commit()
+    assert AuditLog.query.count() == 0
+
+    AuditLog.log_action('expire', 'assignment', details='Expired 3 assignments')
+    assert AuditLog.query.count() == 0
+    AuditLog.log_action('expire', 'assignment', details='Expired 3 assignments',
+                        user_id=user.id)
+    assert _entries() == [('expire', 'assignment', 'Expired 3 assignments')]
+
+
+def test_large_transactions_are_split_into_batches(app, user, monkeypatch):
+    monkeypatch.setattr(audit, '_batch_size', 7)
+    audit.record_changes(db.session, [('update', 'subnet', i, f'#{i}') for i in range(30)],
+                         user_id=user.id)
+    db.session.commit()
+    assert [entry.entity_id for entry in AuditLog.query.order_by(AuditLog.id)] == list(range(30))
+
+
+@pytest.fixture
+def async_audit(app):
+    app.config.update(AUDIT_LOG_ASYNC=True, AUDIT_LOG_FLUSH_SECONDS=0.05)
+    audit.init_app(app)
+    yield
+    audit.shutdown()
+
+
+def test_async_writer_writes_committed_entries_in_the_background(app, user, async_audit):
+    audit.record_changes(db.session, [('update', 'subnet', i, None) for i in range(5)],
+                         user_id=user.id)
+    db.session.commit()
+    audit.shutdown()
+    assert AuditLog.query.count() == 5
+
+    # Rolled back entries never reach the queue
+    audit.record_changes(db.session, [('update', 'subnet', 99, None)], user_id=user.id)
+    db.session.rollback()
+    assert AuditLog.query.count() == 5
+
+
+def test_closed_queue_hands_rows_back(app):
+    writer = audit.AuditQueue(app, batch_size=10, flush_interval=0.05)
+    writer.close()
+    rows = [{'action': 'update'}]
+    assert writer.put(rows) == rows
@@ -0,0 +1,115 @@
+"""Tests for audit log partitions, archival and keyset browsing."""
+import gzip
+import json
+from datetime import datetime
+
+import pytest
+from sqlalchemy import func, insert, inspect, select
+
+from app import db
+from app.models import AuditLog
+from app.utils.audit_storage import (archive_audit_logs, browse_audit_logs, decode_cursor,
+                                     encode_cursor, ensure_audit_partitions, is_partitioned,
+                                     partition_name)
+
+audit_logs = AuditLog.__table__
+
+
+def _add_logs(user, *timestamps):
+    db.session.execute(insert(audit_logs), [
+        {'user_id': user.id, 'action': 'update', 'entity_type': 'subnet', 'entity_id': index,
+         'timestamp': timestamp}
+        for index, timestamp in enumerate(timestamps)])
+    db.session.commit()
+
+
+def test_partitioning_keeps_rows_without_a_timestamp(app, user):
+    if db.engine.dialect.name != 'postgresql':
+        pytest.skip('audit partitions need PostgreSQL')
+    _add_logs(user, datetime(2024, 1, 15), None, datetime(2024, 3, 2), None)
+
+    created = ensure_audit_partitions(months_ahead=0)
+    assert is_partitioned(db.session.connection())
+    assert {partition_name(datetime(2024, month, 1)) for month in (1, 2, 3)} <= set(created)
+    assert db.session.scalar(select(func.count()).select_from(audit_logs)) == 4
+    assert db.session.scalar(
+        select(func.count()).where(audit_logs.c.timestamp.is_(None))) == 0
+
+
+def test_partitioning_is_a_no_op_outside_postgresql(app, user):
+    if db.engine.dialect.name == 'postgresql':
+        pytest.skip('covered by the PostgreSQL tests')
+    _add_logs(user, datetime(2024, 1, 15), None)
+    assert ensure_audit_partitions() == []
+    assert db.session.scalar(select(func.count()).select_from(audit_logs)) == 2
+
+
+@pytest.mark.parametrize('partitioned', [False, True])
+def test_archive_moves_old_months_to_files(app, user, tmp_path, partitioned):
+    if partitioned and db.engine.dialect.name != 'postgresql':
+        pytest.skip('audit partitions need PostgreSQL')
+    _add_logs(user, datetime(2020, 1, 5), datetime(2020, 1, 20), datetime(2020, 3, 1),
+              datetime.utcnow())
+    if partitioned:
+        ensure_audit_partitions(months_ahead=0)
+
+    def months_with_rows(entries):
+        return [(entry['month'], entry['rows']) for entry in entries if entry['rows']]
+
+    planned = archive_audit_logs(6, str(tmp_path), dry_run=True)
+    assert months_with_rows(planned) == [('2020-01', 2), ('2020-03', 1)]
+    assert not list(tmp_path.iterdir())
+
+    archived = archive_audit_logs(6, str(tmp_path))
+    assert months_with_rows(archived) == [('2020-01', 2), ('2020-03', 1)]
+    with gzip.open(tmp_path / 'audit_logs-2020-01.ndjson.gz') as archive:
+        rows = [json.loads(line) for line in archive]
+    assert [row['entity_id'] for row in rows] == [0, 1]
+    assert not list(tmp_path.glob('*.partial'))
+    assert db.session.scalar(select(func.count()).select_from(audit_logs)) == 1
+    assert archive_audit_logs(6, str(tmp_path)) == []
+    if partitioned:
+        assert not inspect(db.session.connection()).has_table(partition_name(datetime(2020, 2, 1)))
+
+
+def test_browse_pages_newest_first(app, user):
+    _add_logs(user, datetime(2024, 1, 1), datetime(2024, 1, 2), datetime(2024, 1, 2),
+              datetime(2024, 1, 3), datetime(2024, 1, 4))
+
+    seen, cursor = [], None
+    while True:
+        items, cursor = browse_audit_logs(cursor=cursor, limit=2, fields=['entity_id'])
+        seen.append([item['entity_id'] for item in items])
+        if cursor is None:
+            break
+    assert seen == [[4, 3], [2, 1], [0]]
+    assert set(items[0]) == {'entity_id'}
+
+    items, cursor = browse_audit_logs(since=datetime(2024, 1, 2), until=datetime(2024, 1, 3),
+                                      fields=['entity_id', 'username'])
+    assert items == [{'entity_id': 2, 'username': 'operator'},
+                     {'entity_id': 1, 'username': 'operator'}]
+    assert cursor is None
+    assert browse_audit_logs(entity_type='customer')[0] == []
+
+
+def test_browse_skips_rows_without_a_timestamp(app, user):
+    _add_logs(user, datetime(2024, 1, 1), None, datetime(2024, 1, 2), None)
+
+    for limit in (1, 2, 3):
+        seen, cursor = [], None
+        while True:
+            items, cursor = browse_audit_logs(cursor=cursor, limit=limit, fields=['entity_id'])
+            seen.extend(item['entity_id'] for item in items)
+            if cursor is None:
+                break
+        assert seen == [2, 0]
+
+
+def test_cursor_round_trip_and_rejects_garbage():
+    cursor = encode_cursor('2024-01-02T03:04:05', 42)
+    assert decode_cursor(cursor) == (datetime(2024, 1, 2, 3, 4, 5), 42)
+    with pytest.raises(ValueError):
+        decode_cursor('not a cursor')
+    with pytest.raises(ValueError):
+        decode_cursor(encode_cursor('yesterday', 1))
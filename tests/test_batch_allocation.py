@@ -0,0 +1,79 @@
+"""Tests for batch subnet allocation across pools."""
+from app import db
+from app.models import Assignment, Subnet
+from app.utils.network import allocate_subnets_batch, plan_batch_allocation
+
+
+def test_plan_places_largest_first_into_the_tightest_block(app, add_subnet):
+    big = add_subnet('10.0.0.0/24')
+    small = add_subnet('10.1.0.0/24')
+    add_subnet('10.1.0.0/25', parent=small, status='assigned')
+
+    placements, errors = plan_batch_allocation(
+        [{'prefix': 28}, {'hosts': 100}, {'prefix': 26, 'count': 2}])
+    assert errors == []
+    assert [(p['index'], p['cidr'], p['pool_id']) for p in placements] == [
+        (0, '10.0.0.128/28', big.id),
+        (1, '10.1.0.128/25', small.id),
+        (2, '10.0.0.0/26', big.id),
+        (2, '10.0.0.64/26', big.id),
+    ]
+
+
+def test_plan_reports_requests_that_do_not_fit(app, add_subnet):
+    add_subnet('10.0.0.0/28')
+    assert plan_batch_allocation([{'prefix': 24}])[1] == [
+        {'index': 0, 'error': 'no free /24 in the matching pools'}]
+    assert plan_batch_allocation([{'count': 2}])[1][0]['error'] == 'prefix or hosts is required'
+    assert plan_batch_allocation([{'prefix': 33}])[1][0]['error'] == 'invalid prefix or count'
+
+
+def test_an_exactly_fitting_leaf_is_used_whole(app, add_subnet):
+    leaf = add_subnet('10.0.0.0/28')
+    placements, _ = plan_batch_allocation([{'prefix': 28}])
+    assert placements[0]['pool_id'] == leaf.id and placements[0]['reuse_pool']
+
+
+def test_subnets_between_pools_do_not_occupy_them(app, add_subnet):
+    first = add_subnet('10.0.0.0/30')
+    add_subnet('10.0.0.64/26', status='assigned')
+    last = add_subnet('10.0.1.0/30')
+    placements, errors = plan_batch_allocation([{'prefix': 30}, {'prefix': 30}])
+    assert errors == []
+    assert sorted(p['pool_id'] for p in placements) == sorted([first.id, last.id])
+
+
+def test_thousands_of_pools_are_read_with_one_query(app):
+    db.session.add_all(Subnet(network_address=f'10.{i // 16}.{(i % 16) * 16}.0',
+                              prefix_length=28) for i in range(4096))
+    db.session.commit()
+    placements, errors = plan_batch_allocation([{'prefix': 29, 'count': 3}])
+    assert errors == [] and len(placements) == 3
+
+
+def test_allocate_creates_assigned_subnets_in_one_transaction(app, add_subnet, customer,
+                                                             counters):
+    pool = add_subnet('192.168.0.0/24')
+    result = allocate_subnets_batch([{'prefix': 26, 'count': 2, 'price': 10}],
+                                    customer_id=customer.id)
+    assert result['success']
+    ids = [placement['subnet_id'] for placement in result['allocations']]
+    children = Subnet.query.filter(Subnet.id.in_(ids)).all()
+    assert {child.parent_subnet_id for child in children} == {pool.id}
+    assert {child.status for child in children} == {'assigned'}
+    assert Assignment.query.filter(Assignment.subnet_id.in_(ids)).count() == 2
+    assert counters()[pool.id] == (128, 0, 128)
+
+
+def test_allocate_writes_nothing_unless_every_request_fits(app, add_subnet, customer):
+    add_subnet('192.168.0.0/24')
+    result = allocate_subnets_batch([{'prefix': 25, 'price': 1}, {'prefix': 23, 'price': 1}],
+                                    customer_id=customer.id)
+    assert not result['success']
+    assert Subnet.query.count() == 1 and Assignment.query.count() == 0
+
+    result = allocate_subnets_batch([{'prefix': 25}], customer_id=customer.id)
+    assert result['errors'] == [{'index': 0, 'error': 'price is required'}]
+
+    result = allocate_subnets_batch([{'prefix': 25}], dry_run=True)
+    assert result['success'] and Subnet.query.count() == 1
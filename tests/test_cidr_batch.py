@@ -0,0 +1,79 @@
+"""Tests for the vectorized CIDR engine, checked against ``ipaddress``."""
+import ipaddress
+import random
+
+import numpy as np
+
+from app.utils.cidr_batch import (duplicates, most_specific_containing, overlap_pairs,
+                                  overlapping, parse_cidrs, parse_ips, self_overlap_pairs)
+from app.utils.network import check_subnet_overlap_batch
+
+
+def _random_networks(rng, version, count):
+    bits = 32 if version == 4 else 128
+    networks = []
+    for _ in range(count):
+        prefix = rng.randint(8, 30) if version == 4 else rng.randint(16, 64)
+        # A narrow address space so that many networks overlap
+        address = (rng.getrandbits(12) << (bits - 12)) | rng.getrandbits(bits - 12)
+        network = ipaddress.ip_network((address, prefix), strict=False)
+        networks.append(str(network))
+    return networks
+
+
+def test_parse_reports_invalid_positions():
+    parsed = parse_cidrs(['10.0.0.0/8', 'bogus', '10.0.0.1/24', '2001:db8::/129',
+                          '192.168.1.7', '2001:db8::/32', '10.0.0.0/x'])
+    assert parsed.invalid.tolist() == [1, 2, 3, 6]
+    assert parsed.v4.to_strings() == ['10.0.0.0/8', '192.168.1.7/32']
+    assert parsed.v4.index.tolist() == [0, 4]
+    assert parsed.v6.to_strings() == ['2001:db8::/32']
+
+    loose = parse_cidrs(['10.0.0.1/24', '2001:db8::1/32'], strict=False)
+    assert loose.invalid.tolist() == []
+    assert loose.v4.to_strings() + loose.v6.to_strings() == ['10.0.0.0/24', '2001:db8::/32']
+    assert parse_ips(['10.0.0.1', '10.0.0.0/8']).invalid.tolist() == [1]
+
+
+def test_overlaps_match_ipaddress():
+    rng = random.Random(11)
+    for version in (4, 6):
+        a = _random_networks(rng, version, 100)
+        b = _random_networks(rng, version, 100)
+        batch_a, batch_b = parse_cidrs(a).family(version), parse_cidrs(b).family(version)
+        expected = sorted((i, j) for i, x in enumerate(a) for j, y in enumerate(b)
+                          if ipaddress.ip_network(x).overlaps(ipaddress.ip_network(y)))
+        rows_a, rows_b = overlap_pairs(batch_a, batch_b)
+        assert sorted(zip(rows_a.tolist(), rows_b.tolist())) == expected
+        assert overlapping(batch_a, batch_b).tolist() == sorted({i for i, _ in expected})
+
+        within = sorted((i, j) for i, x in enumerate(a) for j, y in enumerate(a)
+                        if i < j and ipaddress.ip_network(x).overlaps(ipaddress.ip_network(y)))
+        rows_a, rows_b = self_overlap_pairs(batch_a)
+        assert sorted(zip(rows_a.tolist(), rows_b.tolist())) == within
+
+
+def test_duplicates_and_most_specific_containing():
+    batch = parse_cidrs(['10.0.0.0/8', '10.1.0.0/16', '10.0.0.0/8', '10.1.0.0/24',
+                         '10.1.0.0/16']).v4
+    assert duplicates(batch).tolist() == [2, 4]
+
+    networks = parse_cidrs(['10.0.0.0/8', '10.1.0.0/16', '10.1.2.0/24', '2001:db8::/32'])
+    ips = parse_ips(['10.1.2.3', '10.1.3.3', '10.9.9.9', '11.0.0.1', '2001:db8::5'])
+    assert most_specific_containing(ips.v4, networks.v4).tolist() == [2, 1, 0, -1]
+    assert most_specific_containing(ips.v6, networks.v6).tolist() == [3]
+    assert most_specific_containing(ips.v4, parse_cidrs([]).v4).tolist() == [-1] * 4
+
+
+def test_batch_overlap_check_against_stored_subnets(app, add_subnet):
+    parent = add_subnet('10.0.0.0/16')
+    child = add_subnet('10.0.1.0/24', parent=parent)
+    add_subnet('2001:db8::/32')
+
+    invalid, positions, subnet_ids = check_subnet_overlap_batch(
+        ['10.0.1.128/25', 'nope', '172.16.0.0/12', '2001:db8:1::/48'])
+    assert invalid.tolist() == [1]
+    pairs = sorted(zip(positions.tolist(), subnet_ids.tolist()))
+    assert pairs[:2] == [(0, parent.id), (0, child.id)]
+    assert [position for position, _ in pairs[2:]] == [3]
+    assert isinstance(positions, np.ndarray)
@@ -0,0 +1,85 @@
+"""Tests for folding unused child subnets back together."""
+from datetime import date
+
+import pytest
+
+from app import db
+from app.models import Assignment, Subnet
+from app.utils.network import compact_subnet, compact_subnets
+
+
+@pytest.fixture
+def quarters(add_subnet):
+    """A subdivided /24 and its four /26 children."""
+    def build(cidr='10.0.0.0/24', statuses=('available',) * 4, parent=None):
+        parent = add_subnet(cidr, parent=parent, status='reserved', is_subdivided=True)
+        base = cidr.rsplit('.', 1)[0]
+        children = [add_subnet(f'{base}.{i * 64}/26', parent=parent, status=status)
+                    for i, status in enumerate(statuses)]
+        return parent, children
+    return build
+
+
+def _children(parent):
+    return sorted(subnet.cidr for subnet in Subnet.query.filter_by(parent_subnet_id=parent.id))
+
+
+def test_merge_replaces_runs_of_unused_children(app, quarters, counters):
+    parent, children = quarters(statuses=('available', 'available', 'assigned', 'available'))
+    before = counters()[parent.id]
+    expected = [children[0].id, children[1].id]
+
+    result = compact_subnet(parent.id)
+    assert result['removed_subnet_ids'] == expected
+    assert result['created'] == ['10.0.0.0/25'] and not result['collapsed']
+    assert _children(parent) == ['10.0.0.0/25', '10.0.0.128/26', '10.0.0.192/26']
+    assert counters()[parent.id] == before
+
+
+def test_merge_of_every_child_collapses_the_parent(app, quarters, counters):
+    parent, _ = quarters()
+    result = compact_subnet(parent.id)
+    assert result['collapsed'] and result['created'] == []
+    db.session.refresh(parent)
+    assert _children(parent) == []
+    assert (parent.status, parent.is_subdivided) == ('available', False)
+    assert counters()[parent.id] == (0, 0, 256)
+
+
+def test_collapse_needs_every_child_unused(app, quarters):
+    parent, children = quarters(statuses=('available', 'available', 'available', 'reserved'))
+    result = compact_subnet(parent.id, mode='collapse')
+    assert result['removed_subnet_ids'] == [] and len(_children(parent)) == 4
+
+
+def test_children_with_assignment_history_are_kept(app, quarters, customer):
+    parent, children = quarters()
+    db.session.add(Assignment(subnet_id=children[0].id, customer_id=customer.id, price=1,
+                              start_date=date(2020, 1, 1), status='expired'))
+    db.session.commit()
+
+    result = compact_subnet(parent.id)
+    assert children[0].id not in result['removed_subnet_ids']
+    assert _children(parent) == ['10.0.0.0/26', '10.0.0.128/25', '10.0.0.64/26']
+
+
+def test_dry_run_writes_nothing(app, quarters):
+    parent, _ = quarters()
+    result = compact_subnet(parent.id, dry_run=True)
+    assert result['collapsed'] and len(result['removed_subnet_ids']) == 4
+    assert len(_children(parent)) == 4
+    assert compact_subnet(-1) is None
+    with pytest.raises(ValueError):
+        compact_subnet(parent.id, mode='shuffle')
+
+
+def test_compact_subnets_repeats_until_nothing_collapses(app, add_subnet, quarters, counters):
+    top = add_subnet('10.0.0.0/23', status='reserved', is_subdivided=True)
+    left, _ = quarters('10.0.0.0/24', parent=top)
+    right, _ = quarters('10.0.1.0/24', parent=top)
+    expected = [left.id, right.id, top.id]
+
+    results = compact_subnets(mode='collapse')
+    assert [result['subnet_id'] for result in results] == expected
+    assert Subnet.query.count() == 1
+    assert counters()[top.id] == (0, 0, 512)
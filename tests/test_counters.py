@@ -0,0 +1,83 @@
+"""Tests for the rolled-up utilization counters and the utilization expression."""
+from sqlalchemy import update
+
+from app import db
+from app.models import Subnet
+from app.utils.network import (calculate_subnet_utilization, find_subnets_by_utilization,
+                               rebuild_subnet_counters)
+
+
+def test_leaf_counters_follow_the_status(app, add_subnet, counters):
+    subnet = add_subnet('10.0.0.0/24')
+    assert counters()[subnet.id] == (0, 0, 256)
+    subnet.status = 'assigned'
+    db.session.commit()
+    assert counters()[subnet.id] == (256, 0, 0)
+    subnet.status = 'reserved'
+    db.session.commit()
+    assert counters()[subnet.id] == (0, 256, 0)
+
+
+def test_children_roll_up_to_every_ancestor(app, add_subnet, counters):
+    top = add_subnet('10.0.0.0/16', status='reserved')
+    middle = add_subnet('10.0.0.0/24', parent=top)
+    leaf = add_subnet('10.0.0.0/26', parent=middle, status='assigned')
+    add_subnet('10.0.0.64/26', parent=middle, status='reserved')
+
+    # A parent's own status no longer counts once it has children
+    assert counters()[top.id] == (64, 64, 65536 - 128)
+    assert counters()[middle.id] == (64, 64, 128)
+
+    leaf.status = 'available'
+    db.session.commit()
+    assert counters()[top.id] == (0, 64, 65536 - 64)
+
+    db.session.delete(leaf)
+    db.session.commit()
+    assert counters()[middle.id] == (0, 64, 192)
+
+
+def test_moves_between_parents(app, add_subnet, counters):
+    first = add_subnet('10.0.0.0/24')
+    second = add_subnet('10.1.0.0/24', status='reserved')
+    child = add_subnet('10.0.0.0/25', parent=first, status='assigned')
+    assert counters()[first.id] == (128, 0, 128)
+
+    child.parent_subnet_id = second.id
+    child.network_address = '10.1.0.0'
+    db.session.commit()
+    values = counters()
+    # Without children a parent falls back to its own status
+    assert values[first.id] == (0, 0, 256)
+    assert values[second.id] == (128, 0, 128)
+
+
+def test_rebuild_repairs_drift(app, add_subnet):
+    parent = add_subnet('10.0.0.0/24')
+    add_subnet('10.0.0.0/25', parent=parent, status='assigned')
+    db.session.execute(update(Subnet.__table__).values(assigned_ips=0, free_ips=0))
+    db.session.commit()
+
+    assert rebuild_subnet_counters() == 2
+    db.session.commit()
+    db.session.refresh(parent)
+    assert (parent.assigned_ips, parent.reserved_ips, parent.free_ips) == (128, 0, 128)
+
+
+def test_utilization_in_python_and_sql(app, add_subnet):
+    busy = add_subnet('10.0.0.0/24')
+    add_subnet('10.0.0.0/25', parent=busy, status='assigned')
+    add_subnet('10.0.0.128/26', parent=busy, status='assigned')
+    full = add_subnet('10.1.0.0/24', status='assigned')
+    add_subnet('10.2.0.0/24')
+
+    assert busy.utilization == 75.0
+    roots = find_subnets_by_utilization(70, parent_subnet_id=None)
+    assert [s.id for s in roots] == [full.id, busy.id]
+    assert len(find_subnets_by_utilization(70)) == 4
+    assert [s.id for s in find_subnets_by_utilization(80, limit=1)][0] != busy.id
+
+    stats = calculate_subnet_utilization(busy.id)
+    assert (stats['assigned_ips'], stats['available_ips'], stats['children_count']) == (192, 64, 2)
+    assert stats['utilization_percent'] == 75.0 and not stats['is_fully_utilized']
+    assert calculate_subnet_utilization(full.id)['is_fully_utilized']
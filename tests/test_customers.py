@@ -0,0 +1,38 @@
+"""Tests for customer assignment totals."""
+from datetime import date
+
+from app import db
+from app.models import Assignment, Customer
+
+
+def _assign(customer, subnet, status='active'):
+    db.session.add(Assignment(subnet_id=subnet.id, customer_id=customer.id, price=1,
+                              start_date=date(2025, 1, 1), status=status))
+    db.session.commit()
+
+
+def test_totals_come_from_one_grouped_query(app, add_subnet, customer):
+    other = Customer(name='Other', email='other@example.com')
+    db.session.add(other)
+    db.session.commit()
+    _assign(customer, add_subnet('10.0.0.0/24', status='assigned'))
+    _assign(customer, add_subnet('10.0.1.0/24', status='assigned'))
+    _assign(customer, add_subnet('10.0.2.0/30', status='assigned'), status='expired')
+    _assign(customer, add_subnet('2001:db8::/48', status='assigned'))
+    _assign(other, add_subnet('10.1.0.0/28', status='assigned'))
+
+    totals = Customer.assignment_totals()
+    assert totals[customer.id] == (3, 512 + (1 << 80))
+    assert totals[other.id] == (1, 16)
+    assert Customer.assignment_totals([other.id]) == {other.id: (1, 16)}
+    assert customer.total_assigned_ips == 512 + (1 << 80)
+
+    data = customer.to_dict()
+    assert (data['active_assignments_count'], data['total_assigned_ips']) == (3, 512 + (1 << 80))
+    assert customer.to_dict(totals=(0, 0))['total_assigned_ips'] == 0
+
+
+def test_customers_without_assignments(app, customer):
+    assert Customer.assignment_totals() == {}
+    assert customer.to_dict()['active_assignments_count'] == 0
+
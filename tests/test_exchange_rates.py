@@ -0,0 +1,62 @@
+"""Tests for the bulk-loaded exchange rate cache."""
+import time
+from datetime import date
+from decimal import Decimal
+
+from sqlalchemy import insert
+
+from app import db
+from app.models import ExchangeRate, ExchangeRateHistory
+from app.utils.exchange_rates import rate_cache
+
+
+def _rate(source, target, rate):
+    db.session.add(ExchangeRate(from_currency=source, to_currency=target, rate=rate))
+    db.session.commit()
+
+
+def test_direct_inverse_and_cross_rates(app):
+    _rate('USD', 'TRY', '30')
+    _rate('EUR', 'USD', '1.25')
+    assert rate_cache.get_rate('USD', 'TRY') == Decimal('30')
+    assert rate_cache.get_rate('USD', 'EUR') == Decimal('0.8')
+    assert rate_cache.get_rate('EUR', 'TRY') == Decimal('37.5')
+    assert rate_cache.get_rate('GBP', 'TRY') == Decimal('1')
+    assert rate_cache.total([(10, 'USD'), (2, 'EUR'), (5, 'TRY')], 'TRY') == Decimal('380')
+
+
+def test_rate_writes_invalidate_the_cache(app):
+    _rate('USD', 'TRY', '30')
+    assert rate_cache.get_rate('USD', 'TRY') == Decimal('30')
+    ExchangeRate.query.one().rate = Decimal('32')
+    db.session.commit()
+    assert rate_cache.get_rate('USD', 'TRY') == Decimal('32')
+
+
+def test_as_of_lookups_use_the_history(app):
+    _rate('USD', 'TRY', '30')
+    db.session.add_all([
+        ExchangeRateHistory(from_currency='USD', to_currency='TRY', rate='20',
+                            effective_date=date(2024, 1, 1)),
+        ExchangeRateHistory(from_currency='USD', to_currency='TRY', rate='25',
+                            effective_date=date(2024, 6, 1)),
+    ])
+    db.session.commit()
+    assert rate_cache.get_rate('USD', 'TRY', date(2024, 3, 1)) == Decimal('20')
+    assert rate_cache.get_rate('USD', 'TRY', date(2024, 6, 1)) == Decimal('25')
+    assert rate_cache.get_rate('USD', 'TRY', date(2023, 1, 1)) == Decimal('30')
+    assert rate_cache.convert(2, 'TRY', 'USD', date(2024, 3, 1)) == Decimal('0.1')
+
+
+def test_history_written_elsewhere_shows_up_after_the_ttl(app, monkeypatch):
+    _rate('USD', 'TRY', '30')
+    assert rate_cache.get_rate('USD', 'TRY', date(2024, 3, 1)) == Decimal('30')
+    # A Core insert skips the model events, like a cron job in another process
+    db.session.execute(insert(ExchangeRateHistory.__table__).values(
+        from_currency='USD', to_currency='TRY', rate=20, effective_date=date(2024, 1, 1)))
+    db.session.commit()
+
+    assert rate_cache.get_rate('USD', 'TRY', date(2024, 3, 1)) == Decimal('30')
+    later = time.monotonic() + 25 * 3600
+    monkeypatch.setattr(time, 'monotonic', lambda: later)
+    assert rate_cache.get_rate('USD', 'TRY', date(2024, 3, 1)) == Decimal('20')
@@ -0,0 +1,64 @@
+"""Tests for the pool fragmentation report."""
+from app.utils.network import get_fragmentation_report
+
+
+def _report(pool):
+    return get_fragmentation_report(pool_ids=[pool.id], include_blocks=True)[0]
+
+
+def test_free_space_is_collapsed_into_maximal_blocks(app, add_subnet):
+    pool = add_subnet('10.0.0.0/24')
+    add_subnet('10.0.0.0/26', parent=pool, status='assigned')
+    add_subnet('10.0.0.128/28', parent=pool, status='reserved')
+
+    report = _report(pool)
+    assert report['free_addresses'] == 256 - 64 - 16
+    assert report['free_blocks'] == ['10.0.0.64/26', '10.0.0.144/28', '10.0.0.160/27',
+                                     '10.0.0.192/26']
+    assert report['largest_free_block'] == '10.0.0.64/26'
+    assert report['free_blocks_by_prefix'] == {26: 2, 27: 1, 28: 1}
+    assert report['fragmentation_index'] == round(1 - 64 / 176, 4)
+
+
+def test_assigned_or_reserved_pools_have_no_free_space(app, add_subnet):
+    # Regression: a childless pool counted as free whatever its status
+    assigned = add_subnet('192.168.0.0/24', status='assigned')
+    reserved = add_subnet('192.168.1.0/24', status='reserved')
+    available = add_subnet('192.168.2.0/24')
+    owner = add_subnet('192.168.4.0/23', status='assigned')
+    add_subnet('192.168.4.0/24', parent=owner, status='assigned')
+
+    for pool in (assigned, reserved, owner):
+        report = _report(pool)
+        assert report['free_addresses'] == 0 and report['free_blocks'] == []
+        assert report['largest_free_block'] is None
+    assert _report(available)['free_addresses'] == 256
+
+
+def test_subdivided_containers_count_the_space_between_children(app, add_subnet):
+    container = add_subnet('10.1.0.0/24', status='reserved', is_subdivided=True)
+    add_subnet('10.1.0.0/25', parent=container, status='assigned')
+    assert _report(container)['free_blocks'] == ['10.1.0.128/25']
+
+
+def test_unused_children_are_offered_as_merges(app, add_subnet):
+    pool = add_subnet('10.2.0.0/24')
+    spare = add_subnet('10.2.0.0/26', parent=pool)
+    add_subnet('10.2.0.128/26', parent=pool, status='assigned')
+
+    report = _report(pool)
+    assert report['free_blocks'] == ['10.2.0.64/26', '10.2.0.192/26']
+    assert report['merges'] == [{'cidr': '10.2.0.0/25', 'prefix_length': 25,
+                                 'subnet_ids': [spare.id], 'pieces': 2}]
+
+
+def test_report_filters_and_orders_pools(app, add_subnet):
+    scattered = add_subnet('10.3.0.0/24', location='IST')
+    add_subnet('10.3.0.64/26', parent=scattered, status='assigned')
+    add_subnet('10.4.0.0/24', location='AMS')
+
+    reports = get_fragmentation_report()
+    assert [report['id'] for report in reports][0] == scattered.id
+    assert [report['cidr'] for report in get_fragmentation_report(location='AMS')] == [
+        '10.4.0.0/24']
+    assert get_fragmentation_report(min_fragmentation=0.9) == []
@@ -0,0 +1,42 @@
+"""Tests for loading subnet trees with one recursive query."""
+from app.utils.network import get_subnet_hierarchy
+
+
+def _cidrs(node):
+    return [child['cidr'] for child in node['children']]
+
+
+def test_hierarchy_starts_at_the_root_and_sorts_children(app, add_subnet):
+    root = add_subnet('10.0.0.0/16')
+    second = add_subnet('10.0.1.0/24', parent=root)
+    first = add_subnet('10.0.0.0/24', parent=root, status='assigned')
+    leaf = add_subnet('10.0.1.128/25', parent=second, status='assigned')
+    add_subnet('192.168.0.0/24')
+
+    tree = get_subnet_hierarchy(leaf.id)
+    assert tree['id'] == root.id and _cidrs(tree) == ['10.0.0.0/24', '10.0.1.0/24']
+    assert _cidrs(tree['children'][1]) == ['10.0.1.128/25']
+    assert tree['children'][0]['id'] == first.id
+    assert tree['utilization'] == 384 / 65536 * 100
+
+
+def test_subtree_and_depth_limit(app, add_subnet):
+    root = add_subnet('10.0.0.0/16')
+    middle = add_subnet('10.0.0.0/20', parent=root)
+    add_subnet('10.0.0.0/24', parent=middle)
+
+    subtree = get_subnet_hierarchy(middle.id, subtree_only=True)
+    assert subtree['id'] == middle.id and _cidrs(subtree) == ['10.0.0.0/24']
+
+    shallow = get_subnet_hierarchy(root.id, max_depth=1)
+    child = shallow['children'][0]
+    assert child['children'] == [] and child['has_children']
+    assert get_subnet_hierarchy(-1) == {}
+
+
+def test_lazy_subdivision_reports_virtual_children(app, add_subnet):
+    parent = add_subnet('10.0.0.0/16', virtual_child_prefix=24, is_subdivided=True,
+                        status='reserved')
+    tree = get_subnet_hierarchy(parent.id)
+    assert (tree['virtual_child_prefix'], tree['virtual_children_count']) == (24, 256)
+    assert not tree['has_children']
@@ -0,0 +1,53 @@
+"""Tests for the bitmap host allocator."""
+from app.models import HostAllocation
+from app.utils.network import allocate_ip, get_next_available_ip, release_ip
+
+
+def test_lowest_free_hosts_are_handed_out_in_order(app, add_subnet):
+    subnet = add_subnet('192.168.0.0/29')
+    assert [allocate_ip(subnet.id) for _ in range(7)] == [
+        '192.168.0.1', '192.168.0.2', '192.168.0.3', '192.168.0.4', '192.168.0.5',
+        '192.168.0.6', None]
+    host_map = HostAllocation.query.filter_by(subnet_id=subnet.id).one()
+    assert (host_map.allocated_count, host_map.free_count) == (6, 0)
+
+
+def test_specific_addresses_and_release(app, add_subnet):
+    subnet = add_subnet('192.168.0.0/24')
+    assert allocate_ip(subnet.id, '192.168.0.1') == '192.168.0.1'
+    assert allocate_ip(subnet.id, '192.168.0.1') is None
+    assert allocate_ip(subnet.id, '192.168.0.0') is None
+    assert allocate_ip(subnet.id, '192.168.0.255') is None
+    assert allocate_ip(subnet.id, '10.0.0.1') is None
+    assert allocate_ip(subnet.id) == '192.168.0.2'
+
+    assert release_ip(subnet.id, '192.168.0.1')
+    assert not release_ip(subnet.id, '192.168.0.1')
+    assert allocate_ip(subnet.id) == '192.168.0.1'
+    assert allocate_ip(subnet.id) == '192.168.0.3'
+
+
+def test_point_to_point_and_ipv6_subnets_use_every_address(app, add_subnet):
+    link = add_subnet('10.0.0.0/31')
+    assert [allocate_ip(link.id) for _ in range(3)] == ['10.0.0.0', '10.0.0.1', None]
+    v6 = add_subnet('2001:db8::/126')
+    assert [allocate_ip(v6.id) for _ in range(5)] == [
+        '2001:db8::', '2001:db8::1', '2001:db8::2', '2001:db8::3', None]
+
+
+def test_full_bytes_are_skipped(app, add_subnet):
+    subnet = add_subnet('10.0.0.0/22')
+    for _ in range(600):
+        allocate_ip(subnet.id)
+    assert release_ip(subnet.id, '10.0.0.7')
+    assert allocate_ip(subnet.id) == '10.0.0.7'
+    assert allocate_ip(subnet.id) == '10.0.2.89'
+
+
+def test_next_available_ip_walks_the_exclusions():
+    assert get_next_available_ip('10.0.0.0/24') == '10.0.0.1'
+    assert get_next_available_ip('10.0.0.0/24', ['10.0.0.1', '10.0.0.2', '10.0.0.9']) \
+        == '10.0.0.3'
+    assert get_next_available_ip('10.0.0.0/30', ['10.0.0.1', '10.0.0.2']) is None
+    assert get_next_available_ip('2001:db8::/64', ['2001:db8::', 'junk']) == '2001:db8::1'
+    assert get_next_available_ip('nonsense') is None
@@ -0,0 +1,122 @@
+"""Tests for the in-memory interval index and overlap checks."""
+from sqlalchemy import delete, insert
+
+from app import db
+from app.models import Subnet
+from app.utils.interval_index import (NetworkRange, SubnetIntervalIndex, network_range,
+                                      subnet_index)
+from app.utils.network import check_subnet_overlap, find_overlapping_subnets
+
+
+def test_network_range_parse():
+    rng = NetworkRange.from_cidr('10.1.0.0/16')
+    assert tuple(rng) == (4, 0x0A010000, 0x0A01FFFF, 16)
+    assert rng.num_addresses == 65536
+    assert rng.usable_addresses == 65534
+    assert str(rng) == '10.1.0.0/16'
+    assert NetworkRange.from_cidr('10.1.0.1/16') is None
+    assert NetworkRange.from_cidr('bogus') is None
+    assert network_range('2001:db8::', 32).num_addresses == 1 << 96
+
+
+def test_network_range_contains_and_overlaps():
+    outer = NetworkRange.from_cidr('10.0.0.0/8')
+    inner = NetworkRange.from_cidr('10.20.0.0/16')
+    other = NetworkRange.from_cidr('11.0.0.0/8')
+    assert outer.overlaps(inner) and inner.overlaps(outer)
+    assert not outer.overlaps(other)
+    assert outer.contains(inner.start)
+    assert not outer.contains(inner.start, version=6)
+
+
+def test_index_finds_children_ancestors_and_equal_blocks():
+    index = SubnetIntervalIndex()
+    index.load([
+        (1, NetworkRange.from_cidr('10.0.0.0/8')),
+        (2, NetworkRange.from_cidr('10.1.0.0/16')),
+        (3, NetworkRange.from_cidr('10.1.2.0/24')),
+        (4, NetworkRange.from_cidr('192.168.0.0/24')),
+        (5, NetworkRange.from_cidr('2001:db8::/32')),
+    ])
+    assert index.overlapping(*NetworkRange.from_cidr('10.1.0.0/16')) == [1, 2, 3]
+    assert index.overlapping(*NetworkRange.from_cidr('10.1.2.128/25')) == [1, 2, 3]
+    assert index.overlapping(*NetworkRange.from_cidr('10.2.0.0/16')) == [1]
+    assert index.overlapping(*NetworkRange.from_cidr('172.16.0.0/12')) == []
+    assert index.overlapping(*NetworkRange.from_cidr('2001:db8:1::/48')) == [5]
+    assert index.overlapping(*NetworkRange.from_cidr('10.1.0.0/16'), exclude_id=2) == [1, 3]
+
+
+def test_index_upsert_and_discard():
+    index = SubnetIntervalIndex()
+    index.load([(1, NetworkRange.from_cidr('10.0.0.0/24'))])
+    index.upsert(2, '10.0.1.0', 24)
+    index.upsert(1, '10.0.2.0', 24)
+    assert index.overlapping(*NetworkRange.from_cidr('10.0.0.0/23')) == [2]
+    index.discard(2)
+    assert index.overlapping(*NetworkRange.from_cidr('10.0.0.0/22')) == [1]
+
+
+def test_overlap_check_follows_database_writes(app, add_subnet):
+    parent = add_subnet('10.0.0.0/16')
+    child = add_subnet('10.0.1.0/24', parent=parent)
+
+    assert [s.id for s in find_overlapping_subnets('10.0.1.128', 25)] == [parent.id, child.id]
+    assert [o['id'] for o in check_subnet_overlap('10.0.0.0', 8)] == [parent.id, child.id]
+    assert check_subnet_overlap('10.0.1.0', 24, exclude_id=child.id)[0]['id'] == parent.id
+    assert check_subnet_overlap('10.1.0.0', 16) == []
+
+    child.network_address = '10.0.5.0'
+    db.session.commit()
+    assert [s.id for s in find_overlapping_subnets('10.0.1.0', 24)] == [parent.id]
+    assert [s.id for s in find_overlapping_subnets('10.0.5.0', 24)] == [parent.id, child.id]
+
+    db.session.delete(child)
+    db.session.commit()
+    assert [s.id for s in find_overlapping_subnets('10.0.5.0', 24)] == [parent.id]
+
+
+def test_index_reloads_after_writes_made_elsewhere(app, add_subnet):
+    parent_id = add_subnet('10.0.0.0/16').id
+    subnet_index.ensure_loaded()
+    # Core statements skip the model events, like another process would
+    subnets = Subnet.__table__
+    db.session.execute(insert(subnets).values(network_address='10.0.9.0', prefix_length=24))
+    db.session.execute(delete(subnets).where(subnets.c.id == parent_id))
+    db.session.commit()
+
+    app.config['SUBNET_LOOKUP_CHECK_SECONDS'] = 3600
+    assert subnet_index.overlapping(*NetworkRange.from_cidr('10.0.0.0/8')) == [parent_id]
+    app.config['SUBNET_LOOKUP_CHECK_SECONDS'] = 0
+    found = subnet_index.overlapping(*NetworkRange.from_cidr('10.0.0.0/8'))
+    assert len(found) == 1 and found != [parent_id]
+
+
+def _indexed(cidr):
+    return subnet_index.overlapping(*NetworkRange.from_cidr(cidr))
+
+
+def test_local_writes_do_not_reload_the_index(app, add_subnet, monkeypatch):
+    parent = add_subnet('10.0.0.0/16')
+    subnet_index.ensure_loaded()
+    app.config['SUBNET_LOOKUP_CHECK_SECONDS'] = 0
+    loads = []
+    load = subnet_index.load
+    monkeypatch.setattr(subnet_index, 'load', lambda *args: loads.append(args) or load(*args))
+
+    child = add_subnet('10.0.1.0/24', parent=parent)
+    assert _indexed('10.0.1.0/24') == [parent.id, child.id]
+    child.network_address = '10.0.2.0'
+    db.session.commit()
+    assert _indexed('10.0.1.0/24') == [parent.id]
+    db.session.delete(child)
+    db.session.commit()
+    assert _indexed('10.0.2.0/24') == [parent.id]
+    assert loads == []
+
+    # A write made elsewhere before a local one still forces a reload
+    db.session.execute(insert(Subnet.__table__).values(network_address='10.0.9.0',
+                                                       prefix_length=24))
+    db.session.commit()
+    add_subnet('10.0.3.0/24', parent=parent)
+    assert len(_indexed('10.0.9.0/24')) == 2
+    assert len(loads) == 1
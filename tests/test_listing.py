@@ -0,0 +1,80 @@
+"""Tests for the keyset-paginated JSON listings."""
+from datetime import date
+
+import pytest
+
+from app import db
+from app.models import Assignment, Customer
+from app.utils.listing import decode_cursor, encode_cursor, list_customers
+
+
+def _walk(client, url, limit):
+    items, cursor, pages = [], None, 0
+    while True:
+        query = f'{url}{"&" if "?" in url else "?"}limit={limit}'
+        response = client.get(query + (f'&cursor={cursor}' if cursor else ''))
+        assert response.status_code == 200
+        body = response.get_json()
+        items.extend(body['items'])
+        pages += 1
+        cursor = body['next_cursor']
+        if cursor is None:
+            return items, pages
+
+
+def test_cursor_round_trip():
+    cursor = encode_cursor(['10.0.0.0', 42])
+    assert decode_cursor(cursor, 2) == ['10.0.0.0', 42]
+    for bad in ('!!!', encode_cursor([1]), encode_cursor({'a': 1})):
+        with pytest.raises(ValueError):
+            decode_cursor(bad, 2)
+
+
+def test_subnet_pages_cover_every_row_once(app, client, add_subnet):
+    parent = add_subnet('10.0.0.0/16', location='IST')
+    for i in range(23):
+        add_subnet(f'10.0.{i}.0/24', parent=parent, location='IST')
+
+    items, pages = _walk(client, '/api/v1/subnets', 5)
+    assert pages == 5 and len(items) == 24
+    keys = [(item['network_address'], item['id']) for item in items]
+    assert keys == sorted(keys) and len(set(keys)) == 24
+
+    items, _ = _walk(client, '/api/v1/subnets?parent_id=0&fields=id,cidr', 10)
+    assert items == [{'id': parent.id, 'cidr': '10.0.0.0/16'}]
+
+    items, _ = _walk(client, '/api/v1/subnets?contains=10.0.7.9&fields=cidr', 10)
+    assert sorted(item['cidr'] for item in items) == ['10.0.0.0/16', '10.0.7.0/24']
+
+
+def test_invalid_parameters_are_rejected(app, client):
+    assert client.get('/api/v1/subnets?cursor=garbage').status_code == 400
+    assert client.get('/api/v1/subnets?contains=not-an-ip').status_code == 400
+    response = client.get('/api/v1/customers?fields=id,secret')
+    assert response.status_code == 400
+    assert response.get_json()['error'].startswith('Geçersiz parametre')
+
+
+def test_customer_names_tie_break_on_id(app):
+    db.session.add_all(Customer(name=name, email=f'{i}@example.com', status=status)
+                       for i, (name, status) in enumerate([('Beta', 'active'), ('Acme', 'active'),
+                                                           ('Beta', 'inactive'), ('Beta', 'active')]))
+    db.session.commit()
+
+    first, cursor = list_customers(limit=2, fields=['name'])
+    second, last = list_customers(cursor=cursor, limit=2, fields=['name'])
+    assert [item['name'] for item in first + second] == ['Acme', 'Beta', 'Beta', 'Beta']
+    assert last is None
+    assert len(list_customers(status='active')[0]) == 3
+
+
+def test_assignment_filters(app, client, add_subnet, customer):
+    subnet = add_subnet('10.0.0.0/24', status='assigned')
+    db.session.add_all(Assignment(subnet_id=subnet.id, customer_id=customer.id, price=5,
+                                  start_date=date(2025, 1, 1), status=status)
+                       for status in ('active', 'expired', 'active'))
+    db.session.commit()
+
+    items, _ = _walk(client, f'/api/v1/assignments?status=active&customer_id={customer.id}', 1)
+    assert [item['status'] for item in items] == ['active', 'active']
+    assert items[0]['id'] < items[1]['id']
@@ -0,0 +1,33 @@
+"""Tests for the Subnet model's cached network and derived columns."""
+from app.models import Subnet
+
+
+def test_parsed_network_is_cached_until_the_address_changes():
+    subnet = Subnet(network_address='10.0.0.0', prefix_length=24)
+    rng = subnet.address_range
+    assert subnet.address_range is rng
+    assert subnet.network is subnet.network
+    assert str(subnet.network) == '10.0.0.0/24'
+    assert (subnet.total_ips, subnet.usable_ips) == (256, 254)
+
+    subnet.prefix_length = 25
+    assert subnet.address_range is not rng
+    assert str(subnet.network) == '10.0.0.0/25'
+    subnet.network_address = 'garbage'
+    assert subnet.address_range is None and subnet.network is None
+    assert subnet.total_ips == 0
+
+
+def test_membership_and_overlap_use_the_integer_range():
+    subnet = Subnet(network_address='2001:db8::', prefix_length=32)
+    assert subnet.contains('2001:db8:ffff::1')
+    assert not subnet.contains('2001:db9::') and not subnet.contains('10.0.0.1')
+    assert not subnet.contains('not an ip')
+    assert subnet.overlaps_with('2001:db8:1::/48') and subnet.overlaps_with('2001::/16')
+    assert not subnet.overlaps_with('2001:db9::/32') and not subnet.overlaps_with('bad')
+
+
+def test_derived_columns_are_written_on_save(app, add_subnet):
+    subnet = add_subnet('192.168.4.0/22')
+    assert (subnet.network_cidr, subnet.ip_version) == ('192.168.4.0/22', 4)
+    assert (int(subnet.range_start), int(subnet.range_end)) == (0xC0A80400, 0xC0A807FF)
@@ -0,0 +1,56 @@
+"""Tests for subnet lookups backed by native cidr columns on PostgreSQL."""
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from app.utils.network import (find_overlapping_subnets, find_subnets_containing_ip,
+                               find_subnets_within, uses_native_cidr)
+
+
+@pytest.fixture
+def tree(add_subnet):
+    root = add_subnet('10.0.0.0/16')
+    child = add_subnet('10.0.1.0/24', parent=root)
+    leaf = add_subnet('10.0.1.128/25', parent=child)
+    other = add_subnet('10.1.0.0/24')
+    v6 = add_subnet('2001:db8::/48')
+    return root, child, leaf, other, v6
+
+
+def _cidrs(subnets):
+    return [subnet.cidr for subnet in subnets]
+
+
+def test_lookups_agree_on_every_backend(app, tree):
+    root, child, leaf, other, v6 = tree
+
+    assert _cidrs(find_overlapping_subnets('10.0.1.0', 26)) == [root.cidr, child.cidr]
+    assert find_overlapping_subnets('10.0.0.0', 8, exclude_id=root.id) == [child, leaf, other]
+    assert find_overlapping_subnets('192.168.0.0', 16) == []
+    assert find_overlapping_subnets('2001:db8:0:1::', 64) == [v6]
+
+    assert _cidrs(find_subnets_within('10.0.0.0/16')) == [root.cidr, child.cidr, leaf.cidr]
+    assert find_subnets_within('10.0.1.0/24') == [child, leaf]
+    assert find_subnets_within('not a network') == []
+
+    assert find_subnets_containing_ip('10.0.1.200') == [leaf, child, root]
+    assert find_subnets_containing_ip('10.0.1.5') == [child, root]
+    assert find_subnets_containing_ip('2001:db8::1') == [v6]
+    assert find_subnets_containing_ip('172.16.0.1') == []
+    assert find_subnets_containing_ip('bogus') == []
+
+
+def test_database_rejects_overlapping_siblings(app, add_subnet):
+    if not uses_native_cidr():
+        pytest.skip('the exclusion constraint needs PostgreSQL')
+    root = add_subnet('10.0.0.0/16')
+    child = add_subnet('10.0.0.0/24', parent=root)
+    add_subnet('10.0.0.0/25', parent=child)
+
+    with pytest.raises(IntegrityError):
+        add_subnet('10.0.0.128/25', parent=root)
+    db.session.rollback()
+    with pytest.raises(IntegrityError):
+        add_subnet('10.0.0.0/8')
+    db.session.rollback()
+    add_subnet('10.0.1.0/24', parent=root)
@@ -0,0 +1,114 @@
+"""Tests for the longest-prefix-match table and IP owner lookups."""
+from sqlalchemy import delete, insert
+
+from app import db
+from app.models import Subnet
+from app.utils.cidr_batch import parse_ips
+from app.utils.interval_index import NetworkRange
+from app.utils.network import resolve_ip_owners
+from app.utils.prefix_lookup import PrefixLookupTable, prefix_table
+
+
+def _table():
+    table = PrefixLookupTable()
+    table.load([
+        (1, NetworkRange.from_cidr('10.0.0.0/8')),
+        (2, NetworkRange.from_cidr('10.1.0.0/16')),
+        (3, NetworkRange.from_cidr('10.1.2.0/24')),
+        (4, NetworkRange.from_cidr('2001:db8::/32')),
+    ])
+    return table
+
+
+def test_lookup_returns_most_specific_owner():
+    table = _table()
+    assert table.lookup('10.1.2.3') == 3
+    assert table.lookup('10.1.3.1') == 2
+    assert table.lookup('10.200.0.1') == 1
+    assert table.lookup('11.0.0.1') is None
+    assert table.lookup('2001:db8::1') == 4
+    assert table.lookup('not an ip') is None
+
+
+def test_batch_lookup_matches_single_lookups():
+    table = _table()
+    ips = ['10.1.2.255', '10.1.255.255', '10.255.255.255', '9.255.255.255', '11.0.0.0',
+           '2001:db8:ffff::1', '2001:db9::', 'bogus', '10.1.2.0']
+    owners, invalid = table.lookup_many(ips)
+    assert owners.tolist() == [3, 2, 1, -1, -1, 4, -1, -1, 3]
+    assert invalid.tolist() == [7]
+    for ip, owner in zip(ips, owners.tolist()):
+        assert (table.lookup(ip) or -1) == owner
+
+
+def test_batch_segments_follow_updates():
+    table = _table()
+    batch = parse_ips(['10.1.2.1', '10.1.5.1']).family(4)
+    assert table.lookup_batch(batch).tolist() == [3, 2]
+    table.discard(3)
+    table.upsert(5, '10.1.5.0', 24)
+    assert table.lookup_batch(batch).tolist() == [2, 5]
+
+
+def test_identical_blocks_resolve_to_newest_subnet():
+    table = PrefixLookupTable()
+    table.load([(1, NetworkRange.from_cidr('10.0.0.0/24')),
+                (2, NetworkRange.from_cidr('10.0.0.0/24'))])
+    assert table.lookup('10.0.0.1') == 2
+    table.discard(2)
+    assert table.lookup('10.0.0.1') == 1
+
+
+def test_resolve_ip_owners_follows_database_writes(app, add_subnet):
+    parent = add_subnet('192.168.0.0/16', location='DC1')
+    child = add_subnet('192.168.1.0/24', parent=parent)
+
+    results = resolve_ip_owners(['192.168.1.5', '192.168.9.1', '8.8.8.8', 'x'])
+    assert [r['subnet'] and r['subnet']['id'] for r in results] == [
+        child.id, parent.id, None, None]
+    assert [r['valid'] for r in results] == [True, True, True, False]
+
+    db.session.delete(child)
+    db.session.commit()
+    assert resolve_ip_owners(['192.168.1.5'])[0]['subnet']['id'] == parent.id
+
+
+def test_table_reloads_after_writes_made_elsewhere(app, add_subnet):
+    parent = add_subnet('172.16.0.0/12')
+    parent_id, child_id = parent.id, add_subnet('172.16.1.0/24', parent=parent).id
+    assert prefix_table.lookup('172.16.1.1') == child_id
+
+    # A Core delete skips the model events, like another process would
+    subnets = Subnet.__table__
+    db.session.execute(delete(subnets).where(subnets.c.id == child_id))
+    db.session.commit()
+
+    app.config['SUBNET_LOOKUP_CHECK_SECONDS'] = 3600
+    assert prefix_table.lookup('172.16.1.1') == child_id
+    app.config['SUBNET_LOOKUP_CHECK_SECONDS'] = 0
+    assert prefix_table.lookup('172.16.1.1') == parent_id
+
+
+def test_local_writes_do_not_rebuild_the_table(app, add_subnet, monkeypatch):
+    parent = add_subnet('172.16.0.0/12')
+    prefix_table.ensure_loaded()
+    app.config['SUBNET_LOOKUP_CHECK_SECONDS'] = 0
+    loads = []
+    load = prefix_table.load
+    monkeypatch.setattr(prefix_table, 'load', lambda *args: loads.append(args) or load(*args))
+
+    child = add_subnet('172.16.1.0/24', parent=parent)
+    assert prefix_table.lookup('172.16.1.1') == child.id
+    child.network_address = '172.16.2.0'
+    db.session.commit()
+    owners, _ = prefix_table.lookup_many(['172.16.1.1', '172.16.2.1'])
+    assert owners.tolist() == [parent.id, child.id]
+    assert loads == []
+
+    # A write made elsewhere before a local one still forces a rebuild
+    db.session.execute(insert(Subnet.__table__).values(network_address='172.16.9.0',
+                                                       prefix_length=24))
+    db.session.commit()
+    add_subnet('172.16.3.0/24', parent=parent)
+    assert prefix_table.lookup('172.16.9.1') not in (None, parent.id)
+    assert len(loads) == 1
@@ -0,0 +1,102 @@
+"""Tests for the column-projecting list serializers."""
+import json
+from datetime import date
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import event
+
+from app import db
+from app.models import Assignment, Customer, Subnet
+from app.utils.serializers import (assignment_serializer, customer_serializer, dumps,
+                                   parse_fields, subnet_serializer)
+
+
+@pytest.fixture
+def statements(app):
+    """SELECT statements run while the test body executes."""
+    seen = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            seen.append(statement)
+
+    engine = db.engine
+    event.listen(engine, 'before_cursor_execute', record)
+    yield seen
+    event.remove(engine, 'before_cursor_execute', record)
+
+
+def _assign(customer, subnet):
+    assignment = Assignment(subnet_id=subnet.id, customer_id=customer.id, price=12.5,
+                            currency='EUR', start_date=date(2025, 1, 1), status='active')
+    db.session.add(assignment)
+    db.session.commit()
+    return assignment
+
+
+def test_subnet_fields_match_to_dict(app, add_subnet):
+    add_subnet('10.0.0.0/24', location='IST', vlan_id=10)
+    add_subnet('2001:db8::/64')
+
+    items = subnet_serializer.serialize(Subnet.query.order_by(Subnet.id))
+    assert items == [subnet.to_dict() for subnet in Subnet.query.order_by(Subnet.id)]
+
+
+def test_sparse_fieldset_selects_only_its_columns(app, add_subnet, statements):
+    add_subnet('10.0.0.0/24')
+
+    items = subnet_serializer.serialize(fields=['id', 'cidr', 'id'])
+    assert items == [{'id': 1, 'cidr': '10.0.0.0/24'}]
+    assert len(statements) == 1
+    assert 'description' not in statements[0]
+
+
+def test_unknown_field_is_rejected(app):
+    with pytest.raises(ValueError, match='unknown fields: bogus'):
+        subnet_serializer.field_names(['id', 'bogus'])
+    with pytest.raises(TypeError):
+        subnet_serializer.serialize(query='subnets')
+
+
+def test_joined_and_batch_fields_cost_one_query_each(app, add_subnet, customer, statements):
+    _assign(customer, add_subnet('10.0.0.0/24', status='assigned'))
+    _assign(customer, add_subnet('10.0.1.0/30', status='assigned'))
+    statements.clear()
+
+    items = assignment_serializer.serialize(Assignment.query.order_by(Assignment.id),
+                                            fields=['subnet_cidr', 'customer_name', 'price'])
+    assert items == [
+        {'subnet_cidr': '10.0.0.0/24', 'customer_name': 'Acme', 'price': 12.5},
+        {'subnet_cidr': '10.0.1.0/30', 'customer_name': 'Acme', 'price': 12.5},
+    ]
+    assert len(statements) == 1
+
+    other = Customer(name='Idle', email='idle@example.com')
+    db.session.add(other)
+    db.session.commit()
+    statements.clear()
+    items = customer_serializer.serialize(
+        Customer.query.order_by(Customer.id),
+        fields=['name', 'active_assignments_count', 'total_assigned_ips'])
+    assert items == [
+        {'name': 'Acme', 'active_assignments_count': 2, 'total_assigned_ips': 260},
+        {'name': 'Idle', 'active_assignments_count': 0, 'total_assigned_ips': 0},
+    ]
+    assert len(statements) == 2
+
+
+def test_empty_result_skips_batch_queries(app, statements):
+    assert customer_serializer.serialize(fields=['total_assigned_ips']) == []
+    assert len(statements) == 1
+
+
+def test_parse_fields():
+    assert parse_fields(None) is None
+    assert parse_fields('') is None
+    assert parse_fields(' id, cidr ,,') == ['id', 'cidr']
+
+
+def test_dumps_handles_wide_integers_and_decimals():
+    payload = {'total': 1 << 80, 'price': Decimal('3.5'), 'day': date(2025, 1, 2)}
+    assert json.loads(dumps(payload)) == {'total': 1 << 80, 'price': 3.5, 'day': '2025-01-02'}
@@ -0,0 +1,99 @@
+"""Tests for subdividing subnets eagerly, in bulk and lazily."""
+import pytest
+
+from app.models import Assignment, AuditLog, Subnet
+from app.utils.network import (allocate_child_subnet, allocate_subnets_batch,
+                               auto_subdivide_subnet, materialize_virtual_child)
+
+
+def _children(parent):
+    return Subnet.query.filter_by(parent_subnet_id=parent.id).order_by(Subnet.range_start).all()
+
+
+def test_eager_and_bulk_modes_create_the_same_children(app, add_subnet, counters):
+    eager = add_subnet('10.0.0.0/22', location='IST')
+    bulk = add_subnet('10.1.0.0/22', location='IST')
+
+    assert len(auto_subdivide_subnet(eager.id, 24)) == 4
+    created = auto_subdivide_subnet(bulk.id, 24, mode='bulk')
+    assert [child['cidr'] for child in created] == [f'10.1.{i}.0/24' for i in range(4)]
+
+    for parent in (eager, bulk):
+        assert (parent.status, parent.is_subdivided) == ('reserved', True)
+        children = _children(parent)
+        assert [child.prefix_length for child in children] == [24] * 4
+        assert {(child.status, child.location) for child in children} == {('available', 'IST')}
+    assert counters()[bulk.id] == counters()[eager.id] == (0, 0, 1024)
+
+
+def test_bulk_subdivision_is_audited_with_one_entry(app, add_subnet, logged_in):
+    parent = add_subnet('10.0.0.0/22')
+    AuditLog.query.delete()
+
+    auto_subdivide_subnet(parent.id, 24, mode='bulk')
+    entries = AuditLog.query.all()
+    assert [(entry.action, entry.entity_id, entry.user_id) for entry in entries] == [
+        ('subdivide', parent.id, logged_in.id)]
+    assert entries[0].details == 'Subdivided 10.0.0.0/22 into 4 /24 subnets'
+
+
+def test_invalid_targets_create_nothing(app, add_subnet):
+    parent = add_subnet('10.0.0.0/24')
+    assert auto_subdivide_subnet(parent.id, 24) == []
+    assert auto_subdivide_subnet(parent.id, 33) == []
+    assert auto_subdivide_subnet(-1, 25) == []
+    assert _children(parent) == []
+
+
+def test_oversized_splits_raise_unless_lazy(app, add_subnet):
+    parent = add_subnet('10.0.0.0/8')
+    for mode in ('eager', 'bulk'):
+        with pytest.raises(ValueError):
+            auto_subdivide_subnet(parent.id, 32, mode=mode)
+    assert _children(parent) == []
+    assert auto_subdivide_subnet(parent.id, 32, mode='lazy') == []
+    assert parent.virtual_child_prefix == 32
+
+
+def test_lazy_children_are_materialized_on_demand(app, add_subnet):
+    parent = add_subnet('10.0.0.0/16')
+    assert auto_subdivide_subnet(parent.id, 24, mode='lazy') == []
+    assert (parent.virtual_child_prefix, parent.status) == (24, 'reserved')
+    assert _children(parent) == []
+
+    child = materialize_virtual_child(parent.id, '10.0.7.0/24')
+    assert child.parent_subnet_id == parent.id
+    assert child.description.endswith('#8')
+    assert materialize_virtual_child(parent.id, '10.0.7.0/24').id == child.id
+    assert materialize_virtual_child(parent.id, '10.0.7.0/25') is None
+    assert materialize_virtual_child(parent.id, '10.1.0.0/24') is None
+
+
+def test_allocating_in_a_lazy_parent_materializes_a_virtual_child(app, add_subnet):
+    parent = add_subnet('10.0.0.0/16')
+    auto_subdivide_subnet(parent.id, 24, mode='lazy')
+    materialize_virtual_child(parent.id, '10.0.0.0/24')
+
+    assert allocate_child_subnet(parent.id, 25) is None
+    assert allocate_child_subnet(parent.id, 23) is None
+    child = allocate_child_subnet(parent.id, 24, status='reserved')
+    assert (child.cidr, child.status) == ('10.0.1.0/24', 'reserved')
+    assert child.description.endswith('#2')
+
+
+def test_batch_assignment_in_a_lazy_parent_materializes_virtual_children(app, add_subnet,
+                                                                         customer):
+    parent = add_subnet('10.0.0.0/16')
+    auto_subdivide_subnet(parent.id, 24, mode='lazy')
+
+    result = allocate_subnets_batch([{'prefix': 25, 'price': 1}], customer_id=customer.id,
+                                    parent_subnet_id=parent.id)
+    assert not result['success']
+    result = allocate_subnets_batch([{'prefix': 24, 'price': 1, 'count': 2}],
+                                    customer_id=customer.id, parent_subnet_id=parent.id)
+    assert [placement['cidr'] for placement in result['allocations']] == [
+        '10.0.0.0/24', '10.0.1.0/24']
+    children = _children(parent)
+    assert [(child.cidr, child.status) for child in children] == [
+        ('10.0.0.0/24', 'assigned'), ('10.0.1.0/24', 'assigned')]
+    assert Assignment.query.count() == 2
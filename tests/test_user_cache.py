@@ -0,0 +1,75 @@
+"""Tests for the cached user loader."""
+from app import db
+from app.models import User, load_user
+from app.utils.user_cache import UserCache, user_cache
+
+
+def _count_queries(monkeypatch):
+    calls = []
+    execute = db.session.execute
+
+    def counting(*args, **kwargs):
+        calls.append(args[0])
+        return execute(*args, **kwargs)
+    monkeypatch.setattr(db.session, 'execute', counting)
+    return calls
+
+
+def test_load_user_is_served_from_cache(app, user, monkeypatch):
+    calls = _count_queries(monkeypatch)
+
+    first = load_user(str(user.id))
+    second = load_user(str(user.id))
+    assert (first.username, first.is_active) == ('operator', True)
+    assert second.id == user.id
+    assert len(calls) == 1
+    assert load_user('999') is None
+
+
+def test_zero_ttl_disables_cache(app, user, monkeypatch):
+    app.config['USER_CACHE_SECONDS'] = 0
+    calls = _count_queries(monkeypatch)
+
+    load_user(str(user.id))
+    load_user(str(user.id))
+    assert len(calls) == 2
+
+
+def test_updates_invalidate_cached_user(app, user):
+    assert load_user(str(user.id)).is_admin is False
+
+    user.is_admin = True
+    db.session.commit()
+    assert load_user(str(user.id)).is_admin is True
+
+    db.session.delete(user)
+    db.session.commit()
+    assert load_user(str(user.id)) is None
+
+
+def test_load_racing_an_invalidation_is_not_stored(app, user, monkeypatch):
+    cache = UserCache()
+    execute = db.session.execute
+
+    def invalidate_midway(*args, **kwargs):
+        cache.invalidate([user.id])
+        return execute(*args, **kwargs)
+
+    monkeypatch.setattr(db.session, 'execute', invalidate_midway)
+    assert cache.load(user.id, 60)['username'] == 'operator'
+    assert cache._entries == {}
+    monkeypatch.undo()
+
+    cache.load(user.id, 60)
+    assert user.id in cache._entries
+    cache.invalidate()
+    assert cache._entries == {}
+
+
+def test_loaded_user_can_be_attached_to_session(app, user):
+    user_cache.invalidate()
+    loaded = load_user(str(user.id))
+    loaded = db.session.merge(loaded)
+    loaded.email = 'ops@example.com'
+    db.session.commit()
+    assert db.session.get(User, user.id).email == 'ops@example.com'